@@ -0,0 +1,109 @@
+import os
+import random
+
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+# Fixtures sintéticas e determinísticas para os benchmarks: faturas que imitam cada layout tratado
+# pelas funções _extrair_dados_layout_*, fotos de celular e os dados de um projeto típico.
+
+# nome do layout: (distribuidora, linhas de texto da fatura)
+LAYOUTS_FATURA = {
+    'rge_adriano': ('RGE', [
+        'Inscrição no CNPJ: 02.016.440/0001-62', 'JOAO DA SILVA', 'R DAS FLORES 123', 'CENTRO',
+        '95000-000 CAXIAS DO SUL RS', 'Pelo CPF: 123.456.789-00', 'CPF: 123.456.789-00', 'UC: 3080123456',
+        'TENSÃO NOMINAL EM VOLTS Disp.: 220', 'Classificação: B1 Residencial Tipo de Fornecimento: Bifásico',
+    ]),
+    'rge_adroaldo': ('RGE', [
+        'Inscrição no CNPJ: 02.016.440/0001-62', 'MARIA DOS SANTOS', 'AV BRASIL 45', 'SAO PELEGRINO',
+        '95010-000 CAXIAS DO SUL RS', 'CPF: ******.789-**', 'Lim. máx.: 10 3080654321',
+        'TENSÃO NOMINAL EM VOLTS Disp.: 380', 'Classificação: B2 Rural',
+    ]),
+    'rge_arcindo': ('RGE', [
+        'DANFE - DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRÔNICA', 'CÓDIGO DA UNIDADE CONSUMIDORA: 3080999999',
+        'ARCINDO PEREIRA', 'RUA CENTRAL 10', 'INTERIOR', '95500-000 SANTO ANTONIO - RS', 'CPF: ******.111-**',
+        'TENSÃO NOMINAL EM VOLTS Disp.: 220', 'Classificação: B1 Residencial', '3080999999', '1/2',
+    ]),
+    'cooperluz_cod_ua': ('COOPERLUZ', [
+        'Classificação: B1 Residencial', 'Tipo de Fornecimento: Trifásico', 'MARIA SOUZA', 'COD UA 123 LEITURAS',
+        'INTERIOR / SAO PEDRO-RS', 'Proxima Leitura', 'LINHA SAO JOAO 100 DATAS DE', 'CPF/CNPJ: 123.456.789-00',
+        'CEP: 98 400-000 12345-6',
+    ]),
+    'cooperluz_sem_cod_ua': ('COOPERLUZ', [
+        'Classificação: B2 Rural', 'Tipo de Fornecimento: Monofásico', 'PEDRO ALVES', 'Leitura anterior',
+        'LEITURAS', 'INTERIOR / CAMPINA-RS', 'Proxima Leitura', 'ESTRADA GERAL 5 DATAS DE',
+        'CPF/CNPJ: 987.654.321-00', 'CEP: 98 500-000', 'UNIDADE CONSUMIDORA', 'Rota: 3, Sequência: 7 55555-1',
+    ]),
+    'certhil': ('CERTHIL', [
+        'Classificação: B1 Comercial', 'Tipo de Fornecimento: Bifásico', 'LOJA BOA VISTA', 'DATAS DE',
+        'UNIDADE CONSUMIDORA', 'RURAL / TRES DE MAIO-RS', 'Proxima Leitura', 'RUA XV 12 DATAS DE',
+        'CPF/CNPJ: 12.345.678/0001-90', 'CEP: 98 910-000', 'UC: 77777-8',
+    ]),
+}
+
+# Texto de "enchimento" (tabelas de consumo, avisos) para que a página tenha o volume de uma fatura real
+_LINHAS_ENCHIMENTO = [
+    'HISTÓRICO DE CONSUMO kWh  JAN 312  FEV 298  MAR 305  ABR 287  MAI 276  JUN 265',
+    'Energia Ativa Fornecida TE   kWh   300   0,312450   93,74',
+    'Energia Ativa Fornecida TUSD kWh   300   0,421870  126,56',
+    'Contribuição de Iluminação Pública   18,90',
+    'Bandeira tarifária vigente: VERDE. Consulte www.aneel.gov.br',
+]
+
+DADOS_PROJETO_BASE = {
+    'Nome_Razao_Social': 'JOAO DA SILVA', 'CNPJ_CPF': '123.456.789-00', 'Endereco_Rua_Numero': 'R DAS FLORES 123',
+    'Bairro': 'CENTRO', 'Cidade': 'CAXIAS DO SUL', 'Estado': 'RS', 'CEP': '95000-000', 'UC': '3080123456',
+    'Classe_Tarifaria': 'Residencial', 'Grupo_Tarifario': 'B1', 'Tensao_Nominal_V': 220,
+    'E-MAIL': 'cliente@example.com', 'TELEFONE': '54999999999', 'LATITUDE': -29.1678, 'LONGITUDE': -51.1794,
+    'CARGA_INSTALADA': 10.0, 'CATEGORIA': 'GED 13 - B3', 'TIPO_DE_ATENDIMENTO': 'Aéreo', 'TIPO_DE_CAIXA': 'Tipo A',
+    'ISOLACAO': 'PVC', 'POTENCIA_MODULO_MANUAL': 550.0, 'FABRICANTE_MODULO_MANUAL': 'Canadian',
+    'QUANTIDADE_PLACAS_MANUAL': 10, 'MODELO_MODULO_CALCULADO': 'CS6W-550MS', 'AREA_ARRANJOS_CALCULADO': 25.8,
+    'POTENCIA_INVERSOR_MANUAL': 5.0, 'FABRICANTE_INVERSOR_MANUAL': 'Growatt', 'QUANTIDADE_INVERSOR_MANUAL': 1,
+    'MODELO_INVERSOR_CALCULADO': 'MIN 5000TL-X', 'INMETRO': '004521/2022', 'ISOLACAO_CA': 'PVC 750V',
+    'ART': 1234567, 'DATA_ART': '02/01/2025',
+}
+
+
+def gerar_faturas_pdf(pasta):
+    os.makedirs(pasta, exist_ok=True)
+    caminhos = {}
+    for nome, (_, linhas) in LAYOUTS_FATURA.items():
+        caminho = os.path.join(pasta, f"{nome}.pdf")
+        c = canvas.Canvas(caminho, pagesize=A4, invariant=1)
+        y = 800
+        for linha in linhas:
+            c.drawString(50, y, linha)
+            y -= 18
+        y -= 20
+        for repeticao in range(4):
+            for linha in _LINHAS_ENCHIMENTO:
+                c.drawString(50, y, linha)
+                y -= 14
+        # Moldura e grade de tabela: a fatura real tem muitos traços que o modo rápido ignora
+        for i in range(40):
+            c.line(40, 60 + i * 10, 555, 60 + i * 10)
+        c.rect(30, 30, 535, 780)
+        c.save()
+        caminhos[nome] = caminho
+    return caminhos
+
+
+def gerar_foto_jpeg(caminho, largura=4000, altura=3000, semente=0):
+    # Ruído + gradiente: comprime mal como uma foto real (pior caso para o PDF de fotos)
+    aleatorio = random.Random(semente)
+    ruido = Image.frombytes('L', (largura // 4, altura // 4), aleatorio.randbytes((largura // 4) * (altura // 4)))
+    ruido = ruido.resize((largura, altura))
+    gradiente = Image.linear_gradient('L').resize((largura, altura))
+    imagem = Image.merge('RGB', (ruido, gradiente, Image.blend(ruido, gradiente, 0.5)))
+    imagem.save(caminho, 'JPEG', quality=92)
+    return caminho
+
+
+def dados_projeto(extrator, distributor_type):
+    dados = dict(DADOS_PROJETO_BASE)
+    dados['distributor_type'] = distributor_type
+    extrator.preparar_dados_projeto(dados)
+    if distributor_type != 'RGE':
+        extrator._preparar_dados_cooperativas(dados)
+    return dados
@@ -0,0 +1,107 @@
+import argparse
+import difflib
+import io
+import os
+import random
+import sys
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+PASTA_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+PASTA_REPOSITORIO = os.path.dirname(PASTA_BENCHMARKS)
+sys.path.insert(0, PASTA_REPOSITORIO)
+
+import fixtures
+
+# Diferencial entre os motores de texto: o texto do pdfium tem que sair igual ao do pdfplumber (a referência)
+# antes de o pdfium virar o motor de alguma distribuidora. As páginas imitam o que as faturas reais fazem e
+# as fixtures de uma coluna não exercitam: duas ou três colunas, tamanhos de fonte diferentes, linhas de uma
+# coluna alguns pontos acima ou abaixo das da outra e texto desenhado com "/F 1 Tf" e a escala na matriz de texto.
+# Termina com código 1 se alguma página sair diferente.
+#
+# Uso:
+#   python benchmarks/motores_texto_diferencial.py
+#   python benchmarks/motores_texto_diferencial.py --paginas 500 --semente 7
+
+COLUNAS_X = (40, 230, 400)
+LARGURA_PAGINA = 560
+# Espaço mínimo entre o fim de uma coluna e o início da próxima (as colunas de uma fatura não se sobrepõem)
+MARGEM_COLUNA = 12
+TAMANHOS_FONTE = (6, 7, 8, 9, 10, 12, 14)
+
+
+def _escrever(pdf, x, y, texto, tamanho, escala_na_matriz):
+    objeto = pdf.beginText()
+    if escala_na_matriz:
+        objeto.setFont('Helvetica', 1)
+        objeto.setTextTransform(tamanho, 0, 0, tamanho, x, y)
+    else:
+        objeto.setFont('Helvetica', tamanho)
+        objeto.setTextOrigin(x, y)
+    objeto.textOut(texto)
+    pdf.drawText(objeto)
+
+
+def _caber(texto, tamanho, largura):
+    while texto and stringWidth(texto, 'Helvetica', tamanho) > largura:
+        texto = texto[:-1]
+    return texto.rstrip()
+
+
+def gerar_pagina(aleatorio):
+    # Linhas das fixtures espalhadas em colunas; cada coluna tem o seu deslocamento vertical e tamanho de fonte
+    linhas = [linha for _, linhas_layout in fixtures.LAYOUTS_FATURA.values() for linha in linhas_layout]
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    colunas = COLUNAS_X[:aleatorio.choice((2, 3))]
+    deslocamentos = [aleatorio.uniform(-2.5, 2.5) for _ in colunas]
+    escala_na_matriz = aleatorio.random() < 0.7
+    y = 800
+    while True:
+        celulas = [(coluna, x, aleatorio.choice(TAMANHOS_FONTE)) for coluna, x in enumerate(colunas)
+                   if not coluna or aleatorio.random() >= 0.4]
+        # A linha de base desce o corpo da maior fonte da linha: uma linha não invade a de cima (as faturas não
+        # sobrepõem texto; com texto repetido por cima o pdfium descarta as cópias e o pdfplumber as embaralha)
+        y -= max(tamanho for _, _, tamanho in celulas)
+        if y < 60:
+            break
+        for coluna, x, tamanho in celulas:
+            fim_coluna = colunas[coluna + 1] if coluna + 1 < len(colunas) else LARGURA_PAGINA
+            texto = _caber(aleatorio.choice(linhas), tamanho, fim_coluna - x - MARGEM_COLUNA)
+            _escrever(pdf, x, y + deslocamentos[coluna], texto, tamanho, escala_na_matriz)
+        y -= aleatorio.choice((2, 4, 6))
+    pdf.save()
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compara o texto do pdfium com o do pdfplumber em páginas de várias colunas.')
+    parser.add_argument('--paginas', type=int, default=200, help='Quantidade de páginas geradas')
+    parser.add_argument('--semente', type=int, default=1, help='Semente do gerador (as páginas são determinísticas)')
+    parser.add_argument('--mostrar', type=int, default=3, help='Quantas diferenças imprimir')
+    args = parser.parse_args(argv)
+
+    os.environ['EXTRACTION_CACHE_ENABLED'] = '0'
+    import extrator_solar_web as extrator
+
+    aleatorio = random.Random(args.semente)
+    diferentes = 0
+    for pagina in range(args.paginas):
+        conteudo_pdf = gerar_pagina(aleatorio)
+        texto_referencia = extrator.extrair_texto_pdfplumber(conteudo_pdf)
+        texto_pdfium = extrator.extrair_texto_pdfium(conteudo_pdf)
+        if texto_pdfium == texto_referencia:
+            continue
+        diferentes += 1
+        if diferentes <= args.mostrar:
+            print(f"Página {pagina}:")
+            print('\n'.join(difflib.unified_diff(texto_referencia.splitlines(), texto_pdfium.splitlines(),
+                                                 'pdfplumber', 'pdfium', lineterm='', n=1)))
+    print(f"{args.paginas} páginas, {diferentes} com texto diferente entre pdfplumber e pdfium.")
+    return 1 if diferentes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
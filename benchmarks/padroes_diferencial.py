@@ -0,0 +1,136 @@
+import argparse
+import os
+import re
+import sys
+
+PASTA_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+PASTA_REPOSITORIO = os.path.dirname(PASTA_BENCHMARKS)
+sys.path.insert(0, PASTA_REPOSITORIO)
+
+import fixtures
+import padroes_fatura
+
+# Diferencial dos extratores _extrair_dados_layout_* contra as regex originais (anteriores a padroes_fatura),
+# nos casos em que um limite de distância ou de janela pode perder um campo que a regex original encontrava:
+# linhas de enchimento entre o rótulo e o valor (Tipo de Fornecimento -> fase; LEITURAS/UNIDADE CONSUMIDORA ->
+# linha INTERIOR/RURAL) e o nome do cliente impresso também no alto da página, antes do cabeçalho (endereço da RGE).
+# As regex originais rodam sobre o mesmo texto preparado (TextoFatura) que os extratores recebem.
+# Termina com código 1 se algum campo sair diferente.
+#
+# Uso:
+#   python benchmarks/padroes_diferencial.py
+#   python benchmarks/padroes_diferencial.py --linhas 200
+
+_RUA_NUMERO_ORIGINAL = r'((?:R|AV|EST|ROD|AL|TV|PR|TR|VD|RUA|VL|PRC|PCA)\s+[A-Z\s,.-]+?\s*\d+\s*(?:[A-Z0-9\s,.-]+)?)'
+_NOME_CNPJ_ORIGINAL = r'Inscrição no CNPJ: \d{2}\.\d{3}\.\d{3}\/\d{4}-\d{2}\n+([A-Z\s,.]+)\n'
+_NOME_ARCINDO_ORIGINAL = r'CÓDIGO DA UNIDADE CONSUMIDORA:\s*\d+\n([A-Z\s]+)\n'
+_UF_RGE = r'\s+(RS)'
+_UF_ARCINDO = r'\s*-\s*(RS)'
+_CAMPOS_ENDERECO = ('Endereco_Rua_Numero', 'Bairro', 'CEP', 'Cidade', 'Estado')
+
+
+def _endereco_original(texto, padrao_nome, uf):
+    match_nome = re.search(padrao_nome, texto)
+    if not match_nome:
+        return {}
+    nome = match_nome.group(1).strip()
+    match = re.search(re.escape(nome) + r'.*?' + _RUA_NUMERO_ORIGINAL + r'\n([A-Z\s,.-]+)\n(\d{5}-\d{3})\s+([A-Z\s,.-]+)' + uf,
+                      texto, re.DOTALL)
+    if not match:
+        return {}
+    return {campo: match.group(grupo).strip() for grupo, campo in enumerate(_CAMPOS_ENDERECO, 1)}
+
+
+def _tensao_original(texto):
+    match = re.search(r'Tipo de Fornecimento:\s*(?:[\s\S]*?)(Monofásico|Bifásico|Trifásico)', texto, re.IGNORECASE | re.DOTALL)
+    if not match:
+        return {}
+    return {'Tensao_Nominal_V': 380 if 'Trifásico' in match.group(1) else 220}
+
+
+def _interior_original(padrao, bairro_fixo=None):
+    def referencia(texto):
+        match = re.search(padrao, texto, re.DOTALL)
+        if not match:
+            return {}
+        return {'Bairro': bairro_fixo or match.group(1).strip(), 'Cidade': match.group(2).strip(),
+                'Estado': match.group(3).strip()}
+    return referencia
+
+
+# caso: (layout das fixtures, nome do extrator, referência original, linha depois da qual entra o enchimento,
+#        linha antes da qual o nome é repetido no alto da página (ou None))
+CASOS = {
+    'tensao_cooperluz_cod_ua': ('cooperluz_cod_ua', '_extrair_dados_layout_cooperluz_sublayout_com_cod_ua',
+                                _tensao_original, 'Tipo de Fornecimento:', None),
+    'tensao_cooperluz_sem_cod_ua': ('cooperluz_sem_cod_ua', '_extrair_dados_layout_cooperluz_sublayout_sem_cod_ua',
+                                    _tensao_original, 'Tipo de Fornecimento:', None),
+    'tensao_certhil': ('certhil', '_extrair_dados_layout_coop_similar_style', _tensao_original, 'Tipo de Fornecimento:', None),
+    'interior_cooperluz_cod_ua': ('cooperluz_cod_ua', '_extrair_dados_layout_cooperluz_sublayout_com_cod_ua', _interior_original(
+        r'COD UA \d+ LEITURAS.*?\n\s*(INTERIOR / ([A-Za-zÀ-ÖØ-öø-ÿ\s,.-]+))-([A-Z]{2})', 'INTERIOR'), 'COD UA', None),
+    'interior_cooperluz_sem_cod_ua': ('cooperluz_sem_cod_ua', '_extrair_dados_layout_cooperluz_sublayout_sem_cod_ua', _interior_original(
+        r'LEITURAS.*?\n\s*(INTERIOR / ([A-Za-zÀ-ÖØ-öø-ÿ\s,.-]+))-([A-Z]{2})', 'INTERIOR'), 'LEITURAS', None),
+    'interior_certhil': ('certhil', '_extrair_dados_layout_coop_similar_style', _interior_original(
+        r'(?:LEITURAS|UNIDADE CONSUMIDORA).*?\n\s*(RURAL|INTERIOR)\s*/\s*([A-Za-zÀ-ÖØ-öø-ÿ\s,.-]+)-([A-Z]{2})'),
+        'UNIDADE CONSUMIDORA', None),
+    'endereco_rge_adriano': ('rge_adriano', '_extrair_dados_layout_adriano_style',
+                             lambda texto: _endereco_original(texto, _NOME_CNPJ_ORIGINAL, _UF_RGE), None, 'Inscrição no CNPJ:'),
+    'endereco_rge_adroaldo': ('rge_adroaldo', '_extrair_dados_layout_adroaldo_style',
+                              lambda texto: _endereco_original(texto, _NOME_CNPJ_ORIGINAL, _UF_RGE), None, 'Inscrição no CNPJ:'),
+    'endereco_rge_arcindo': ('rge_arcindo', '_extrair_dados_layout_arcindo_style',
+                             lambda texto: _endereco_original(texto, _NOME_ARCINDO_ORIGINAL, _UF_ARCINDO), None, 'DANFE'),
+}
+
+
+def _nome_cliente(linhas):
+    # Linha do nome nas fixtures da RGE: a primeira depois do cabeçalho só com letras
+    return next(linha for linha in linhas[1:] if re.fullmatch(r'[A-Z ]+', linha))
+
+
+def montar_texto(layout, depois_de, antes_de, quantidade):
+    _, linhas = fixtures.LAYOUTS_FATURA[layout]
+    enchimento = [fixtures._LINHAS_ENCHIMENTO[i % len(fixtures._LINHAS_ENCHIMENTO)] for i in range(quantidade)]
+    resultado = []
+    for linha in linhas:
+        if antes_de and linha.startswith(antes_de):
+            # O nome do cliente também aparece no alto da página, seguido de outras linhas
+            resultado += [_nome_cliente(linhas)] + enchimento
+        if depois_de and linha.startswith(depois_de):
+            # "Tipo de Fornecimento: Trifásico" vira o rótulo, o enchimento e a fase na linha de baixo
+            rotulo, _, resto = linha.partition(depois_de) if depois_de == 'Tipo de Fornecimento:' else (linha, '', '')
+            resultado += [rotulo + depois_de if resto else linha] + enchimento + ([resto.strip()] if resto.strip() else [])
+            continue
+        resultado.append(linha)
+    return '\n'.join(resultado)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compara os extratores com as regex originais em casos de distância entre rótulo e valor.')
+    parser.add_argument('--linhas', type=int, default=60, help='Máximo de linhas de enchimento entre o rótulo e o valor')
+    args = parser.parse_args(argv)
+
+    os.environ['EXTRACTION_CACHE_ENABLED'] = '0'
+    import extrator_solar_web as extrator
+
+    falhas = 0
+    total = 0
+    for nome_caso, (layout, nome_extrator, referencia, depois_de, antes_de) in CASOS.items():
+        extrair = getattr(extrator, nome_extrator)
+        if nome_extrator.endswith('coop_similar_style'):
+            extrair = (lambda funcao: lambda texto: funcao(texto, 'CERTHIL'))(extrair)
+        for quantidade in range(args.linhas + 1):
+            texto = padroes_fatura.TextoFatura(montar_texto(layout, depois_de, antes_de, quantidade))
+            esperado = referencia(texto)
+            obtido = extrair(texto)
+            total += 1
+            diferencas = {campo: (valor, obtido.get(campo)) for campo, valor in esperado.items() if obtido.get(campo) != valor}
+            if not esperado or diferencas:
+                falhas += 1
+                print(f"FALHA {nome_caso} com {quantidade} linha(s): "
+                      f"{diferencas or 'a regex original não encontrou o campo (caso mal montado)'}")
+    print(f"{total} textos comparados, {falhas} falha(s).")
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+PASTA_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+PASTA_REPOSITORIO = os.path.dirname(PASTA_BENCHMARKS)
+sys.path.insert(0, PASTA_REPOSITORIO)
+
+import fixtures
+import padroes_fatura
+
+# Regressão de pior caso dos padrões de padroes_fatura e dos extratores _extrair_dados_layout_*.
+# Cada texto adversarial repete n vezes um trecho que faz um padrão com ".*?" ou repetições vizinhas
+# ilimitadas retroceder (âncora sem o resto do campo, maiúsculas sem quebra de linha, ...). O mesmo texto
+# é medido com n e com fator * n unidades: se o tempo crescer mais do que linearmente (com folga para o
+# ruído da medição) ou se um extrator passar do orçamento de tempo, o script termina com código 1.
+#
+# Uso:
+#   python benchmarks/regex_adversarial.py
+#   python benchmarks/regex_adversarial.py --unidades 2000 --fator 8 --saida adversarial.json
+
+FOLGA_LINEAR = 2.0
+# Tempos abaixo disso são ruído de medição: a razão entre dois tempos minúsculos não diz nada
+PISO_SEGUNDOS = 0.0005
+REPETICOES = 3
+
+_CABECALHO_RGE = 'Inscrição no CNPJ: 02.016.440/0001-62\nJOAO DA SILVA\n'
+
+# nome: função que recebe n e devolve o texto
+TEXTOS_ADVERSARIAIS = {
+    'cabecalhos_rge_sem_cpf': lambda n: 'Inscrição no CNPJ: 02.016.440/0001-62\nJOAO DA SILVA\n' * n,
+    'endereco_sem_quebra': lambda n: _CABECALHO_RGE + 'R ' + 'A 1 ' * n,
+    'endereco_sem_cep': lambda n: _CABECALHO_RGE + 'R DAS FLORES 123\n' + 'CENTRO\n' * n,
+    'maiusculas_sem_fim': lambda n: 'CÓDIGO DA UNIDADE CONSUMIDORA: 3080999999\n' + 'ABC DEF ' * n,
+    'tipo_fornecimento_repetido': lambda n: 'Tipo de Fornecimento: ' * n,
+    'fase_e_linhas_maiusculas': lambda n: 'Monofásico\n' + 'MARIA SOUZA\n' * n,
+    'leituras_repetidas': lambda n: 'COD UA 123 LEITURAS\n' * n,
+    'interior_sem_uf': lambda n: 'LEITURAS\nINTERIOR / ' + 'SAO PEDRO ' * n,
+    'r_r_r': lambda n: 'R ' * n,
+    'quebras_de_linha': lambda n: '\n' * n,
+    'digitos': lambda n: 'Lim. máx.: ' + '1' * n,
+    'fatura_real_repetida': lambda n: '\n'.join(linha for _, linhas in fixtures.LAYOUTS_FATURA.values() for linha in linhas)
+                                      * max(1, n // 50),
+}
+
+
+def _padroes():
+    return {nome: valor for nome, valor in vars(padroes_fatura).items()
+            if nome.isupper() and hasattr(valor, 'search')}
+
+
+def _extratores(extrator):
+    return {
+        nome: (lambda texto, funcao=funcao: funcao(texto, 'CERTHIL')) if nome.endswith('coop_similar_style') else funcao
+        for nome, funcao in vars(extrator).items() if nome.startswith('_extrair_dados_layout_')
+    }
+
+
+def medir(operacao, texto):
+    melhor = None
+    for _ in range(REPETICOES):
+        inicio = time.perf_counter()
+        operacao(texto)
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return melhor
+
+
+def verificar(nome, operacao, texto_pequeno, texto_grande, fator, limite_absoluto=None):
+    t_pequeno = medir(operacao, texto_pequeno)
+    t_grande = medir(operacao, texto_grande)
+    razao = t_grande / max(t_pequeno, PISO_SEGUNDOS)
+    falhas = []
+    if t_grande > PISO_SEGUNDOS and razao > fator * FOLGA_LINEAR:
+        falhas.append(f"cresce mais que linear ({razao:.1f}x para {fator}x o texto)")
+    if limite_absoluto is not None and t_grande > limite_absoluto:
+        falhas.append(f"passou do orçamento ({t_grande:.3f} s > {limite_absoluto} s)")
+    return {'nome': nome, 'pequeno_s': round(t_pequeno, 6), 'grande_s': round(t_grande, 6),
+            'razao': round(razao, 2), 'falhas': falhas}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pior caso dos padrões de extração de faturas com textos adversariais.')
+    parser.add_argument('--unidades', type=int, default=1000, help='Repetições do trecho adversarial no texto menor')
+    parser.add_argument('--fator', type=int, default=8, help='Quantas vezes o texto maior é maior que o menor')
+    parser.add_argument('--saida', help='Arquivo JSON de saída (padrão: só imprime)')
+    args = parser.parse_args(argv)
+
+    os.environ['EXTRACTION_CACHE_ENABLED'] = '0'
+    import extrator_solar_web as extrator
+
+    padroes = _padroes()
+    extratores = _extratores(extrator)
+    resultados = []
+    for nome_texto, gerar in TEXTOS_ADVERSARIAIS.items():
+        texto_pequeno = gerar(args.unidades)
+        texto_grande = gerar(args.unidades * args.fator)
+        # Normalização do texto, feita uma vez por fatura
+        resultados.append(verificar(f"{nome_texto}/TextoFatura", padroes_fatura.TextoFatura, texto_pequeno, texto_grande,
+                                    args.fator))
+        for nome, padrao in padroes.items():
+            resultados.append(verificar(f"{nome_texto}/{nome}", padrao.search, texto_pequeno, texto_grande, args.fator))
+        # Os extratores cortam o texto em EXTRACTION_MAX_TEXT_CHARS: além da linearidade, o tempo total
+        # de uma extração tem que caber no orçamento
+        for nome, funcao in extratores.items():
+            resultados.append(verificar(f"{nome_texto}/{nome}", funcao, texto_pequeno, texto_grande, args.fator,
+                                        padroes_fatura.EXTRACTION_TIME_BUDGET_SECONDS))
+
+    falhas = [r for r in resultados if r['falhas']]
+    for resultado in falhas:
+        print(f"FALHA {resultado['nome']}: {'; '.join(resultado['falhas'])}")
+    pior = max(resultados, key=lambda r: r['grande_s'])
+    print(f"{len(resultados)} medições, {len(falhas)} falha(s). Mais lenta: {pior['nome']} ({pior['grande_s']:.4f} s)")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({'unidades': args.unidades, 'fator': args.fator, 'resultados': resultados}, f,
+                      ensure_ascii=False, indent=2)
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
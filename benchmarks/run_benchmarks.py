@@ -0,0 +1,301 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PASTA_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+PASTA_REPOSITORIO = os.path.dirname(PASTA_BENCHMARKS)
+sys.path.insert(0, PASTA_REPOSITORIO)
+
+import fixtures
+
+# Benchmarks dos caminhos quentes da extração e da geração de documentos.
+# Cada benchmark roda num processo novo (spawn), para que o pico de RSS medido seja só dele e o
+# aquecimento dos registros de templates/caches não vaze de um benchmark para o outro.
+#
+# Uso:
+#   python benchmarks/run_benchmarks.py --iteracoes 30 --saida resultado.json
+#   python benchmarks/run_benchmarks.py --apenas extracao --comparar baseline.json --tolerancia 0.25
+
+PERCENTIS = (50, 90, 99)
+FOTOS_POR_PROJETO = 3
+
+BENCHMARKS = {}
+
+
+def benchmark(nome):
+    def registrar(preparar):
+        BENCHMARKS[nome] = preparar
+        return preparar
+    return registrar
+
+
+# --- Preparação de cada benchmark ---
+# Recebem o módulo da aplicação e a pasta de fixtures e devolvem a operação medida (sem argumentos).
+# Tudo o que não faz parte da operação (ler fixtures, montar dados) fica fora dela.
+
+def _preparar_extracao(layout, extrator, pasta_fixtures):
+    distributor_type, _ = fixtures.LAYOUTS_FATURA[layout]
+    with open(os.path.join(pasta_fixtures, f"{layout}.pdf"), 'rb') as f:
+        conteudo_pdf = f.read()
+
+    # Uma extração que deixou de achar os campos também é regressão, não só a que ficou lenta
+    dados = extrator.extrair_dados_fatura(conteudo_pdf, distributor_type, f"{layout}.pdf")
+    if 'error' in dados:
+        raise RuntimeError(f"{layout}: {dados['error']}")
+    return lambda: extrator.extrair_dados_fatura(conteudo_pdf, distributor_type, f"{layout}.pdf")
+
+for _layout in fixtures.LAYOUTS_FATURA:
+    benchmark(f"extracao_{_layout}")(
+        lambda extrator, pasta_fixtures, layout=_layout: _preparar_extracao(layout, extrator, pasta_fixtures))
+
+
+def _preparar_texto(motor, extrator, pasta_fixtures):
+    # Só a leitura do texto da página inteira, para comparar os motores entre si
+    with open(os.path.join(pasta_fixtures, 'rge_adriano.pdf'), 'rb') as f:
+        conteudo_pdf = f.read()
+    extrair_texto = extrator.MOTORES_TEXTO[motor]
+    return lambda: extrair_texto(conteudo_pdf)
+
+for _motor in ('pdfplumber', 'pdfium'):
+    benchmark(f"texto_{_motor}")(
+        lambda extrator, pasta_fixtures, motor=_motor: _preparar_texto(motor, extrator, pasta_fixtures))
+
+
+def _documentos_docx(extrator):
+    return [valor for nome, valor in vars(extrator).items()
+            if nome.startswith('DOCX_') and isinstance(valor, dict) and 'template_path' in valor]
+
+
+def _preparar_docx(prefixo_temp, extrator, pasta_fixtures):
+    documento = next(d for d in _documentos_docx(extrator) if d['prefixo_temp'] == prefixo_temp)
+    dados = fixtures.dados_projeto(extrator, 'COOPERLUZ')
+
+    def operacao():
+        replacements = {
+            placeholder: extrator.get_formatted_value_for_doc(python_var_name, dados)
+            for placeholder, python_var_name in documento['placeholders'].items()
+        }
+        extrator.replace_docx_placeholders(documento['template_path'], replacements).save(io.BytesIO())
+    return operacao
+
+
+# Os descritores DOCX_* só existem depois de importar a aplicação (no processo filho); os nomes ficam fixos aqui
+for _prefixo_temp in ('anexo_e', 'termo_aceite', 'procuracao', 'termo_aceite_inciso_iii',
+                      'responsabilidade_tecnica', 'dados_gd_ufv', 'memorial_descritivo'):
+    benchmark(f"docx_{_prefixo_temp}")(
+        lambda extrator, pasta_fixtures, prefixo_temp=_prefixo_temp: _preparar_docx(prefixo_temp, extrator, pasta_fixtures))
+
+
+@benchmark('anexo_f')
+def _preparar_anexo_f(extrator, pasta_fixtures):
+    dados = fixtures.dados_projeto(extrator, 'RGE')
+
+    def operacao():
+        workbook, indice = extrator.carregar_formulario_excel(extrator._registro_anexo_f, extrator.ANEXO_F_TEMPLATE_PATH)
+        extrator.preencher_anexo_f(workbook[extrator.ANEXO_F_SHEET_NAME], indice, dados)
+        workbook.save(io.BytesIO())
+    return operacao
+
+
+@benchmark('anexo_i')
+def _preparar_anexo_i(extrator, pasta_fixtures):
+    dados = fixtures.dados_projeto(extrator, 'RGE')
+
+    def operacao():
+        workbook, indice = extrator.carregar_formulario_excel(extrator._registro_anexo_i, extrator.ANEXO_I_TEMPLATE_PATH)
+        extrator.preencher_anexo_i(workbook[extrator.ANEXO_I_SHEET_NAME], indice, dados)
+        workbook.save(io.BytesIO())
+    return operacao
+
+
+@benchmark('pdf_fotos')
+def _preparar_pdf_fotos(extrator, pasta_fixtures):
+    fotos = []
+    for indice, titulo in enumerate(list(extrator.TITULOS_FOTOS_PDF.values())[:FOTOS_POR_PROJETO]):
+        with open(os.path.join(pasta_fixtures, f"foto_{indice}.jpg"), 'rb') as f:
+            fotos.append({'conteudo': f.read(), 'title': titulo})
+    caminho_pdf = os.path.join(pasta_fixtures, 'fotos_saida.pdf')
+    return lambda: extrator.generate_images_pdf(fotos, caminho_pdf)
+
+
+def _gerar_arquivos_projeto(extrator, pasta_fixtures, distributor_type):
+    dados = fixtures.dados_projeto(extrator, distributor_type)
+    fotos = [{'path': os.path.join(pasta_fixtures, f"foto_{indice}.jpg"), 'title': titulo}
+             for indice, titulo in enumerate(list(extrator.TITULOS_FOTOS_PDF.values())[:FOTOS_POR_PROJETO])]
+    temp_dir = tempfile.mkdtemp(prefix=extrator.JOB_TEMP_DIR_PREFIX, dir=pasta_fixtures)
+    tarefas = extrator.montar_tarefas_documentos(dados, distributor_type, temp_dir, fotos)
+    return dados, temp_dir, tarefas
+
+
+@benchmark('zip_projeto')
+def _preparar_zip_projeto(extrator, pasta_fixtures):
+    dados, temp_dir, tarefas = _gerar_arquivos_projeto(extrator, pasta_fixtures, 'RGE')
+    arquivos = extrator.gerar_documentos_projeto(tarefas)
+    pasta_raiz = extrator.nome_pasta_projeto(dados)
+    caminho_zip = os.path.join(temp_dir, 'projeto.zip')
+    return lambda: extrator.gravar_zip_projeto(arquivos, pasta_raiz, caminho_zip)
+
+
+@benchmark('projeto_completo_rge')
+def _preparar_projeto_completo(extrator, pasta_fixtures):
+    # Ponta a ponta (todos os documentos + ZIP), como o botão "Baixar Projeto"
+    def operacao():
+        dados, temp_dir, tarefas = _gerar_arquivos_projeto(extrator, pasta_fixtures, 'RGE')
+        try:
+            arquivos = extrator.gerar_documentos_projeto(tarefas)
+            extrator.gravar_zip_projeto(arquivos, extrator.nome_pasta_projeto(dados), os.path.join(temp_dir, 'projeto.zip'))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return operacao
+
+
+# --- Execução e estatísticas ---
+
+def _percentil(amostras_ordenadas, percentil):
+    # Nearest-rank: sempre devolve uma amostra real
+    indice = max(0, -(-len(amostras_ordenadas) * percentil // 100) - 1)
+    return amostras_ordenadas[indice]
+
+
+def _pico_rss_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KiB, macOS em bytes
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def executar_benchmark(nome, iteracoes, aquecimento, pasta_fixtures):
+    import extrator_solar_web as extrator
+
+    operacao = BENCHMARKS[nome](extrator, pasta_fixtures)
+    for _ in range(aquecimento):
+        operacao()
+
+    amostras = []
+    inicio_total = time.perf_counter()
+    for _ in range(iteracoes):
+        inicio = time.perf_counter()
+        operacao()
+        amostras.append((time.perf_counter() - inicio) * 1000)
+    duracao_total = time.perf_counter() - inicio_total
+
+    amostras.sort()
+    resultado = {'iteracoes': iteracoes}
+    for percentil in PERCENTIS:
+        resultado[f"p{percentil}_ms"] = round(_percentil(amostras, percentil), 3)
+    resultado.update({
+        'media_ms': round(sum(amostras) / len(amostras), 3),
+        'min_ms': round(amostras[0], 3),
+        'max_ms': round(amostras[-1], 3),
+        'throughput_ops_s': round(iteracoes / duracao_total, 2),
+        'pico_rss_mb': _pico_rss_mb(),
+    })
+    return resultado
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PASTA_REPOSITORIO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar_com_baseline(resultados, caminho_baseline, tolerancia):
+    with open(caminho_baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['benchmarks']
+    regressoes = []
+    for nome, resultado in resultados.items():
+        anterior = baseline.get(nome)
+        if not anterior or 'p50_ms' not in anterior or 'p50_ms' not in resultado:
+            continue
+        variacao = resultado['p50_ms'] / anterior['p50_ms'] - 1 if anterior['p50_ms'] else 0
+        resultado['variacao_p50'] = round(variacao, 3)
+        if variacao > tolerancia:
+            regressoes.append(f"{nome}: p50 {anterior['p50_ms']} ms -> {resultado['p50_ms']} ms (+{variacao:.0%})")
+    return regressoes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks da extração de faturas e da geração de documentos.')
+    parser.add_argument('--iteracoes', type=int, default=20, help='Iterações medidas por benchmark')
+    parser.add_argument('--aquecimento', type=int, default=2, help='Iterações descartadas antes da medição')
+    parser.add_argument('--apenas', action='append', default=[],
+                        help='Roda só os benchmarks cujo nome começa com este prefixo (pode repetir)')
+    parser.add_argument('--saida', help='Arquivo JSON de saída (padrão: só imprime)')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para detectar regressões')
+    parser.add_argument('--tolerancia', type=float, default=0.25, help='Aumento máximo aceito no p50 (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    nomes = [nome for nome in BENCHMARKS if not args.apenas or any(nome.startswith(p) for p in args.apenas)]
+    if not nomes:
+        print(f"Nenhum benchmark corresponde a {args.apenas}. Disponíveis: {', '.join(BENCHMARKS)}")
+        return 1
+
+    # A extração é medida sempre sem o cache em disco
+    os.environ['EXTRACTION_CACHE_ENABLED'] = '0'
+
+    pasta_fixtures = tempfile.mkdtemp(prefix='bench_fixtures_')
+    try:
+        fixtures.gerar_faturas_pdf(pasta_fixtures)
+        for indice in range(FOTOS_POR_PROJETO):
+            fixtures.gerar_foto_jpeg(os.path.join(pasta_fixtures, f"foto_{indice}.jpg"), semente=indice)
+
+        resultados = {}
+        contexto = multiprocessing.get_context('spawn')
+        for nome in nomes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+                try:
+                    resultados[nome] = executor.submit(
+                        executar_benchmark, nome, args.iteracoes, args.aquecimento, pasta_fixtures).result()
+                except Exception as e:
+                    resultados[nome] = {'erro': str(e)}
+            print(f"{nome}: {json.dumps(resultados[nome], ensure_ascii=False)}", file=sys.stderr)
+    finally:
+        shutil.rmtree(pasta_fixtures, ignore_errors=True)
+
+    regressoes = comparar_com_baseline(resultados, args.comparar, args.tolerancia) if args.comparar else []
+
+    relatorio = {
+        'meta': {
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'commit': _commit_atual(),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'iteracoes': args.iteracoes,
+            'aquecimento': args.aquecimento,
+        },
+        'benchmarks': resultados,
+        'regressoes': regressoes,
+    }
+    saida = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(saida + '\n')
+    print(saida)
+
+    for regressao in regressoes:
+        print(f"REGRESSÃO {regressao}", file=sys.stderr)
+    erros = [nome for nome, resultado in resultados.items() if 'erro' in resultado]
+    return 1 if regressoes or erros else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import argparse
+import io
+import os
+import sys
+
+import pdfplumber
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+PASTA_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+PASTA_REPOSITORIO = os.path.dirname(PASTA_BENCHMARKS)
+sys.path.insert(0, PASTA_REPOSITORIO)
+
+import fixtures
+
+# Diferencial da extração rápida (EXTRACTION_FAST_MODE) contra o extract_text da página inteira: as linhas das
+# fixtures são desenhadas a partir de várias alturas da página, de modo que cada linha passe por qualquer
+# fronteira de faixa que um recorte da página pudesse ter (ex.: uma linha metade acima, metade abaixo de 25%).
+# O texto e todos os campos extraídos têm que sair iguais. Termina com código 1 se algum sair diferente.
+#
+# Uso:
+#   python benchmarks/texto_rapido_diferencial.py
+#   python benchmarks/texto_rapido_diferencial.py --passo 0.5
+
+ALTURA_PAGINA = A4[1]
+ENTRELINHA = 18
+
+
+def gerar_pdf(linhas, inicio):
+    # inicio: altura (em % da página, a partir do topo) da base da primeira linha
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, invariant=1)
+    y = ALTURA_PAGINA * (1 - inicio / 100)
+    for linha in linhas:
+        pdf.drawString(50, y, linha)
+        y -= ENTRELINHA
+    pdf.save()
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compara a extração rápida com o texto da página inteira.')
+    parser.add_argument('--passo', type=float, default=1.0, help='Passo (em % da altura da página) entre as posições')
+    parser.add_argument('--mostrar', type=int, default=5, help='Quantas diferenças imprimir')
+    args = parser.parse_args(argv)
+
+    os.environ['EXTRACTION_CACHE_ENABLED'] = '0'
+    os.environ['EXTRACTION_FAST_MODE'] = '1'
+    import extrator_solar_web as extrator
+
+    diferentes = 0
+    total = 0
+    for nome_layout, (distribuidora, linhas) in fixtures.LAYOUTS_FATURA.items():
+        # Só posições em que todas as linhas cabem na página
+        ultimo_inicio = 100 * (1 - (len(linhas) * ENTRELINHA + 20) / ALTURA_PAGINA)
+        inicio = 3.0
+        while inicio <= ultimo_inicio:
+            conteudo_pdf = gerar_pdf(linhas, inicio)
+            with pdfplumber.open(io.BytesIO(conteudo_pdf)) as pdf:
+                texto_completo = pdf.pages[0].extract_text()
+            esperado = dict(extrator._extrair_dados_do_texto(texto_completo, extrator.obter_distribuidora(distribuidora), nome_layout))
+            obtido = dict(extrator.extrair_dados_fatura(conteudo_pdf, distribuidora, nome_layout))
+            texto_rapido = extrator.extrair_texto_pdfplumber(conteudo_pdf)
+            total += 1
+            diferencas = {campo: (valor, obtido.get(campo)) for campo, valor in esperado.items() if obtido.get(campo) != valor}
+            if diferencas or texto_rapido != texto_completo:
+                diferentes += 1
+                if diferentes <= args.mostrar:
+                    print(f"{nome_layout} a partir de {inicio:.1f}% da página: "
+                          f"{diferencas or 'texto rápido diferente do texto da página inteira'}")
+            inicio += args.passo
+    print(f"{total} páginas, {diferentes} com resultado diferente entre a extração rápida e a página inteira.")
+    return 1 if diferentes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
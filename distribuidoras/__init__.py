@@ -0,0 +1,21 @@
+# Distribuidoras adicionais, carregadas pelo registro de extrator_solar_web na primeira consulta.
+#
+# Cada módulo deste pacote define registrar(extrator), que recebe o módulo da aplicação e devolve a
+# declaração da distribuidora (os mesmos campos das embutidas em _registrar_distribuidoras_embutidas):
+#
+#   def registrar(extrator):
+#       return {
+#           'codigo': 'CERILUZ',
+#           'nome': 'Ceriluz',
+#           'layouts': extrator._layouts_coop_similar('CERILUZ'),
+#           'documentos': extrator.DOCUMENTOS_COOPERATIVAS,
+#           'preparar_dados': extrator._preparar_dados_cooperativas,
+#       }
+#
+# Um layout próprio declara 'nome', 'extrator' (texto -> extrator.ResultadoExtracao) e, opcionalmente,
+# 'ancoras', 'ancoras_extras' e 'assinatura' (regex compilada), como em RGE_LAYOUTS.
+# O extrator recebe o texto já normalizado (padroes_fatura.TextoFatura, uma str): NFC, um espaço entre
+# palavras, sem linhas em branco. Com padroes_fatura.BuscaFatura ele usa o orçamento de tempo da extração.
+#
+# 'motor_texto' escolhe o leitor de texto do PDF (uma das chaves de extrator.MOTORES_TEXTO; padrão:
+# EXTRACTION_TEXT_ENGINE). Se ele não preencher os campos obrigatórios, a fatura é lida pelo pdfplumber.
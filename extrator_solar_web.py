@@ -1,15 +1,51 @@
 import pdfplumber
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_raw
+from pdfplumber.page import Page as PdfplumberPage, PDFPageAggregatorWithMarkedContent
+from pdfplumber.utils.text import LIGATURES
+from pdfminer.pdfinterp import PDFPageInterpreter
+from pdfminer.fontmetrics import FONT_METRICS
 import re
 import os
 import uuid
 import tempfile
-from flask import Flask, request, render_template, redirect, url_for, session, send_file
+from flask import Flask, request, render_template, redirect, url_for, session, jsonify, Response, g
 from werkzeug.utils import secure_filename
 import json
+import csv
+import io
+import hashlib
+import threading
+import importlib
+import pkgutil
+import sys
+import subprocess
+import multiprocessing
+import signal
+import ctypes
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import openpyxl
+from openpyxl.utils.indexed_list import IndexedList
+import copy
+import bisect
+import itertools
+import math
 from datetime import datetime, timedelta
 import zipfile
 import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+import unicodedata
+from urllib.parse import quote
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import padroes_fatura
 
 # --- Import para manipulação de DOCX ---
 from docx import Document
@@ -17,7 +53,7 @@ from docx.shared import Pt
 from docx.text.run import Run
 
 # --- Import para manipulação de imagens e PDF ---
-from PIL import Image
+from PIL import Image, ImageOps
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4, portrait
 from reportlab.lib.units import cm
@@ -60,70 +96,318 @@ def format_value_for_display(value, is_date=False, is_numeric=False, date_separa
 
     return s_value
 
+# --- Métricas de desempenho: histogramas de duração por etapa (expostos em /metrics, formato do Prometheus) ---
+# Cada processo (worker do gunicorn) tem os seus próprios histogramas. O pool da extração em lote devolve
+# as medições junto com o resultado, para que entrem nas métricas do worker web que atendeu a requisição.
+METRICAS_BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metricas_etapas = {}
+_metricas_lock = threading.Lock()
+_metricas_captura = threading.local()
+
+def _registrar_medicao(chave, duracao):
+    indice_bucket = bisect.bisect_left(METRICAS_BUCKETS_SEGUNDOS, duracao)
+    with _metricas_lock:
+        histograma = _metricas_etapas.get(chave)
+        if histograma is None:
+            histograma = _metricas_etapas[chave] = {'buckets': [0] * len(METRICAS_BUCKETS_SEGUNDOS), 'soma': 0.0, 'total': 0}
+        if indice_bucket < len(METRICAS_BUCKETS_SEGUNDOS):
+            histograma['buckets'][indice_bucket] += 1
+        histograma['soma'] += duracao
+        histograma['total'] += 1
+
+def registrar_duracao_etapa(etapa, duracao, **rotulos):
+    chave = (('etapa', etapa),) + tuple(sorted((nome, str(valor)) for nome, valor in rotulos.items() if valor))
+    medicoes_capturadas = getattr(_metricas_captura, 'medicoes', None)
+    if medicoes_capturadas is not None:
+        medicoes_capturadas.append((chave, duracao))
+    else:
+        _registrar_medicao(chave, duracao)
+
+def registrar_medicoes(medicoes):
+    for chave, duracao in medicoes:
+        _registrar_medicao(chave, duracao)
+
+@contextmanager
+def medir_etapa(etapa, **rotulos):
+    # Os rótulos podem ser completados dentro do bloco (ex.: o layout só é conhecido depois da classificação)
+    inicio = time.perf_counter()
+    try:
+        yield rotulos
+    finally:
+        registrar_duracao_etapa(etapa, time.perf_counter() - inicio, **rotulos)
+
+@contextmanager
+def capturar_medicoes():
+    # Guarda as medições desta thread numa lista em vez de registrá-las (usado nos processos do pool)
+    medicoes = []
+    _metricas_captura.medicoes = medicoes
+    try:
+        yield medicoes
+    finally:
+        _metricas_captura.medicoes = None
+
+def obter_histogramas_etapas():
+    with _metricas_lock:
+        return {chave: {'buckets': list(h['buckets']), 'soma': h['soma'], 'total': h['total']}
+                for chave, h in _metricas_etapas.items()}
+
+# --- Extração rápida de texto: somente os objetos de texto da página inteira ---
+# A página não é recortada em faixas: uma linha que cruza a fronteira entre duas faixas sai repetida ou
+# embaralhada nos dois recortes. benchmarks/texto_rapido_diferencial.py confere que o texto rápido é igual
+# ao extract_text da página inteira com as linhas em qualquer altura.
+EXTRACTION_FAST_MODE = os.environ.get('EXTRACTION_FAST_MODE', '1') == '1'
+
+# Sem estes campos a extração é considerada incompleta
+CAMPOS_OBRIGATORIOS_FATURA = ('Nome_Razao_Social', 'UC')
+
+class _AgregadorSomenteTexto(PDFPageAggregatorWithMarkedContent):
+    # Ignora caminhos (linhas, retângulos, curvas) e imagens: só os caracteres interessam aos extratores
+    def paint_path(self, gstate, stroke, fill, evenodd, path):
+        pass
+
+    def render_image(self, name, stream):
+        pass
+
+class PaginaSomenteTexto(PdfplumberPage):
+    @property
+    def layout(self):
+        if hasattr(self, '_layout'):
+            return self._layout
+        device = _AgregadorSomenteTexto(self.pdf.rsrcmgr, pageno=self.page_number, laparams=self.pdf.laparams)
+        interpreter = PDFPageInterpreter(self.pdf.rsrcmgr, device)
+        interpreter.process_page(self.page_obj)
+        self._layout = device.get_result()
+        return self._layout
+
+def extrair_texto_rapido(pdf, pagina):
+    # Mesmo texto do pagina.extract_text(): os caminhos e as imagens ignorados não geram caracteres
+    pagina_texto = PaginaSomenteTexto(pdf, pagina.page_obj, page_number=pagina.page_number, initial_doctop=pagina.initial_doctop)
+    return pagina_texto.extract_text() or ''
+
+# --- Motores de texto: pdfplumber (referência) e pdfium (biblioteca C, várias vezes mais rápido) ---
+# O texto do pdfium é remontado com as regras do extract_text do pdfplumber: caracteres agrupados em linhas
+# pelo topo (em cadeia, com tolerância de 3 pt) e ordenados por x dentro da linha; palavras separadas por
+# espaço, por mais de 3 pt ou por um caractere que volta para trás; as palavras agrupadas de novo em linhas,
+# na ordem em que saíram. A caixa de cada caractere é a do pdfminer (linha de base, descendente e corpo da
+# fonte), porque um décimo de ponto no topo já muda o agrupamento perto da tolerância.
+# Os extratores recebem as mesmas linhas: benchmarks/motores_texto_diferencial.py compara os dois motores
+# em páginas de várias colunas e termina com erro se alguma página sair diferente.
+# Cada distribuidora escolhe o seu motor (motor_texto); se ele não preencher os campos obrigatórios,
+# a fatura é lida de novo pelo pdfplumber.
+# O padrão continua sendo o pdfplumber: o pdfium só é escolhido explicitamente (EXTRACTION_TEXT_ENGINE=pdfium)
+EXTRACTION_TEXT_ENGINE = os.environ.get('EXTRACTION_TEXT_ENGINE', 'pdfplumber')
+TOLERANCIA_TEXTO_PT = 3
+
+def _descendente_fonte_pdfium(fonte):
+    # Descendente (em milésimos do corpo, negativa) que o pdfminer usaria: a da tabela das 14 fontes padrão
+    # pelo nome, como ele faz; senão a da própria fonte. A do pdfium para as fontes padrão vem da fonte que
+    # as substitui (Helvetica: -224 contra -207) e desloca o topo de cada caractere em 1,7% do corpo
+    nome = ctypes.create_string_buffer(256)
+    pdfium_raw.FPDFFont_GetBaseFontName(fonte, nome, len(nome))
+    metricas = FONT_METRICS.get(nome.value.decode('latin-1'))
+    if metricas is not None:
+        return -abs(metricas[0].get('Descent', 0))
+    descendente = ctypes.c_float()
+    if not pdfium_raw.FPDFFont_GetDescent(fonte, ctypes.c_float(1000), descendente):
+        return 0
+    return -abs(descendente.value)
+
+def _caracteres_pdfium(pagina):
+    # (x0, topo, x1, base, caractere) com topo/base medidos a partir do alto da página, como no pdfplumber;
+    # os caracteres gerados pelo pdfium são descartados
+    pagina_texto = pagina.get_textpage()
+    try:
+        altura = pagina.get_height()
+        matriz = pdfium_raw.FS_MATRIX()
+        caixa = pdfium_raw.FS_RECTF()
+        origem_x, origem_y = ctypes.c_double(), ctypes.c_double()
+        descendentes = {}
+        caracteres = []
+        for indice in range(pagina_texto.count_chars()):
+            if pdfium_raw.FPDFText_IsGenerated(pagina_texto, indice) == 1:
+                continue
+            caractere = chr(pdfium_raw.FPDFText_GetUnicode(pagina_texto, indice))
+            # O pdfium troca o hífen do fim de uma linha por U+0002; o pdfminer mantém o "-" do PDF
+            if caractere == '\x02' and pdfium_raw.FPDFText_IsHyphen(pagina_texto, indice) == 1:
+                caractere = '-'
+            # Caixa do pdfminer: da linha de base mais a descendente da fonte até um corpo acima.
+            # FPDFText_GetFontSize devolve o tamanho do Tf sem a escala da matriz de texto ("/F 1 Tf" com a matriz
+            # fazendo o resto é comum em faturas): a altura real é esse tamanho vezes a escala vertical da matriz
+            # x0 e a linha de base vêm da origem do caractere (double, como no pdfminer): a caixa em float do pdfium
+            # desempata errado caracteres de linhas diferentes alinhados na mesma coluna
+            pdfium_raw.FPDFText_GetLooseCharBox(pagina_texto, indice, caixa)
+            pdfium_raw.FPDFText_GetCharOrigin(pagina_texto, indice, origem_x, origem_y)
+            tamanho = pdfium_raw.FPDFText_GetFontSize(pagina_texto, indice)
+            if pdfium_raw.FPDFText_GetMatrix(pagina_texto, indice, matriz):
+                tamanho *= math.hypot(matriz.c, matriz.d)
+            fonte = pdfium_raw.FPDFTextObj_GetFont(pdfium_raw.FPDFText_GetTextObject(pagina_texto, indice))
+            chave_fonte = ctypes.cast(fonte, ctypes.c_void_p).value
+            if chave_fonte not in descendentes:
+                descendentes[chave_fonte] = _descendente_fonte_pdfium(fonte) if fonte else 0
+            base = altura - (origem_y.value + descendentes[chave_fonte] * tamanho / 1000)
+            caracteres.append((origem_x.value, base - tamanho, caixa.right, base, LIGATURES.get(caractere, caractere)))
+        return caracteres
+    finally:
+        pagina_texto.close()
+
+def _agrupar_linhas(objetos, preservar_ordem=False):
+    # Como o cluster_objects do pdfplumber: topos distintos em ordem, um novo grupo quando o topo passa do
+    # anterior por mais que a tolerância; dentro do grupo, a ordem original é mantida. Com preservar_ordem
+    # (o que o extract_text da página usa para as palavras), só objetos seguidos do mesmo grupo ficam na
+    # mesma linha: uma palavra do grupo de uma linha anterior que vem depois de outra linha abre uma linha nova
+    grupos = {}
+    grupo = -1
+    topo_anterior = None
+    for topo in sorted({objeto[1] for objeto in objetos}):
+        if topo_anterior is None or topo > topo_anterior + TOLERANCIA_TEXTO_PT:
+            grupo += 1
+        grupos[topo] = grupo
+        topo_anterior = topo
+    if preservar_ordem:
+        return [list(linha) for _, linha in itertools.groupby(objetos, key=lambda objeto: grupos[objeto[1]])]
+    linhas = [[] for _ in range(grupo + 1)]
+    for objeto in objetos:
+        linhas[grupos[objeto[1]]].append(objeto)
+    return linhas
+
+def _montar_texto_pdfium(caracteres):
+    # palavra: [x0, topo, texto], com x0 e topo mínimos entre os caracteres
+    palavras = []
+    for linha in _agrupar_linhas(caracteres):
+        anterior = None
+        for caractere in sorted(linha, key=lambda c: c[0]):
+            x0, topo, x1, _, texto = caractere
+            if texto.isspace():
+                anterior = None
+                continue
+            if (anterior is None or x0 < anterior[0] or x0 > anterior[2] + TOLERANCIA_TEXTO_PT
+                    or abs(topo - anterior[1]) > TOLERANCIA_TEXTO_PT):
+                palavras.append([x0, topo, texto])
+            else:
+                palavra = palavras[-1]
+                palavra[1] = min(palavra[1], topo)
+                palavra[2] += texto
+            anterior = caractere
+
+    return '\n'.join(' '.join(palavra[2] for palavra in linha) for linha in _agrupar_linhas(palavras, preservar_ordem=True))
+
+def extrair_texto_pdfium(origem_pdf):
+    # origem_pdf: caminho, bytes ou arquivo aberto
+    documento = pdfium.PdfDocument(origem_pdf)
+    try:
+        return _montar_texto_pdfium(_caracteres_pdfium(documento[0]))
+    finally:
+        documento.close()
+
+def extrair_texto_pdfplumber(origem_pdf):
+    if isinstance(origem_pdf, bytes):
+        origem_pdf = io.BytesIO(origem_pdf)
+    with pdfplumber.open(origem_pdf) as pdf:
+        return extrair_texto_rapido(pdf, pdf.pages[0])
+
+MOTORES_TEXTO = {
+    'pdfplumber': extrair_texto_pdfplumber,
+    'pdfium': extrair_texto_pdfium,
+}
+
+# --- Resultado da extração: os dados da fatura + a origem de cada campo ---
+# É um dict (sessão, cache em JSON e templates continuam funcionando como antes); a origem de cada campo
+# fica à parte, em atributos que não são serializados.
+CAMPOS_FATURA = (
+    'Nome_Razao_Social', 'Endereco_Rua_Numero', 'Bairro', 'CNPJ_CPF', 'Cidade', 'CEP',
+    'UC', 'Grupo_Tarifario', 'Tensao_Nominal_V', 'Classe_Tarifaria', 'Estado',
+)
+VALOR_NAO_ENCONTRADO = 'Não encontrado'
+
+# Confiança: 1.0 para o padrão principal do layout; menos para padrões de reserva e valores deduzidos
+CONFIANCA_PADRAO_ALTERNATIVO = 0.6
+CONFIANCA_VALOR_DEDUZIDO = 0.8
+
+class OrigemCampo:
+    __slots__ = ('layout', 'padrao', 'posicao', 'confianca')
+
+    def __init__(self, layout, padrao, posicao, confianca):
+        self.layout = layout
+        self.padrao = padrao
+        self.posicao = posicao
+        self.confianca = confianca
+
+    def __repr__(self):
+        return f"OrigemCampo(layout={self.layout!r}, posicao={self.posicao}, confianca={self.confianca})"
+
+class ResultadoExtracao(dict):
+    __slots__ = ('layout', 'origens')
+
+    def __init__(self, layout):
+        super().__init__((campo, VALOR_NAO_ENCONTRADO) for campo in CAMPOS_FATURA)
+        self.layout = layout
+        self.origens = {}
+
+    def definir(self, campo, valor, match, grupo=1, confianca=1.0):
+        self[campo] = valor
+        self.origens[campo] = OrigemCampo(self.layout, match.re.pattern, match.start(grupo), confianca)
+
+    def confianca_total(self):
+        return sum(origem.confianca for origem in self.origens.values())
+
+    def campos_nao_encontrados(self):
+        return [campo for campo in CAMPOS_FATURA if campo not in self.origens]
+
 # --- Funções Auxiliares de Extração para Layouts Específicos ---
 
 def _extrair_dados_layout_adriano_style(texto):
-    dados_extraidos = {
-        'Nome_Razao_Social': 'Não encontrado', 'Endereco_Rua_Numero': 'Não encontrado',
-        'Bairro': 'Não encontrado', 'CNPJ_CPF': 'Não encontrado',
-        'Cidade': 'Não encontrado', 'CEP': 'Não encontrado',
-        'UC': 'Não encontrado', 'Grupo_Tarifario': 'Não encontrado',
-        'Tensao_Nominal_V': 'Não encontrado', 'Classe_Tarifaria': 'Não encontrado',
-        'Estado': 'Não encontrado',
-    }
+    dados_extraidos = ResultadoExtracao('Adriano Style')
+    busca = padroes_fatura.BuscaFatura(texto)
 
     try:
-        match_tensao = re.search(r'TENSÃO NOMINAL EM VOLTS\s*Disp\.:\s*(\d+)', texto)
+        match_tensao = busca.search(padroes_fatura.TENSAO_NOMINAL_RGE)
         if match_tensao:
-            dados_extraidos['Tensao_Nominal_V'] = int(match_tensao.group(1))
+            dados_extraidos.definir('Tensao_Nominal_V', int(match_tensao.group(1)), match_tensao)
 
-        match_nome = re.search(r'Inscrição no CNPJ: \d{2}\.\d{3}\.\d{3}\/\d{4}-\d{2}\n+([A-Z\s,.]+)\n', texto)
+        match_nome = busca.search(padroes_fatura.NOME_CABECALHO_CNPJ_RGE)
         customer_name_found = None
         if match_nome:
             customer_name_found = match_nome.group(1).strip()
-            dados_extraidos['Nome_Razao_Social'] = customer_name_found
+            dados_extraidos.definir('Nome_Razao_Social', customer_name_found, match_nome)
 
         if customer_name_found and customer_name_found != 'Não encontrado':
-            street_and_number_pattern = r'((?:R|AV|EST|ROD|AL|TV|PR|TR|VD|RUA|VL|PRC|PCA)\s+[A-Z\s,.-]+?\s*\d+\s*(?:[A-Z0-9\s,.-]+)?)'
-            address_block_full_regex = (
-                re.escape(customer_name_found) + r'.*?' 
-                + street_and_number_pattern + r'\n' 
-                + r'([A-Z\s,.-]+)\n' 
-                + r'(\d{5}-\d{3})\s+([A-Z\s,.-]+)\s+(RS)'
-            )
-            match_endereco_bloco = re.search(address_block_full_regex, texto, re.DOTALL)
+            # O endereço vem logo depois do nome: a busca fica restrita às linhas seguintes a ele
+            fim_nome = match_nome.end(1)
+            fim_janela = busca.texto.fim_linhas(fim_nome, padroes_fatura.JANELA_ENDERECO_LINHAS)
+            match_endereco_bloco = busca.search(padroes_fatura.ENDERECO_RGE, fim_nome, fim_janela)
             if match_endereco_bloco:
-                dados_extraidos['Endereco_Rua_Numero'] = match_endereco_bloco.group(1).strip()
-                dados_extraidos['Bairro'] = match_endereco_bloco.group(2).strip()
-                dados_extraidos['CEP'] = match_endereco_bloco.group(3).strip()
-                dados_extraidos['Cidade'] = match_endereco_bloco.group(4).strip()
-                dados_extraidos['Estado'] = match_endereco_bloco.group(5).strip()
+                dados_extraidos.definir('Endereco_Rua_Numero', match_endereco_bloco.group(1).strip(), match_endereco_bloco, grupo=1)
+                dados_extraidos.definir('Bairro', match_endereco_bloco.group(2).strip(), match_endereco_bloco, grupo=2)
+                dados_extraidos.definir('CEP', match_endereco_bloco.group(3).strip(), match_endereco_bloco, grupo=3)
+                dados_extraidos.definir('Cidade', match_endereco_bloco.group(4).strip(), match_endereco_bloco, grupo=4)
+                dados_extraidos.definir('Estado', match_endereco_bloco.group(5).strip(), match_endereco_bloco, grupo=5)
 
-        match_cpf = re.search(r'CPF:\s*(\d{3}\.\d{3}\.\d{3}-\d{2})', texto)
+        match_cpf = busca.search(padroes_fatura.CPF_RGE)
         if match_cpf:
-            dados_extraidos['CNPJ_CPF'] = match_cpf.group(1)
+            dados_extraidos.definir('CNPJ_CPF', match_cpf.group(1), match_cpf)
         else:
-            match_cnpj = re.search(r'CNPJ:\s*(\d{2}\.\d{3}\.\d{3}\/\d{4}-\d{2})', texto)
+            match_cnpj = busca.search(padroes_fatura.CNPJ)
             if match_cnpj:
-                dados_extraidos['CNPJ_CPF'] = match_cnpj.group(1)
+                dados_extraidos.definir('CNPJ_CPF', match_cnpj.group(1), match_cnpj, confianca=CONFIANCA_PADRAO_ALTERNATIVO)
 
-        match_uc = re.search(r'UC:\s*(\d{10})', texto)
+        match_uc = busca.search(padroes_fatura.UC_RGE)
         if match_uc:
-            dados_extraidos['UC'] = match_uc.group(1)
+            dados_extraidos.definir('UC', match_uc.group(1), match_uc)
         else:
-            match_uc_alt = re.search(r'Lim.\s*máx.:\s*\d+\s*(\d{10})', texto)
+            match_uc_alt = busca.search(padroes_fatura.UC_LIMITE_MAXIMO_RGE)
             if match_uc_alt:
-                dados_extraidos['UC'] = match_uc_alt.group(1)
+                dados_extraidos.definir('UC', match_uc_alt.group(1), match_uc_alt, confianca=CONFIANCA_PADRAO_ALTERNATIVO)
 
-        match_classificacao = re.search(r'Classificaç(?:ão|ao):\s*([^\n]+)', texto, re.IGNORECASE)
+        match_classificacao = busca.search(padroes_fatura.CLASSIFICACAO_RGE)
         if match_classificacao:
             classif = match_classificacao.group(1).strip().replace('Tipo de Fornecimento:', '').strip()
-            match_grupo = re.search(r'(B[1-4]|A)', classif)
+            match_grupo = padroes_fatura.GRUPO_TARIFARIO.search(classif)
             if match_grupo:
-                dados_extraidos['Grupo_Tarifario'] = match_grupo.group(1)
-            match_classe = re.search(r'(Residencial|Comercial|Industrial|Rural|Poder Público|Iluminação Pública)', classif, re.IGNORECASE)
+                dados_extraidos.definir('Grupo_Tarifario', match_grupo.group(1), match_classificacao)
+            match_classe = padroes_fatura.CLASSE_TARIFARIA.search(classif)
             if match_classe:
-                dados_extraidos['Classe_Tarifaria'] = match_classe.group(1)
+                dados_extraidos.definir('Classe_Tarifaria', match_classe.group(1), match_classificacao)
 
     except Exception as e:
         print(f"Erro ao extrair dados do layout 'Adriano Style': {e}")
@@ -133,63 +417,53 @@ def _extrair_dados_layout_adriano_style(texto):
 
 
 def _extrair_dados_layout_adroaldo_style(texto):
-    dados_extraidos = {
-        'Nome_Razao_Social': 'Não encontrado', 'Endereco_Rua_Numero': 'Não encontrado',
-        'Bairro': 'Não encontrado', 'CNPJ_CPF': 'Não encontrado',
-        'Cidade': 'Não encontrado', 'CEP': 'Não encontrado',
-        'UC': 'Não encontrado', 'Grupo_Tarifario': 'Não encontrado',
-        'Tensao_Nominal_V': 'Não encontrado', 'Classe_Tarifaria': 'Não encontrado',
-        'Estado': 'Não encontrado',
-    }
+    dados_extraidos = ResultadoExtracao('Adroaldo/Aire Style')
+    busca = padroes_fatura.BuscaFatura(texto)
 
     try:
-        match_tensao = re.search(r'TENSÃO NOMINAL EM VOLTS\s*Disp\.:\s*(\d+)', texto)
+        match_tensao = busca.search(padroes_fatura.TENSAO_NOMINAL_RGE)
         if match_tensao:
-            dados_extraidos['Tensao_Nominal_V'] = int(match_tensao.group(1))
+            dados_extraidos.definir('Tensao_Nominal_V', int(match_tensao.group(1)), match_tensao)
 
-        match_nome = re.search(r'Inscrição no CNPJ: \d{2}\.\d{3}\.\d{3}\/\d{4}-\d{2}\n+([A-Z\s,.]+)\n', texto)
+        match_nome = busca.search(padroes_fatura.NOME_CABECALHO_CNPJ_RGE)
         customer_name_found = None
         if match_nome:
             customer_name_found = match_nome.group(1).strip()
-            dados_extraidos['Nome_Razao_Social'] = customer_name_found
+            dados_extraidos.definir('Nome_Razao_Social', customer_name_found, match_nome)
 
         if customer_name_found and customer_name_found != 'Não encontrado':
-            street_and_number_pattern = r'((?:R|AV|EST|ROD|AL|TV|PR|TR|VD|RUA|VL|PRC|PCA)\s+[A-Z\s,.-]+?\s*\d+\s*(?:[A-Z0-9\s,.-]+)?)'
-            address_block_full_regex = (
-                re.escape(customer_name_found) + r'.*?' 
-                + street_and_number_pattern + r'\n' 
-                + r'([A-Z\s,.-]+)\n' 
-                + r'(\d{5}-\d{3})\s+([A-Z\s,.-]+)\s+(RS)'
-            )
-            match_endereco_bloco = re.search(address_block_full_regex, texto, re.DOTALL)
+            # O endereço vem logo depois do nome: a busca fica restrita às linhas seguintes a ele
+            fim_nome = match_nome.end(1)
+            fim_janela = busca.texto.fim_linhas(fim_nome, padroes_fatura.JANELA_ENDERECO_LINHAS)
+            match_endereco_bloco = busca.search(padroes_fatura.ENDERECO_RGE, fim_nome, fim_janela)
             if match_endereco_bloco:
-                dados_extraidos['Endereco_Rua_Numero'] = match_endereco_bloco.group(1).strip()
-                dados_extraidos['Bairro'] = match_endereco_bloco.group(2).strip()
-                dados_extraidos['CEP'] = match_endereco_bloco.group(3).strip()
-                dados_extraidos['Cidade'] = match_endereco_bloco.group(4).strip()
-                dados_extraidos['Estado'] = match_endereco_bloco.group(5).strip()
+                dados_extraidos.definir('Endereco_Rua_Numero', match_endereco_bloco.group(1).strip(), match_endereco_bloco, grupo=1)
+                dados_extraidos.definir('Bairro', match_endereco_bloco.group(2).strip(), match_endereco_bloco, grupo=2)
+                dados_extraidos.definir('CEP', match_endereco_bloco.group(3).strip(), match_endereco_bloco, grupo=3)
+                dados_extraidos.definir('Cidade', match_endereco_bloco.group(4).strip(), match_endereco_bloco, grupo=4)
+                dados_extraidos.definir('Estado', match_endereco_bloco.group(5).strip(), match_endereco_bloco, grupo=5)
 
-        match_cpf_masked = re.search(r'CPF:\s*(((\*)?){6}\.\d{3}-(((\*)?){2}))', texto)
+        match_cpf_masked = busca.search(padroes_fatura.CPF_MASCARADO_RGE)
         if match_cpf_masked:
-            dados_extraidos['CNPJ_CPF'] = match_cpf_masked.group(1)
+            dados_extraidos.definir('CNPJ_CPF', match_cpf_masked.group(1), match_cpf_masked)
         else:
-            match_cnpj = re.search(r'CNPJ:\s*(\d{2}\.\d{3}\.\d{3}\/\d{4}-\d{2})', texto)
+            match_cnpj = busca.search(padroes_fatura.CNPJ)
             if match_cnpj:
-                dados_extraidos['CNPJ_CPF'] = match_cnpj.group(1)
+                dados_extraidos.definir('CNPJ_CPF', match_cnpj.group(1), match_cnpj, confianca=CONFIANCA_PADRAO_ALTERNATIVO)
 
-        match_uc = re.search(r'Lim.\s*máx.:\s*\d+\s*(\d{10})', texto)
+        match_uc = busca.search(padroes_fatura.UC_LIMITE_MAXIMO_RGE)
         if match_uc:
-            dados_extraidos['UC'] = match_uc.group(1)
+            dados_extraidos.definir('UC', match_uc.group(1), match_uc)
 
-        match_classificacao = re.search(r'Classificaç(?:ão|ao):\s*([^\n]+)', texto, re.IGNORECASE)
+        match_classificacao = busca.search(padroes_fatura.CLASSIFICACAO_RGE)
         if match_classificacao:
             classif = match_classificacao.group(1).strip().replace('Tipo de Fornecimento:', '').strip()
-            match_grupo = re.search(r'(B[1-4]|A)', classif)
+            match_grupo = padroes_fatura.GRUPO_TARIFARIO.search(classif)
             if match_grupo:
-                dados_extraidos['Grupo_Tarifario'] = match_grupo.group(1)
-            match_classe = re.search(r'(Residencial|Comercial|Industrial|Rural|Poder Público|Iluminação Pública)', classif, re.IGNORECASE)
+                dados_extraidos.definir('Grupo_Tarifario', match_grupo.group(1), match_classificacao)
+            match_classe = padroes_fatura.CLASSE_TARIFARIA.search(classif)
             if match_classe:
-                dados_extraidos['Classe_Tarifaria'] = match_classe.group(1)
+                dados_extraidos.definir('Classe_Tarifaria', match_classe.group(1), match_classificacao)
 
     except Exception as e:
         print(f"Erro ao extrair dados do layout 'Adroaldo Style': {e}")
@@ -199,67 +473,57 @@ def _extrair_dados_layout_adroaldo_style(texto):
 
 
 def _extrair_dados_layout_arcindo_style(texto):
-    dados_extraidos = {
-        'Nome_Razao_Social': 'Não encontrado', 'Endereco_Rua_Numero': 'Não encontrado',
-        'Bairro': 'Não encontrado', 'CNPJ_CPF': 'Não encontrado',
-        'Cidade': 'Não encontrado', 'CEP': 'Não encontrado',
-        'UC': 'Não encontrado', 'Grupo_Tarifario': 'Não encontrado',
-        'Tensao_Nominal_V': 'Não encontrado', 'Classe_Tarifaria': 'Não encontrado',
-        'Estado': 'Não encontrado',
-    }
+    dados_extraidos = ResultadoExtracao('Arcindo Style')
+    busca = padroes_fatura.BuscaFatura(texto)
 
     try:
-        match_tensao = re.search(r'TENSÃO NOMINAL EM VOLTS\s*Disp\.:\s*(\d+)', texto)
+        match_tensao = busca.search(padroes_fatura.TENSAO_NOMINAL_RGE)
         if match_tensao:
-            dados_extraidos['Tensao_Nominal_V'] = int(match_tensao.group(1))
+            dados_extraidos.definir('Tensao_Nominal_V', int(match_tensao.group(1)), match_tensao)
 
-        match_nome = re.search(r'CÓDIGO DA UNIDADE CONSUMIDORA:\s*\d+\n([A-Z\s]+)\n', texto)
+        match_nome = busca.search(padroes_fatura.NOME_ARCINDO)
         customer_name_found = None
         if match_nome:
             customer_name_found = match_nome.group(1).strip()
-            dados_extraidos['Nome_Razao_Social'] = customer_name_found
+            dados_extraidos.definir('Nome_Razao_Social', customer_name_found, match_nome)
         
         if customer_name_found and customer_name_found != 'Não encontrado':
-            street_and_number_pattern = r'((?:R|AV|EST|ROD|AL|TV|PR|TR|VD|RUA|VL|PRC|PCA)\s+[A-Z\s,.-]+?\s*\d+\s*(?:[A-Z0-9\s,.-]+)?)'
-            address_block_full_regex = (
-                re.escape(customer_name_found) + r'.*?' 
-                + street_and_number_pattern + r'\n' 
-                + r'([A-Z\s,.-]+)\n' 
-                + r'(\d{5}-\d{3})\s+([A-Z\s,.-]+)\s*-\s*(RS)'
-            )
-            match_endereco_bloco = re.search(address_block_full_regex, texto, re.DOTALL)
+            # O endereço vem logo depois do nome: a busca fica restrita às linhas seguintes a ele
+            fim_nome = match_nome.end(1)
+            fim_janela = busca.texto.fim_linhas(fim_nome, padroes_fatura.JANELA_ENDERECO_LINHAS)
+            match_endereco_bloco = busca.search(padroes_fatura.ENDERECO_ARCINDO, fim_nome, fim_janela)
             if match_endereco_bloco:
-                dados_extraidos['Endereco_Rua_Numero'] = match_endereco_bloco.group(1).strip()
-                dados_extraidos['Bairro'] = match_endereco_bloco.group(2).strip()
-                dados_extraidos['CEP'] = match_endereco_bloco.group(3).strip()
-                dados_extraidos['Cidade'] = match_endereco_bloco.group(4).strip()
-                dados_extraidos['Estado'] = match_endereco_bloco.group(5).strip()
+                dados_extraidos.definir('Endereco_Rua_Numero', match_endereco_bloco.group(1).strip(), match_endereco_bloco, grupo=1)
+                dados_extraidos.definir('Bairro', match_endereco_bloco.group(2).strip(), match_endereco_bloco, grupo=2)
+                dados_extraidos.definir('CEP', match_endereco_bloco.group(3).strip(), match_endereco_bloco, grupo=3)
+                dados_extraidos.definir('Cidade', match_endereco_bloco.group(4).strip(), match_endereco_bloco, grupo=4)
+                dados_extraidos.definir('Estado', match_endereco_bloco.group(5).strip(), match_endereco_bloco, grupo=5)
 
-        match_cpf_masked = re.search(r'CPF:\s*(((\*)?){6}\.\d{3}-(((\*)?){2}))', texto)
+        match_cpf_masked = busca.search(padroes_fatura.CPF_MASCARADO_RGE)
         if match_cpf_masked:
-            dados_extraidos['CNPJ_CPF'] = match_cpf_masked.group(1)
+            dados_extraidos.definir('CNPJ_CPF', match_cpf_masked.group(1), match_cpf_masked)
         else:
-            match_cnpj = re.search(r'CNPJ:\s*(\d{2}\.\d{3}\.\d{3}\/\d{4}-\d{2})', texto)
+            match_cnpj = busca.search(padroes_fatura.CNPJ)
             if match_cnpj:
-                dados_extraidos['CNPJ_CPF'] = match_cnpj.group(1)
+                dados_extraidos.definir('CNPJ_CPF', match_cnpj.group(1), match_cnpj, confianca=CONFIANCA_PADRAO_ALTERNATIVO)
 
-        match_uc = re.search(r'CÓDIGO DA UNIDADE CONSUMIDORA:\s*(\d{10})', texto)
+        match_uc = busca.search(padroes_fatura.UC_ARCINDO)
         if match_uc:
-            dados_extraidos['UC'] = match_uc.group(1)
+            dados_extraidos.definir('UC', match_uc.group(1), match_uc)
         else:
-            match_uc_alt = re.search(r'(\d{10})\n1/2', texto)
+            match_uc_alt = busca.search(padroes_fatura.UC_ARCINDO_PAGINA)
             if match_uc_alt:
-                dados_extraidos['UC'] = match_uc_alt.group(1)
+                dados_extraidos.definir('UC', match_uc_alt.group(1), match_uc_alt, confianca=CONFIANCA_PADRAO_ALTERNATIVO)
 
-        match_classificacao = re.search(r'Classificaç(?:ão|ao):\s*([^\n]+)', texto, re.IGNORECASE)
+        match_classificacao = busca.search(padroes_fatura.CLASSIFICACAO_RGE)
         if match_classificacao:
             classif = match_classificacao.group(1).strip()
-            match_grupo = re.search(r'(B[1-4]|A)', classif)
+            match_grupo = padroes_fatura.GRUPO_TARIFARIO.search(classif)
             if match_grupo:
-                dados_extraidos['Grupo_Tarifario'] = match_grupo.group(1)
-            match_classe = re.search(r'(Residencial|Comercial|Industrial|Rural|Poder Público|Iluminação Pública)', classif, re.IGNORECASE)
+                dados_extraidos.definir('Grupo_Tarifario', match_grupo.group(1), match_classificacao)
+            match_classe = padroes_fatura.CLASSE_TARIFARIA.search(classif)
             if match_classe:
-                dados_extraidos['Classe_Tarifaria'] = match_classe.group(1)
+                dados_extraidos.definir('Classe_Tarifaria', match_classe.group(1), match_classificacao)
 
     except Exception as e:
         print(f"Erro ao extrair dados do layout 'Arcindo Style': {e}")
@@ -270,59 +534,53 @@ def _extrair_dados_layout_arcindo_style(texto):
 # --- Funções para Sub-layouts da Cooperluz ---
 
 def _extrair_dados_layout_cooperluz_sublayout_com_cod_ua(texto):
-    dados_extraidos = {
-        'Nome_Razao_Social': 'Não encontrado', 'Endereco_Rua_Numero': 'Não encontrado',
-        'Bairro': 'Não encontrado', 'CNPJ_CPF': 'Não encontrado',
-        'Cidade': 'Não encontrado', 'CEP': 'Não encontrado',
-        'UC': 'Não encontrado', 'Grupo_Tarifario': 'Não encontrado',
-        'Tensao_Nominal_V': 'Não encontrado', 'Classe_Tarifaria': 'Não encontrado',
-        'Estado': 'Não encontrado',
-    }
-    
+    dados_extraidos = ResultadoExtracao('Cooperluz (com COD UA)')
+    busca = padroes_fatura.BuscaFatura(texto)
+
     try:
-        tipo_fornecimento_match = re.search(r'Tipo de Fornecimento:\s*(?:[\s\S]*?)(Monofásico|Bifásico|Trifásico)', texto, re.IGNORECASE | re.DOTALL)
+        tipo_fornecimento_match = busca.search(padroes_fatura.TIPO_FORNECIMENTO)
         if tipo_fornecimento_match:
             tipo_fornecimento_extraido = tipo_fornecimento_match.group(1).strip()
             if 'Bifásico' in tipo_fornecimento_extraido or 'Monofásico' in tipo_fornecimento_extraido:
-                dados_extraidos['Tensao_Nominal_V'] = 220
+                dados_extraidos.definir('Tensao_Nominal_V', 220, tipo_fornecimento_match, confianca=CONFIANCA_VALOR_DEDUZIDO)
             elif 'Trifásico' in tipo_fornecimento_extraido:
-                dados_extraidos['Tensao_Nominal_V'] = 380
+                dados_extraidos.definir('Tensao_Nominal_V', 380, tipo_fornecimento_match, confianca=CONFIANCA_VALOR_DEDUZIDO)
 
-        classificacao_line_match = re.search(r'Classificaç(?:ão|ao):\s*(.*?)(?:(?=\nTipo de Fornecimento)|\n|$)', texto, re.DOTALL | re.IGNORECASE)
+        classificacao_line_match = busca.search(padroes_fatura.CLASSIFICACAO_COOP)
         if classificacao_line_match:
             classif_line_content = classificacao_line_match.group(1).strip()
-            match_grupo = re.search(r'(B[1-4]|A)', classif_line_content)
+            match_grupo = padroes_fatura.GRUPO_TARIFARIO.search(classif_line_content)
             if match_grupo:
-                dados_extraidos['Grupo_Tarifario'] = match_grupo.group(1)
-            match_classe = re.search(r'(Residencial|Comercial|Industrial|Rural|Poder Público|Iluminação Pública)', classif_line_content, re.IGNORECASE)
+                dados_extraidos.definir('Grupo_Tarifario', match_grupo.group(1), classificacao_line_match)
+            match_classe = padroes_fatura.CLASSE_TARIFARIA.search(classif_line_content)
             if match_classe:
-                dados_extraidos['Classe_Tarifaria'] = match_classe.group(1)
+                dados_extraidos.definir('Classe_Tarifaria', match_classe.group(1), classificacao_line_match)
 
-        nome_match = re.search(r'(?:Monofásico|Bifásico|Trifásico)\n+([A-Z\s,.-]+)\n+(?:Leitura anterior|DATAS DE|COD UA)', texto, re.DOTALL | re.IGNORECASE)
+        nome_match = busca.search(padroes_fatura.NOME_COOPERLUZ_COM_COD_UA)
         if nome_match:
-            dados_extraidos['Nome_Razao_Social'] = nome_match.group(1).strip()
+            dados_extraidos.definir('Nome_Razao_Social', nome_match.group(1).strip(), nome_match)
 
-        endereco_rua_match = re.search(r'Proxima Leitura\n+([^\n]+) DATAS DE', texto, re.DOTALL) 
+        endereco_rua_match = busca.search(padroes_fatura.ENDERECO_COOP)
         if endereco_rua_match:
-            dados_extraidos['Endereco_Rua_Numero'] = endereco_rua_match.group(1).strip()
+            dados_extraidos.definir('Endereco_Rua_Numero', endereco_rua_match.group(1).strip(), endereco_rua_match)
 
-        interior_line_match = re.search(r'COD UA \d+ LEITURAS.*?\n\s*(INTERIOR / ([A-Za-zÀ-ÖØ-öø-ÿ\s,.-]+))-([A-Z]{2})', texto, re.DOTALL)
+        interior_line_match = busca.search(padroes_fatura.INTERIOR_COOPERLUZ_COM_COD_UA)
         if interior_line_match:
-            dados_extraidos['Bairro'] = 'INTERIOR'
-            dados_extraidos['Cidade'] = interior_line_match.group(2).strip()
-            dados_extraidos['Estado'] = interior_line_match.group(3).strip()
+            dados_extraidos.definir('Bairro', 'INTERIOR', interior_line_match)
+            dados_extraidos.definir('Cidade', interior_line_match.group(2).strip(), interior_line_match, grupo=2)
+            dados_extraidos.definir('Estado', interior_line_match.group(3).strip(), interior_line_match, grupo=3)
 
-        match_cpf_cnpj = re.search(r'CPF/CNPJ:\s*([\d*]{3}\.[\d*]{3}\.[\d*]{3}-\d{2}|\d{2}\.[\d*]{3}\.[\d*]{3}\/\d{4}-\d{2})', texto)
+        match_cpf_cnpj = busca.search(padroes_fatura.CPF_CNPJ_COOP)
         if match_cpf_cnpj:
-            dados_extraidos['CNPJ_CPF'] = match_cpf_cnpj.group(1)
+            dados_extraidos.definir('CNPJ_CPF', match_cpf_cnpj.group(1), match_cpf_cnpj)
 
-        match_cep = re.search(r'CEP:\s*(\d{2}\s*\d{3}-\d{3})', texto)
+        match_cep = busca.search(padroes_fatura.CEP_COOP)
         if match_cep:
-            dados_extraidos['CEP'] = match_cep.group(1)
+            dados_extraidos.definir('CEP', match_cep.group(1), match_cep)
 
-        uc_match = re.search(r'CEP:\s*\d{2}\s*\d{3}-\d{3}\s*([\d-]+)', texto)
+        uc_match = busca.search(padroes_fatura.UC_APOS_CEP_COOPERLUZ)
         if uc_match:
-            dados_extraidos['UC'] = uc_match.group(1)
+            dados_extraidos.definir('UC', uc_match.group(1), uc_match)
 
     except Exception as e:
         print(f"Erro ao extrair dados do sub-layout 'Cooperluz (com COD UA)': {e}")
@@ -330,59 +588,53 @@ def _extrair_dados_layout_cooperluz_sublayout_com_cod_ua(texto):
     return dados_extraidos
 
 def _extrair_dados_layout_cooperluz_sublayout_sem_cod_ua(texto):
-    dados_extraidos = {
-        'Nome_Razao_Social': 'Não encontrado', 'Endereco_Rua_Numero': 'Não encontrado',
-        'Bairro': 'Não encontrado', 'CNPJ_CPF': 'Não encontrado',
-        'Cidade': 'Não encontrado', 'CEP': 'Não encontrado',
-        'UC': 'Não encontrado', 'Grupo_Tarifario': 'Não encontrado',
-        'Tensao_Nominal_V': 'Não encontrado', 'Classe_Tarifaria': 'Não encontrado',
-        'Estado': 'Não encontrado',
-    }
+    dados_extraidos = ResultadoExtracao('Cooperluz (sem COD UA)')
+    busca = padroes_fatura.BuscaFatura(texto)
 
     try:
-        tipo_fornecimento_match = re.search(r'Tipo de Fornecimento:\s*(?:[\s\S]*?)(Monofásico|Bifásico|Trifásico)', texto, re.IGNORECASE | re.DOTALL)
+        tipo_fornecimento_match = busca.search(padroes_fatura.TIPO_FORNECIMENTO)
         if tipo_fornecimento_match:
             tipo_fornecimento_extraido = tipo_fornecimento_match.group(1).strip()
             if 'Bifásico' in tipo_fornecimento_extraido or 'Monofásico' in tipo_fornecimento_extraido:
-                dados_extraidos['Tensao_Nominal_V'] = 220
+                dados_extraidos.definir('Tensao_Nominal_V', 220, tipo_fornecimento_match, confianca=CONFIANCA_VALOR_DEDUZIDO)
             elif 'Trifásico' in tipo_fornecimento_extraido:
-                dados_extraidos['Tensao_Nominal_V'] = 380
+                dados_extraidos.definir('Tensao_Nominal_V', 380, tipo_fornecimento_match, confianca=CONFIANCA_VALOR_DEDUZIDO)
 
-        classificacao_line_match = re.search(r'Classificaç(?:ão|ao):\s*(.*?)(?:(?=\nTipo de Fornecimento)|\n|$)', texto, re.DOTALL | re.IGNORECASE)
+        classificacao_line_match = busca.search(padroes_fatura.CLASSIFICACAO_COOP)
         if classificacao_line_match:
             classif_line_content = classificacao_line_match.group(1).strip()
-            match_grupo = re.search(r'(B[1-4]|A)', classif_line_content)
+            match_grupo = padroes_fatura.GRUPO_TARIFARIO.search(classif_line_content)
             if match_grupo:
-                dados_extraidos['Grupo_Tarifario'] = match_grupo.group(1)
-            match_classe = re.search(r'(Residencial|Comercial|Industrial|Rural|Poder Público|Iluminação Pública)', classif_line_content, re.IGNORECASE)
+                dados_extraidos.definir('Grupo_Tarifario', match_grupo.group(1), classificacao_line_match)
+            match_classe = padroes_fatura.CLASSE_TARIFARIA.search(classif_line_content)
             if match_classe:
-                dados_extraidos['Classe_Tarifaria'] = match_classe.group(1)
+                dados_extraidos.definir('Classe_Tarifaria', match_classe.group(1), classificacao_line_match)
 
-        nome_match = re.search(r'(?:Monofásico|Bifásico|Trifásico)\n+([A-Z\s,.-]+)\n+Leitura anterior', texto, re.DOTALL | re.IGNORECASE)
+        nome_match = busca.search(padroes_fatura.NOME_COOPERLUZ_SEM_COD_UA)
         if nome_match:
-            dados_extraidos['Nome_Razao_Social'] = nome_match.group(1).strip()
+            dados_extraidos.definir('Nome_Razao_Social', nome_match.group(1).strip(), nome_match)
 
-        endereco_rua_match = re.search(r'Proxima Leitura\n+([^\n]+) DATAS DE', texto, re.DOTALL)
+        endereco_rua_match = busca.search(padroes_fatura.ENDERECO_COOP)
         if endereco_rua_match:
-            dados_extraidos['Endereco_Rua_Numero'] = endereco_rua_match.group(1).strip()
+            dados_extraidos.definir('Endereco_Rua_Numero', endereco_rua_match.group(1).strip(), endereco_rua_match)
 
-        interior_line_match = re.search(r'LEITURAS.*?\n\s*(INTERIOR / ([A-Za-zÀ-ÖØ-öø-ÿ\s,.-]+))-([A-Z]{2})', texto, re.DOTALL)
+        interior_line_match = busca.search(padroes_fatura.INTERIOR_COOPERLUZ_SEM_COD_UA)
         if interior_line_match:
-            dados_extraidos['Bairro'] = 'INTERIOR'
-            dados_extraidos['Cidade'] = interior_line_match.group(2).strip()
-            dados_extraidos['Estado'] = interior_line_match.group(3).strip()
+            dados_extraidos.definir('Bairro', 'INTERIOR', interior_line_match)
+            dados_extraidos.definir('Cidade', interior_line_match.group(2).strip(), interior_line_match, grupo=2)
+            dados_extraidos.definir('Estado', interior_line_match.group(3).strip(), interior_line_match, grupo=3)
 
-        match_cpf_cnpj = re.search(r'CPF/CNPJ:\s*([\d*]{3}\.[\d*]{3}\.[\d*]{3}-\d{2}|\d{2}\.[\d*]{3}\.[\d*]{3}\/\d{4}-\d{2})', texto)
+        match_cpf_cnpj = busca.search(padroes_fatura.CPF_CNPJ_COOP)
         if match_cpf_cnpj:
-            dados_extraidos['CNPJ_CPF'] = match_cpf_cnpj.group(1)
+            dados_extraidos.definir('CNPJ_CPF', match_cpf_cnpj.group(1), match_cpf_cnpj)
 
-        match_cep = re.search(r'CEP:\s*(\d{2}\s*\d{3}-\d{3})', texto)
+        match_cep = busca.search(padroes_fatura.CEP_COOP)
         if match_cep:
-            dados_extraidos['CEP'] = match_cep.group(1)
+            dados_extraidos.definir('CEP', match_cep.group(1), match_cep)
 
-        uc_match = re.search(r'UNIDADE CONSUMIDORA\n+Rota:\s*\d+,\s*Sequência:\s*\d+\s*([\d-]+)', texto, re.DOTALL)
+        uc_match = busca.search(padroes_fatura.UC_ROTA_COOPERLUZ)
         if uc_match:
-            dados_extraidos['UC'] = uc_match.group(1).strip()
+            dados_extraidos.definir('UC', uc_match.group(1).strip(), uc_match)
 
     except Exception as e:
         print(f"Erro ao extrair dados do sub-layout 'Cooperluz (sem COD UA)': {e}")
@@ -390,141 +642,602 @@ def _extrair_dados_layout_cooperluz_sublayout_sem_cod_ua(texto):
     return dados_extraidos
 
 
-def _extrair_dados_layout_cooperluz_style(texto):
-    if re.search(r'COD UA \d+', texto):
-        return _extrair_dados_layout_cooperluz_sublayout_com_cod_ua(texto)
-    else:
-        return _extrair_dados_layout_cooperluz_sublayout_sem_cod_ua(texto)
+COOPERLUZ_LAYOUTS = [
+    {
+        'nome': 'Cooperluz (com COD UA)',
+        'extrator': _extrair_dados_layout_cooperluz_sublayout_com_cod_ua,
+        'ancoras': ('COD UA',),
+        'assinatura': padroes_fatura.ASSINATURA_COOPERLUZ_COD_UA,
+    },
+    # Sem âncoras nem assinatura: usado sempre que o sub-layout anterior não é confirmado
+    {
+        'nome': 'Cooperluz (sem COD UA)',
+        'extrator': _extrair_dados_layout_cooperluz_sublayout_sem_cod_ua,
+    },
+]
 
 def _extrair_dados_layout_coop_similar_style(texto, distributor_name):
-    dados_extraidos = {
-        'Nome_Razao_Social': 'Não encontrado', 'Endereco_Rua_Numero': 'Não encontrado',
-        'Bairro': 'Não encontrado', 'CNPJ_CPF': 'Não encontrado',
-        'Cidade': 'Não encontrado', 'CEP': 'Não encontrado',
-        'UC': 'Não encontrado', 'Grupo_Tarifario': 'Não encontrado',
-        'Tensao_Nominal_V': 'Não encontrado', 'Classe_Tarifaria': 'Não encontrado',
-        'Estado': 'Não encontrado',
-    }
+    dados_extraidos = ResultadoExtracao(f"{distributor_name} (similar Cooperluz)")
+    busca = padroes_fatura.BuscaFatura(texto)
 
     try:
-        tipo_fornecimento_match = re.search(r'Tipo de Fornecimento:\s*(?:[\s\S]*?)(Monofásico|Bifásico|Trifásico)', texto, re.IGNORECASE | re.DOTALL)
+        tipo_fornecimento_match = busca.search(padroes_fatura.TIPO_FORNECIMENTO)
         if tipo_fornecimento_match:
             tipo_fornecimento_extraido = tipo_fornecimento_match.group(1).strip()
             if 'Bifásico' in tipo_fornecimento_extraido or 'Monofásico' in tipo_fornecimento_extraido:
-                dados_extraidos['Tensao_Nominal_V'] = 220
+                dados_extraidos.definir('Tensao_Nominal_V', 220, tipo_fornecimento_match, confianca=CONFIANCA_VALOR_DEDUZIDO)
             elif 'Trifásico' in tipo_fornecimento_extraido:
-                dados_extraidos['Tensao_Nominal_V'] = 380
+                dados_extraidos.definir('Tensao_Nominal_V', 380, tipo_fornecimento_match, confianca=CONFIANCA_VALOR_DEDUZIDO)
 
-        classificacao_line_match = re.search(r'Classificaç(?:ão|ao):\s*(.*?)(?:(?=\nTipo de Fornecimento)|\n|$)', texto, re.DOTALL | re.IGNORECASE)
+        classificacao_line_match = busca.search(padroes_fatura.CLASSIFICACAO_COOP)
         if classificacao_line_match:
             classif_line_content = classificacao_line_match.group(1).strip()
-            match_grupo = re.search(r'(B[1-4]|A)', classif_line_content)
+            match_grupo = padroes_fatura.GRUPO_TARIFARIO.search(classif_line_content)
             if match_grupo:
-                dados_extraidos['Grupo_Tarifario'] = match_grupo.group(1)
-            match_classe = re.search(r'(Residencial|Comercial|Industrial|Rural|Poder Público|Iluminação Pública)', classif_line_content, re.IGNORECASE)
+                dados_extraidos.definir('Grupo_Tarifario', match_grupo.group(1), classificacao_line_match)
+            match_classe = padroes_fatura.CLASSE_TARIFARIA.search(classif_line_content)
             if match_classe:
-                dados_extraidos['Classe_Tarifaria'] = match_classe.group(1)
+                dados_extraidos.definir('Classe_Tarifaria', match_classe.group(1), classificacao_line_match)
 
-        nome_match = re.search(r'(?:Monofásico|Bifásico|Trifásico)\n+([A-Z\s,.-]+)\n+(?:Leitura anterior|DATAS DE)', texto, re.DOTALL | re.IGNORECASE)
+        nome_match = busca.search(padroes_fatura.NOME_COOP_SIMILAR)
         if nome_match:
-            dados_extraidos['Nome_Razao_Social'] = nome_match.group(1).strip()
+            dados_extraidos.definir('Nome_Razao_Social', nome_match.group(1).strip(), nome_match)
 
-        endereco_rua_match = re.search(r'Proxima Leitura\n+([^\n]+) DATAS DE', texto, re.DOTALL)
+        endereco_rua_match = busca.search(padroes_fatura.ENDERECO_COOP)
         if endereco_rua_match:
-            dados_extraidos['Endereco_Rua_Numero'] = endereco_rua_match.group(1).strip()
+            dados_extraidos.definir('Endereco_Rua_Numero', endereco_rua_match.group(1).strip(), endereco_rua_match)
 
-        interior_line_match = re.search(r'(?:LEITURAS|UNIDADE CONSUMIDORA).*?\n\s*(RURAL|INTERIOR)\s*/\s*([A-Za-zÀ-ÖØ-öø-ÿ\s,.-]+)-([A-Z]{2})', texto, re.DOTALL)
+        interior_line_match = busca.search(padroes_fatura.INTERIOR_COOP_SIMILAR)
         if interior_line_match:
-            dados_extraidos['Bairro'] = interior_line_match.group(1).strip()
-            dados_extraidos['Cidade'] = interior_line_match.group(2).strip()
-            dados_extraidos['Estado'] = interior_line_match.group(3).strip()
+            dados_extraidos.definir('Bairro', interior_line_match.group(1).strip(), interior_line_match)
+            dados_extraidos.definir('Cidade', interior_line_match.group(2).strip(), interior_line_match, grupo=2)
+            dados_extraidos.definir('Estado', interior_line_match.group(3).strip(), interior_line_match, grupo=3)
 
-        match_cpf_cnpj = re.search(r'CPF/CNPJ:\s*([\d*]{3}\.[\d*]{3}\.[\d*]{3}-\d{2}|\d{2}\.[\d*]{3}\.[\d*]{3}\/\d{4}-\d{2})', texto)
+        match_cpf_cnpj = busca.search(padroes_fatura.CPF_CNPJ_COOP)
         if match_cpf_cnpj:
-            dados_extraidos['CNPJ_CPF'] = match_cpf_cnpj.group(1)
+            dados_extraidos.definir('CNPJ_CPF', match_cpf_cnpj.group(1), match_cpf_cnpj)
 
-        match_cep = re.search(r'CEP:\s*(\d{2}\s*\d{3}-\d{3})', texto)
+        match_cep = busca.search(padroes_fatura.CEP_COOP)
         if match_cep:
-            dados_extraidos['CEP'] = match_cep.group(1)
+            dados_extraidos.definir('CEP', match_cep.group(1), match_cep)
 
-        uc_match_explicit = re.search(r'UC:\s*([\d]+)[- ]', texto)
+        uc_match_explicit = busca.search(padroes_fatura.UC_EXPLICITA_COOP)
         if uc_match_explicit:
-            dados_extraidos['UC'] = uc_match_explicit.group(1).strip()
+            dados_extraidos.definir('UC', uc_match_explicit.group(1).strip(), uc_match_explicit)
         else:
-            uc_match_rota = re.search(r'UNIDADE CONSUMIDORA\n+Rota:\s*\d+,\s*Sequência:\s*\d+\s*([\d]+)', texto, re.DOTALL)
+            uc_match_rota = busca.search(padroes_fatura.UC_ROTA_COOP)
             if uc_match_rota:
-                dados_extraidos['UC'] = uc_match_rota.group(1).strip()
+                dados_extraidos.definir('UC', uc_match_rota.group(1).strip(), uc_match_rota, confianca=CONFIANCA_PADRAO_ALTERNATIVO)
             else:
-                uc_match_codigo_cliente = re.search(r'CÓDIGO DO CLIENTE\n*([\d]+)', texto)
+                uc_match_codigo_cliente = busca.search(padroes_fatura.UC_CODIGO_CLIENTE_COOP)
                 if uc_match_codigo_cliente:
-                    dados_extraidos['UC'] = uc_match_codigo_cliente.group(1).strip()
+                    dados_extraidos.definir('UC', uc_match_codigo_cliente.group(1).strip(), uc_match_codigo_cliente, confianca=CONFIANCA_PADRAO_ALTERNATIVO)
 
     except Exception as e:
         print(f"Erro ao extrair dados do sub-layout '{distributor_name} (similar Cooperluz)': {e}")
         pass
     return dados_extraidos
 
+def _layouts_coop_similar(distributor_name):
+    return [{
+        'nome': f"{distributor_name} (similar Cooperluz)",
+        'extrator': partial(_extrair_dados_layout_coop_similar_style, distributor_name=distributor_name),
+    }]
+
+# --- Layouts da RGE ---
+# Cada layout declara tokens âncora (literais) e, opcionalmente, uma assinatura completa que o confirma.
+# Os tokens de todos os layouts da distribuidora são procurados no texto já preparado (TextoFatura); só as
+# assinaturas cujos tokens obrigatórios apareceram são testadas, e o extrator escolhido é chamado uma única vez.
+RGE_LAYOUTS = [
+    {
+        'nome': 'Adriano Style',
+        'extrator': _extrair_dados_layout_adriano_style,
+        'ancoras': ('Inscrição no CNPJ:', 'Pelo CPF:'),
+        'ancoras_extras': ('UC:',),
+        'assinatura': padroes_fatura.ASSINATURA_RGE_ADRIANO,
+    },
+    {
+        'nome': 'Adroaldo/Aire Style',
+        'extrator': _extrair_dados_layout_adroaldo_style,
+        'ancoras': ('Inscrição no CNPJ:', 'CPF:'),
+        'ancoras_extras': ('Lim.',),
+        'assinatura': padroes_fatura.ASSINATURA_RGE_ADROALDO,
+    },
+    {
+        'nome': 'Arcindo Style',
+        'extrator': _extrair_dados_layout_arcindo_style,
+        'ancoras': ('DANFE - DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRÔNICA', 'CÓDIGO DA UNIDADE CONSUMIDORA:'),
+        'ancoras_extras': ('1/2',),
+        'assinatura': None,
+    },
+]
 
-def extrair_dados_fatura(caminho_pdf, distributor_type):
+# --- Registro de distribuidoras ---
+# Cada distribuidora declara os seus layouts (âncoras, assinatura e extrator), as regiões da extração rápida,
+# os campos obrigatórios e os documentos do projeto. As embutidas e os módulos do pacote distribuidoras/
+# são carregados na primeira consulta; os tokens âncora de cada uma são reunidos no registro.
+PACOTE_PLUGINS_DISTRIBUIDORAS = 'distribuidoras'
+
+_distribuidoras = {}
+_distribuidoras_carregadas = False
+_distribuidoras_lock = threading.RLock()
+
+def _tokens_ancoras(layouts):
+    # Tokens literais: a presença de cada um é conferida com "in", bem mais rápido que uma regex com
+    # alternativas sobre o texto inteiro (e tokens sobrepostos, como 'CPF:' dentro de 'Pelo CPF:', não interferem)
+    return tuple(sorted({token for layout in layouts for token in layout['ancoras'] + layout['ancoras_extras']}))
+
+def registrar_distribuidora(distribuidora):
+    distribuidora = dict(distribuidora)
+    distribuidora['layouts'] = [
+        {'ancoras': (), 'ancoras_extras': (), 'assinatura': None, **layout} for layout in distribuidora['layouts']
+    ]
+    distribuidora.setdefault('nome', distribuidora['codigo'])
+    distribuidora.setdefault('campos_obrigatorios', CAMPOS_OBRIGATORIOS_FATURA)
+    distribuidora.setdefault('exige_nome_razao_social', True)
+    distribuidora.setdefault('documentos', [])
+    distribuidora.setdefault('preparar_dados', None)
+    distribuidora.setdefault('motor_texto', EXTRACTION_TEXT_ENGINE)
+    if distribuidora['motor_texto'] not in MOTORES_TEXTO:
+        raise ValueError(f"Motor de texto '{distribuidora['motor_texto']}' desconhecido (opções: {', '.join(MOTORES_TEXTO)}).")
+    distribuidora['tokens_ancoras'] = _tokens_ancoras(distribuidora['layouts'])
+    with _distribuidoras_lock:
+        _distribuidoras[distribuidora['codigo']] = distribuidora
+    return distribuidora
+
+def _carregar_plugins_distribuidoras():
+    # Cada módulo do pacote define registrar(extrator) e devolve a declaração da distribuidora
     try:
-        with pdfplumber.open(caminho_pdf) as pdf:
-            texto = pdf.pages[0].extract_text()
-
-            if distributor_type == 'RGE':
-                is_layout_adriano_style = re.search(r'Inscrição no CNPJ: \d{2}\.\d{3}\.\d{3}\/\d{4}-\d{2}\n+([A-Z\s,.]+)\n.*?Pelo CPF:\s*\d{3}\.\d{3}\.\d{3}-\d{2}', texto, re.DOTALL)
-                is_layout_adroaldo_aire_style = re.search(r'Inscrição no CNPJ: \d{2}\.\d{3}\.\d{3}\/\d{4}-\d{2}\n+([A-Z\s,.]+)\n.*?CPF:\s*(((\*)?){6}\.\d{3}-(((\*)?){2}))', texto, re.DOTALL)
-                is_layout_arcindo_style = re.search(r'DANFE - DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRÔNICA', texto) and re.search(r'CÓDIGO DA UNIDADE CONSUMIDORA:', texto)
-
-                if is_layout_adriano_style:
-                    return _extrair_dados_layout_adriano_style(texto)
-                elif is_layout_adroaldo_aire_style:
-                    return _extrair_dados_layout_adroaldo_style(texto)
-                elif is_layout_arcindo_style:
-                    return _extrair_dados_layout_arcindo_style(texto)
-                else:
-                    extraction_functions = [
-                        (_extrair_dados_layout_adriano_style, 'Adriano Style Fallback'),
-                        (_extrair_dados_layout_adroaldo_style, 'Adroaldo/Aire Style Fallback'),
-                        (_extrair_dados_layout_arcindo_style, 'Arcindo Style Fallback')
-                    ]
-                    best_match_data = None
-                    max_found_fields = 0
-                    for func, _ in extraction_functions:
-                        current_data = func(texto)
-                        current_found_fields = sum(1 for k, v in current_data.items() if v != 'Não encontrado' and k not in ['error'])
-                        if current_found_fields > max_found_fields:
-                            max_found_fields = current_found_fields
-                            best_match_data = current_data
-                    if best_match_data and max_found_fields > 0:
-                         return best_match_data
-                    
-                    return {'error': f"Não foi possível identificar o layout da fatura RGE '{os.path.basename(caminho_pdf)}'. Layout desconhecido ou estrutura muito diferente."}
-
-            elif distributor_type == 'COOPERLUZ':
-                dados = _extrair_dados_layout_cooperluz_style(texto)
-                if dados.get('Nome_Razao_Social') == 'Não encontrado':
-                    return {'error': f"A fatura da Cooperluz '{os.path.basename(caminho_pdf)}' não pôde ser extraída. Nome/Razão Social não encontrado."}
-                return dados
-            elif distributor_type == 'CERTHIL':
-                dados = _extrair_dados_layout_coop_similar_style(texto, 'CERTHIL')
-                if dados.get('Nome_Razao_Social') == 'Não encontrado':
-                     return {'error': f"A fatura da Certhil '{os.path.basename(caminho_pdf)}' não pôde ser extraída. Nome/Razão Social não encontrado."}
-                return dados
-            elif distributor_type == 'CERMISSOES':
-                dados = _extrair_dados_layout_coop_similar_style(texto, 'CERMISSOES')
-                if dados.get('Nome_Razao_Social') == 'Não encontrado':
-                     return {'error': f"A fatura da Cermissões '{os.path.basename(caminho_pdf)}' não pôde ser extraída. Nome/Razão Social não encontrado."}
+        pacote = importlib.import_module(PACOTE_PLUGINS_DISTRIBUIDORAS)
+    except ImportError:
+        return
+    for modulo_info in pkgutil.iter_modules(pacote.__path__):
+        try:
+            modulo = importlib.import_module(f"{PACOTE_PLUGINS_DISTRIBUIDORAS}.{modulo_info.name}")
+            registrar_distribuidora(modulo.registrar(sys.modules[__name__]))
+        except Exception as e:
+            print(f"Erro ao carregar a distribuidora do módulo '{modulo_info.name}': {e}")
+
+def _carregar_distribuidoras():
+    global _distribuidoras_carregadas
+    if _distribuidoras_carregadas:
+        return
+    with _distribuidoras_lock:
+        if not _distribuidoras_carregadas:
+            _registrar_distribuidoras_embutidas()
+            _carregar_plugins_distribuidoras()
+            _distribuidoras_carregadas = True
+
+def obter_distribuidora(codigo):
+    _carregar_distribuidoras()
+    return _distribuidoras.get(codigo)
+
+def listar_distribuidoras():
+    _carregar_distribuidoras()
+    return list(_distribuidoras.values())
+
+def classificar_layout(distribuidora, texto):
+    # Devolve (layouts candidatos, confirmado_por_assinatura). Sem assinatura confirmada, os candidatos vêm
+    # do que tem mais âncoras presentes para o que tem menos (empate pela ordem de declaração)
+    ancoras_encontradas = {token for token in distribuidora['tokens_ancoras'] if token in texto}
+
+    for layout in distribuidora['layouts']:
+        if not all(token in ancoras_encontradas for token in layout['ancoras']):
+            continue
+        if layout['assinatura'] is None or layout['assinatura'].search(texto):
+            return [layout], True
+
+    pontuacoes = []
+    for ordem, layout in enumerate(distribuidora['layouts']):
+        pontuacao = sum(1 for token in layout['ancoras'] + layout['ancoras_extras'] if token in ancoras_encontradas)
+        if pontuacao:
+            pontuacoes.append((-pontuacao, ordem, layout))
+    pontuacoes.sort(key=lambda item: item[:2])
+    return [layout for _, _, layout in pontuacoes], False
+
+
+def _extrair_dados_sem_assinatura(texto, candidatos, campos_obrigatorios):
+    # Tenta os candidatos em ordem e para no primeiro que preenche os campos obrigatórios;
+    # se nenhum preencher, fica o de maior confiança somada
+    melhor = None
+    for layout in candidatos:
+        dados = layout['extrator'](texto)
+        if melhor is None or dados.confianca_total() > melhor.confianca_total():
+            melhor = dados
+        if _campos_obrigatorios_encontrados(melhor, campos_obrigatorios):
+            break
+    return melhor
+
+
+def _extrair_dados_do_texto(texto, distribuidora, nome_arquivo):
+    erro_layout = {'error': f"Não foi possível identificar o layout da fatura {distribuidora['nome']} '{nome_arquivo}'. Layout desconhecido ou estrutura muito diferente."}
+
+    # Normalizado uma única vez; a classificação e todos os extratores usam o mesmo texto
+    texto = padroes_fatura.TextoFatura(texto)
+    candidatos, confirmado_por_assinatura = classificar_layout(distribuidora, texto)
+    if not candidatos:
+        return erro_layout
+
+    if confirmado_por_assinatura:
+        dados = candidatos[0]['extrator'](texto)
+    else:
+        dados = _extrair_dados_sem_assinatura(texto, candidatos, distribuidora['campos_obrigatorios'])
+        if not dados.origens:
+            return erro_layout
+
+    if distribuidora['exige_nome_razao_social'] and 'Nome_Razao_Social' not in dados.origens:
+        return {'error': f"A fatura da {distribuidora['nome']} '{nome_arquivo}' não pôde ser extraída. Nome/Razão Social não encontrado."}
+    return dados
+
+def _campos_obrigatorios_encontrados(dados, campos_obrigatorios=CAMPOS_OBRIGATORIOS_FATURA):
+    if isinstance(dados, ResultadoExtracao):
+        return all(campo in dados.origens for campo in campos_obrigatorios)
+    return 'error' not in dados and all(dados.get(campo, VALOR_NAO_ENCONTRADO) != VALOR_NAO_ENCONTRADO for campo in campos_obrigatorios)
+
+def _status_extracao(dados, campos_obrigatorios):
+    if 'error' in dados:
+        return 'erro'
+    return 'ok' if _campos_obrigatorios_encontrados(dados, campos_obrigatorios) else 'incompleto'
+
+def _nome_arquivo_pdf(origem_pdf, nome_arquivo=None):
+    if nome_arquivo:
+        return nome_arquivo
+    if isinstance(origem_pdf, str):
+        return os.path.basename(origem_pdf)
+    return os.path.basename(getattr(origem_pdf, 'name', None) or 'fatura.pdf')
+
+def extrair_dados_fatura(origem_pdf, distributor_type, nome_arquivo=None):
+    # origem_pdf: caminho, bytes ou arquivo aberto (BytesIO, stream do upload...)
+    nome_arquivo = _nome_arquivo_pdf(origem_pdf, nome_arquivo)
+    distribuidora = obter_distribuidora(distributor_type)
+    if distribuidora is None:
+        return {'error': f"Tipo de distribuidora '{distributor_type}' desconhecido."}
+    if isinstance(origem_pdf, bytes):
+        origem_pdf = io.BytesIO(origem_pdf)
+
+    with medir_etapa('extracao_pdf', distribuidora=distributor_type) as rotulos:
+        dados = _extrair_dados_pdf(origem_pdf, distribuidora, nome_arquivo, rotulos)
+        rotulos['layout'] = getattr(dados, 'layout', 'desconhecido')
+        rotulos['resultado'] = _status_extracao(dados, distribuidora['campos_obrigatorios'])
+    return dados
+
+def _extrair_dados_pdf(origem_pdf, distribuidora, nome_arquivo, rotulos):
+    # A triagem decide, antes de qualquer análise completa, se o arquivo segue pelo texto, pelo OCR ou é recusado
+    if TRIAGEM_ENABLED:
+        try:
+            conteudo_pdf = _ler_conteudo_pdf(origem_pdf)
+        except FileNotFoundError:
+            return {'error': f"O arquivo '{nome_arquivo}' não foi encontrado."}
+        with medir_etapa('triagem') as rotulos_triagem:
+            triagem = triar_pdf(conteudo_pdf)
+            rotulos_triagem['rota'] = triagem['rota']
+        if triagem['rota'] == 'rejeitar':
+            rotulos['modo'] = 'triagem'
+            return {'error': f"O arquivo '{nome_arquivo}' {triagem['motivo']}."}
+        if triagem['rota'] == 'ocr':
+            rotulos['modo'] = 'ocr'
+            dados = _extrair_dados_por_ocr(conteudo_pdf, distribuidora, nome_arquivo)
+            if dados is None:
+                return {'error': f"A fatura '{nome_arquivo}' é uma imagem digitalizada (sem texto) e o OCR não está disponível."}
+            return dados
+        if not isinstance(origem_pdf, str):
+            origem_pdf.seek(0)
+    return _extrair_dados_camada_texto(origem_pdf, distribuidora, nome_arquivo, rotulos)
+
+def _extrair_dados_camada_texto(origem_pdf, distribuidora, nome_arquivo, rotulos):
+    motor = distribuidora['motor_texto']
+    if motor != 'pdfplumber':
+        rotulos['motor'] = motor
+        try:
+            texto = MOTORES_TEXTO[motor](origem_pdf)
+            dados = _extrair_dados_do_texto(texto, distribuidora, nome_arquivo)
+            if _campos_obrigatorios_encontrados(dados, distribuidora['campos_obrigatorios']):
+                rotulos['modo'] = 'rapido' if EXTRACTION_FAST_MODE else 'completo'
                 return dados
+        except FileNotFoundError:
+            return {'error': f"O arquivo '{nome_arquivo}' não foi encontrado."}
+        except MemoryError:
+            return {'error': f"A leitura da fatura '{nome_arquivo}' excedeu o limite de memória."}
+        except Exception as e:
+            print(f"Erro ao ler o PDF '{nome_arquivo}' com o motor {motor}, usando o pdfplumber: {e}")
+        if not isinstance(origem_pdf, str):
+            origem_pdf.seek(0)
+
+    rotulos['motor'] = 'pdfplumber'
+    try:
+        with pdfplumber.open(origem_pdf) as pdf:
+            pagina = pdf.pages[0]
+
+            # O texto rápido é o mesmo da página inteira: com campos faltando, extrair de novo não acharia outros
+            if EXTRACTION_FAST_MODE:
+                rotulos['modo'] = 'rapido'
+                texto = extrair_texto_rapido(pdf, pagina)
             else:
-                return {'error': f"Tipo de distribuidora '{distributor_type}' desconhecido."}
+                rotulos['modo'] = 'completo'
+                texto = pagina.extract_text()
+            dados = _extrair_dados_do_texto(texto, distribuidora, nome_arquivo)
+
+            # Fatura digitalizada (sem camada de texto): só então a página é renderizada e passa pelo OCR
+            if 'error' in dados and pagina_sem_texto(texto):
+                dados_ocr = _extrair_dados_por_ocr(origem_pdf, distribuidora, nome_arquivo)
+                if dados_ocr is not None:
+                    rotulos['modo'] = 'ocr'
+                    dados = dados_ocr
+            return dados
 
     except pdfplumber.pdfminer.pdfdocument.PDFSyntaxError:
-        return {'error': f"O arquivo '{os.path.basename(caminho_pdf)}' não é um PDF válido ou está corrompido."}
+        return {'error': f"O arquivo '{nome_arquivo}' não é um PDF válido ou está corrompido."}
     except FileNotFoundError:
-        return {'error': f"O arquivo '{os.path.basename(caminho_pdf)}' não foi encontrado."}
+        return {'error': f"O arquivo '{nome_arquivo}' não foi encontrado."}
+    except MemoryError:
+        return {'error': f"A leitura da fatura '{nome_arquivo}' excedeu o limite de memória."}
     except Exception as e:
         return {'error': f"Erro inesperado durante a leitura do PDF: {e}"}
 
+# --- Cache em disco dos resultados de extração (chave: SHA-256 do PDF) ---
+# Incrementar sempre que a lógica de extração mudar, para invalidar os resultados já gravados
+EXTRATOR_VERSION = '13'
+EXTRACTION_CACHE_ENABLED = os.environ.get('EXTRACTION_CACHE_ENABLED', '1') == '1'
+EXTRACTION_CACHE_DIR = os.environ.get('EXTRACTION_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'extrator_solar_cache'))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.environ.get('EXTRACTION_CACHE_MAX_ENTRIES', 5000))
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+_extraction_cache_stats = {'hits': 0, 'misses': 0}
+_extraction_cache_lock = threading.Lock()
+
+def chave_cache_extracao(conteudo_pdf, distributor_type):
+    hash_pdf = hashlib.sha256(conteudo_pdf).hexdigest()
+    return hashlib.sha256(f"{hash_pdf}:{distributor_type}:{EXTRATOR_VERSION}".encode('utf-8')).hexdigest()
+
+def _caminho_cache_extracao(chave):
+    return os.path.join(EXTRACTION_CACHE_DIR, chave[:2], f"{chave}.json")
+
+def ler_cache_extracao(chave):
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    caminho = _caminho_cache_extracao(chave)
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            dados = json.load(f)
+        # Atualiza o mtime: é ele que define a ordem LRU na remoção
+        os.utime(caminho, None)
+    except (FileNotFoundError, ValueError, OSError):
+        with _extraction_cache_lock:
+            _extraction_cache_stats['misses'] += 1
+        return None
+    with _extraction_cache_lock:
+        _extraction_cache_stats['hits'] += 1
+    return dados
+
+def gravar_cache_extracao(chave, dados):
+    # Erros não são guardados: a mesma fatura pode ser extraída com sucesso depois de uma correção
+    if not EXTRACTION_CACHE_ENABLED or 'error' in dados:
+        return
+    caminho = _caminho_cache_extracao(chave)
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        caminho_temp = f"{caminho}.{uuid.uuid4().hex}.tmp"
+        with open(caminho_temp, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, ensure_ascii=False)
+        os.replace(caminho_temp, caminho)
+        _remover_excedentes_cache_extracao()
+    except OSError as e:
+        print(f"Erro ao gravar o cache de extração: {e}")
+
+def _listar_cache_extracao():
+    entradas = []
+    if not os.path.isdir(EXTRACTION_CACHE_DIR):
+        return entradas
+    for subdir in os.scandir(EXTRACTION_CACHE_DIR):
+        if not subdir.is_dir():
+            continue
+        for entrada in os.scandir(subdir.path):
+            if entrada.name.endswith('.json'):
+                try:
+                    stat = entrada.stat()
+                except FileNotFoundError:
+                    continue
+                entradas.append((stat.st_mtime, stat.st_size, entrada.path))
+    return entradas
+
+def _remover_excedentes_cache_extracao():
+    entradas = _listar_cache_extracao()
+    total_bytes = sum(tamanho for _, tamanho, _ in entradas)
+    if len(entradas) <= EXTRACTION_CACHE_MAX_ENTRIES and total_bytes <= EXTRACTION_CACHE_MAX_BYTES:
+        return
+    entradas.sort()
+    while entradas and (len(entradas) > EXTRACTION_CACHE_MAX_ENTRIES or total_bytes > EXTRACTION_CACHE_MAX_BYTES):
+        _, tamanho, caminho = entradas.pop(0)
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+        total_bytes -= tamanho
+
+def get_extraction_cache_stats():
+    entradas = _listar_cache_extracao()
+    with _extraction_cache_lock:
+        hits = _extraction_cache_stats['hits']
+        misses = _extraction_cache_stats['misses']
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        'entries': len(entradas),
+        'bytes': sum(tamanho for _, tamanho, _ in entradas),
+        'extrator_version': EXTRATOR_VERSION,
+    }
+
+def extrair_dados_fatura_com_cache(origem_pdf, distributor_type, nome_arquivo=None):
+    nome_arquivo = _nome_arquivo_pdf(origem_pdf, nome_arquivo)
+    if isinstance(origem_pdf, bytes):
+        conteudo_pdf = origem_pdf
+    elif isinstance(origem_pdf, str):
+        try:
+            with open(origem_pdf, 'rb') as f:
+                conteudo_pdf = f.read()
+        except FileNotFoundError:
+            return {'error': f"O arquivo '{nome_arquivo}' não foi encontrado."}
+    else:
+        conteudo_pdf = origem_pdf.read()
+
+    chave = chave_cache_extracao(conteudo_pdf, distributor_type)
+    dados_em_cache = ler_cache_extracao(chave)
+    if dados_em_cache is not None:
+        return dados_em_cache
+
+    dados_fatura = extrair_dados_fatura_isolada(conteudo_pdf, distributor_type, nome_arquivo)
+    gravar_cache_extracao(chave, dados_fatura)
+    return dados_fatura
+
+# --- OCR das faturas digitalizadas (sem camada de texto) ---
+# A página é renderizada com o pypdfium2 e lida pelo Tesseract (executável local, chamado via subprocess).
+# Só é acionado quando o texto da página fica abaixo de OCR_MIN_CARACTERES; o texto reconhecido passa
+# pelos mesmos extratores de layout e fica em cache pelo SHA-256 do PDF. Roda no processo que lê a fatura
+# (o da sandbox, quando ligada): a concorrência é a da extração e o Tesseract tem o próprio timeout.
+OCR_ENABLED = os.environ.get('OCR_ENABLED', '1') == '1'
+OCR_TESSERACT_CMD = os.environ.get('OCR_TESSERACT_CMD', 'tesseract')
+OCR_LANG = os.environ.get('OCR_LANG', 'por')
+OCR_DPI = int(os.environ.get('OCR_DPI', 300))
+OCR_MIN_CARACTERES = int(os.environ.get('OCR_MIN_CARACTERES', 30))
+OCR_TIMEOUT_SECONDS = int(os.environ.get('OCR_TIMEOUT_SECONDS', 60))
+
+def pagina_sem_texto(texto):
+    return len(re.sub(r'\s+', '', texto or '')) < OCR_MIN_CARACTERES
+
+def ocr_disponivel():
+    return OCR_ENABLED and shutil.which(OCR_TESSERACT_CMD) is not None
+
+def executar_ocr_pdf(conteudo_pdf):
+    documento = pdfium.PdfDocument(conteudo_pdf)
+    try:
+        imagem = documento[0].render(scale=OCR_DPI / 72, grayscale=True).to_pil()
+    finally:
+        documento.close()
+    imagem_png = io.BytesIO()
+    imagem.save(imagem_png, 'PNG')
+    # --psm 6: lê a página como um bloco único, linha a linha, na mesma ordem do texto do pdfplumber
+    resultado = subprocess.run(
+        [OCR_TESSERACT_CMD, 'stdin', 'stdout', '-l', OCR_LANG, '--psm', '6'],
+        input=imagem_png.getvalue(), capture_output=True, timeout=OCR_TIMEOUT_SECONDS, check=True
+    )
+    return resultado.stdout.decode('utf-8', errors='replace')
+
+def _chave_cache_ocr(conteudo_pdf):
+    hash_pdf = hashlib.sha256(conteudo_pdf).hexdigest()
+    return hashlib.sha256(f"ocr:{hash_pdf}:{OCR_LANG}:{OCR_DPI}".encode('utf-8')).hexdigest()
+
+def _ler_cache_ocr(chave):
+    # Mesma pasta (e mesmo limite LRU) do cache de extração, mas fora das estatísticas de hits/misses
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    caminho = _caminho_cache_extracao(chave)
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            texto = json.load(f)['texto']
+        os.utime(caminho, None)
+    except (FileNotFoundError, ValueError, KeyError, OSError):
+        return None
+    return texto
+
+def _gravar_cache_ocr(chave, texto):
+    if not EXTRACTION_CACHE_ENABLED:
+        return
+    caminho = _caminho_cache_extracao(chave)
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        caminho_temp = f"{caminho}.{uuid.uuid4().hex}.tmp"
+        with open(caminho_temp, 'w', encoding='utf-8') as f:
+            json.dump({'texto': texto}, f, ensure_ascii=False)
+        os.replace(caminho_temp, caminho)
+        _remover_excedentes_cache_extracao()
+    except OSError as e:
+        print(f"Erro ao gravar o cache de OCR: {e}")
+
+def _ler_conteudo_pdf(origem_pdf):
+    if isinstance(origem_pdf, bytes):
+        return origem_pdf
+    if isinstance(origem_pdf, str):
+        with open(origem_pdf, 'rb') as f:
+            return f.read()
+    origem_pdf.seek(0)
+    return origem_pdf.read()
+
+def extrair_texto_ocr(conteudo_pdf):
+    chave = _chave_cache_ocr(conteudo_pdf)
+    texto = _ler_cache_ocr(chave)
+    if texto is not None:
+        return texto
+
+    with medir_etapa('ocr') as rotulos:
+        try:
+            texto = executar_ocr_pdf(conteudo_pdf)
+        except Exception as e:
+            rotulos['resultado'] = 'erro'
+            print(f"Erro no OCR da fatura: {e}")
+            return None
+        rotulos['resultado'] = 'ok'
+
+    _gravar_cache_ocr(chave, texto)
+    return texto
+
+def _extrair_dados_por_ocr(origem_pdf, distribuidora, nome_arquivo):
+    # None = OCR indisponível ou com falha; quem chamou mantém o erro da extração pelo texto
+    if not ocr_disponivel():
+        return None
+    texto = extrair_texto_ocr(_ler_conteudo_pdf(origem_pdf))
+    if texto is None:
+        return None
+    return _extrair_dados_do_texto(texto, distribuidora, nome_arquivo)
+
+# --- Triagem do PDF: texto, OCR ou rejeição em poucos milissegundos ---
+# Lê só o cabeçalho, o trailer/xref (ao abrir com o pdfium) e a lista de objetos da primeira página, sem
+# extrair texto: arquivos que não são PDF, protegidos por senha, sem páginas ou em branco não chegam aos
+# motores de texto, e as faturas só com imagem vão direto para o OCR.
+TRIAGEM_ENABLED = os.environ.get('TRIAGEM_ENABLED', '1') == '1'
+
+def triar_pdf(conteudo_pdf):
+    triagem = {'rota': 'rejeitar', 'motivo': 'não é um PDF válido ou está corrompido', 'paginas': 0,
+               'criptografado': False, 'objetos_texto': 0, 'fontes': 0, 'imagens': 0}
+    if b'%PDF-' not in conteudo_pdf[:1024]:
+        return triagem
+
+    try:
+        documento = pdfium.PdfDocument(conteudo_pdf)
+    except pdfium.PdfiumError as e:
+        if getattr(e, 'err_code', None) == pdfium_raw.FPDF_ERR_PASSWORD:
+            triagem['motivo'] = 'está protegido por senha'
+        return triagem
+
+    try:
+        triagem['paginas'] = len(documento)
+        # Criptografado sem senha de abertura (só restrições de impressão/cópia) é lido normalmente
+        triagem['criptografado'] = pdfium_raw.FPDF_GetSecurityHandlerRevision(documento) != -1
+        if not triagem['paginas']:
+            triagem['motivo'] = 'não tem páginas'
+            return triagem
+
+        fontes = set()
+        for objeto in documento[0].get_objects():
+            if objeto.type == pdfium_raw.FPDF_PAGEOBJ_TEXT:
+                triagem['objetos_texto'] += 1
+                fontes.add(ctypes.cast(pdfium_raw.FPDFTextObj_GetFont(objeto.raw), ctypes.c_void_p).value)
+            elif objeto.type == pdfium_raw.FPDF_PAGEOBJ_IMAGE:
+                triagem['imagens'] += 1
+        triagem['fontes'] = len(fontes)
+    except pdfium.PdfiumError:
+        return triagem
+    finally:
+        documento.close()
+
+    if triagem['objetos_texto']:
+        triagem['rota'], triagem['motivo'] = 'texto', ''
+    elif triagem['imagens']:
+        triagem['rota'], triagem['motivo'] = 'ocr', ''
+    else:
+        triagem['motivo'] = 'não tem texto nem imagem na primeira página'
+    return triagem
+
 # --- Função auxiliar para parsear endereço para o Excel ---
 def parse_address_for_excel(full_address):
     street = full_address
@@ -595,27 +1308,24 @@ TABELA_PARAMETROS_INVERSOR_AC = [
     {'min_power': 60.0, 'max_power': 75.0, 'DISJUNTOR_CA': 'Verificação pontual', 'DISJ_CA_ATEN': 'Verificação pontual', 'DISJ_CA_INTR': 'Verificação pontual', 'DISJ_CA_TENS': 'Verificação pontual', 'CABO_CA': 'Verificação pontual'},
 ]
 
-def get_ac_parameters_by_inverter_power(potencia_inversor_kw):
+# Faixas ordenadas e sem sobreposição: a faixa de uma potência é a última com min_power <= potência
+# (busca binária), desde que a potência não passe do max_power dela (há intervalos entre faixas)
+CAMPOS_PARAMETROS_AC = ('CABO_CA', 'DISJUNTOR_CA', 'DISJ_CA_TENS', 'DISJ_CA_INTR', 'DISJ_CA_ATEN')
+_INICIOS_FAIXAS_INVERSOR_AC = [linha['min_power'] for linha in TABELA_PARAMETROS_INVERSOR_AC]
+_PARAMETROS_AC_POR_FAIXA = [{campo: linha[campo] for campo in CAMPOS_PARAMETROS_AC} for linha in TABELA_PARAMETROS_INVERSOR_AC]
+_PARAMETROS_AC_NAO_CALCULADO = {campo: 'Não calculado' for campo in CAMPOS_PARAMETROS_AC}
+_PARAMETROS_AC_FORA_DA_FAIXA = {campo: 'Fora da faixa (0-75kW)' for campo in CAMPOS_PARAMETROS_AC}
+
+def _parametros_ac_da_potencia(potencia_inversor_kw):
     if not isinstance(potencia_inversor_kw, (int, float)):
-        return {
-            'CABO_CA': 'Não calculado', 'DISJUNTOR_CA': 'Não calculado',
-            'DISJ_CA_TENS': 'Não calculado', 'DISJ_CA_INTR': 'Não calculado',
-            'DISJ_CA_ATEN': 'Não calculado'
-        }
+        return _PARAMETROS_AC_NAO_CALCULADO
+    indice = bisect.bisect_right(_INICIOS_FAIXAS_INVERSOR_AC, potencia_inversor_kw) - 1
+    if indice >= 0 and potencia_inversor_kw <= TABELA_PARAMETROS_INVERSOR_AC[indice]['max_power']:
+        return _PARAMETROS_AC_POR_FAIXA[indice]
+    return _PARAMETROS_AC_FORA_DA_FAIXA
 
-    for linha in TABELA_PARAMETROS_INVERSOR_AC:
-        if linha['min_power'] <= potencia_inversor_kw <= linha['max_power']:
-            return {
-                'CABO_CA': linha['CABO_CA'], 'DISJUNTOR_CA': linha['DISJUNTOR_CA'],
-                'DISJ_CA_TENS': linha['DISJ_CA_TENS'], 'DISJ_CA_INTR': linha['DISJ_CA_INTR'],
-                'DISJ_CA_ATEN': linha['DISJ_CA_ATEN']
-            }
-    
-    return {
-        'CABO_CA': 'Fora da faixa (0-75kW)', 'DISJUNTOR_CA': 'Fora da faixa (0-75kW)',
-        'DISJ_CA_TENS': 'Fora da faixa (0-75kW)', 'DISJ_CA_INTR': 'Fora da faixa (0-75kW)',
-        'DISJ_CA_ATEN': 'Fora da faixa (0-75kW)'
-    }
+def get_ac_parameters_by_inverter_power(potencia_inversor_kw):
+    return dict(_parametros_ac_da_potencia(potencia_inversor_kw))
 
 # --- FUNÇÃO PARA CALCULAR VARIÁVEIS DO SISTEMA EM PYTHON ---
 def calculate_system_variables(all_data):
@@ -670,6 +1380,79 @@ def calculate_system_variables(all_data):
 
     return calculated_data
 
+# --- Conversão dos valores digitados no formulário (também usada no dimensionamento em lote) ---
+CAMPOS_FORMULARIO_DECIMAIS = {
+    'CARGA_INSTALADA', 'POTENCIA_MODULO_MANUAL', 'POTENCIA_INVERSOR_MANUAL',
+    'LATITUDE', 'LONGITUDE', 'AREA_ARRANJOS_CALCULADO',
+}
+CAMPOS_FORMULARIO_INTEIROS = {'QUANTIDADE_PLACAS_MANUAL', 'QUANTIDADE_INVERSOR_MANUAL', 'ART'}
+
+def converter_valor_formulario(key, value):
+    processed_value = value.strip() if isinstance(value, str) else value
+
+    if key in CAMPOS_FORMULARIO_DECIMAIS:
+        if processed_value:
+            try:
+                return float(str(processed_value).replace(',', '.'))
+            except ValueError:
+                return processed_value
+        return None
+    elif key in CAMPOS_FORMULARIO_INTEIROS:
+        if processed_value and str(processed_value).isdigit():
+            return int(processed_value)
+        return processed_value
+    return processed_value
+
+# --- Dimensionamento em lote (muitos projetos/leads de uma vez) ---
+CAMPOS_DIMENSIONAMENTO = [
+    'NUMERO_FASES_CALCULADO', 'RAMAL_ENTRADA_CALCULADO', 'DISJUNTOR_CALCULADO',
+    'POTENCIA_PICO_MODULOS', 'POTENCIA_TOTAL_SISTEMA_KWP',
+] + list(CAMPOS_PARAMETROS_AC)
+
+# Únicos campos de entrada dos quais CAMPOS_DIMENSIONAMENTO dependem em calculate_system_variables
+CAMPOS_ENTRADA_DIMENSIONAMENTO = (
+    'CATEGORIA', 'QUANTIDADE_PLACAS_MANUAL', 'POTENCIA_MODULO_MANUAL',
+    'QUANTIDADE_INVERSOR_MANUAL', 'POTENCIA_INVERSOR_MANUAL',
+)
+_CAMPO_AUSENTE = object()
+
+def dimensionar_projetos_em_lote(registros):
+    # registros: lista de dicts (linhas de um CSV ou JSON) com os mesmos nomes de campo do formulário.
+    # O resultado de cada linha é idêntico ao de calculate_system_variables para o mesmo projeto;
+    # só as entradas do dimensionamento são convertidas e cada combinação distinta é calculada uma
+    # única vez (leads repetem poucas categorias/potências)
+    cache = {}
+    resultados = []
+    for registro in registros:
+        entradas = tuple(registro.get(campo, _CAMPO_AUSENTE) for campo in CAMPOS_ENTRADA_DIMENSIONAMENTO)
+        try:
+            calculados = cache.get(entradas)
+        except TypeError:
+            entradas = tuple(map(repr, entradas))
+            calculados = cache.get(entradas)
+
+        if calculados is None:
+            dados = {campo: converter_valor_formulario(campo, registro[campo])
+                     for campo in CAMPOS_ENTRADA_DIMENSIONAMENTO if campo in registro}
+            calculados = calculate_system_variables(dados)
+            calculados = cache[entradas] = {campo: calculados[campo] for campo in CAMPOS_DIMENSIONAMENTO}
+
+        linha = dict(registro)
+        linha.update(calculados)
+        resultados.append(linha)
+    return resultados
+
+class _CsvPontoEVirgula(csv.excel):
+    delimiter = ';'
+
+def ler_registros_csv(conteudo):
+    texto = conteudo.decode('utf-8-sig') if isinstance(conteudo, bytes) else conteudo
+    try:
+        dialeto = csv.Sniffer().sniff(texto[:4096], delimiters=';,\t')
+    except csv.Error:
+        dialeto = _CsvPontoEVirgula
+    return list(csv.DictReader(io.StringIO(texto), dialect=dialeto))
+
 # --- Mapeamento de campos internos para células do Excel (Planilha Projetos FV) ---
 EXCEL_PROJETO_FV_CELL_MAPPING = {
     'Nome_Razao_Social': 'B2', 'Endereco_Rua': 'C2', 'Numero_Endereco': 'D2', 'Bairro': 'E2',
@@ -739,8 +1522,23 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 app.secret_key = 'supersecretkey'
 
+@app.context_processor
+def _distribuidoras_nos_templates():
+    # Os seletores de distribuidora dos formulários vêm do registro
+    return {'distribuidoras': listar_distribuidoras()}
+
 ALLOWED_EXTENSIONS = {'pdf'}
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_BATCH_EXTENSIONS = {'pdf', 'zip'}
+
+# --- Configuração do processamento em lote de faturas ---
+BATCH_MAX_CONTENT_LENGTH = int(os.environ.get('BATCH_MAX_CONTENT_LENGTH', 256 * 1024 * 1024))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', os.cpu_count() or 2))
+# Limites dos ZIPs do lote, conferidos antes de descompactar (tamanhos declarados no próprio ZIP; o zipfile
+# não entrega mais bytes do que o declarado). Um ZIP que passe de qualquer um deles recusa o lote inteiro.
+BATCH_ZIP_MAX_MEMBERS = int(os.environ.get('BATCH_ZIP_MAX_MEMBERS', 500))
+BATCH_ZIP_MAX_MEMBER_SIZE = int(os.environ.get('BATCH_ZIP_MAX_MEMBER_SIZE', 50 * 1024 * 1024))
+BATCH_ZIP_MAX_TOTAL_SIZE = int(os.environ.get('BATCH_ZIP_MAX_TOTAL_SIZE', 512 * 1024 * 1024))
 
 EXCEL_PROJETO_FV_TEMPLATE_FILENAME = 'Planilha Projetos FV.xlsx'
 EXCEL_PROJETO_FV_TEMPLATE_PATH = os.path.join(app.root_path, 'templates', EXCEL_PROJETO_FV_TEMPLATE_FILENAME)
@@ -784,77 +1582,253 @@ if not os.path.exists(CERTIDAO_REGISTRO_PROFISSIONAL_PATH):
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+# --- Registro de templates: cada arquivo é carregado uma vez por worker e recarregado quando o mtime muda ---
+class RegistroTemplates:
+    def __init__(self, carregar):
+        self._carregar = carregar
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def obter(self, caminho):
+        mtime = os.path.getmtime(caminho)
+        with self._lock:
+            entrada = self._templates.get(caminho)
+            if entrada is None or entrada[0] != mtime:
+                self.misses += 1
+                entrada = (mtime, self._carregar(caminho))
+                self._templates[caminho] = entrada
+            else:
+                self.hits += 1
+            return entrada[1]
+
+    def limpar(self):
+        with self._lock:
+            self._templates.clear()
+
+def _copiar_workbook(workbook):
+    # copy.deepcopy sozinho devolve as IndexedList de estilos do openpyxl vazias (o __dict__ é restaurado antes
+    # dos itens e o append os descarta), então elas são copiadas à parte e registradas no memo
+    memo = {}
+    for valor in vars(workbook).values():
+        if isinstance(valor, IndexedList):
+            copia = IndexedList()
+            list.extend(copia, copy.deepcopy(list(valor), memo))
+            copia._dict = copy.deepcopy(valor._dict, memo)
+            copia.clean = valor.clean
+            memo[id(valor)] = copia
+    return copy.deepcopy(workbook, memo)
+
+_registro_workbooks = RegistroTemplates(openpyxl.load_workbook)
+
+def carregar_workbook_template(caminho):
+    # O workbook do registro nunca é alterado: cada requisição recebe uma cópia própria
+    with medir_etapa('carregar_workbook', documento=os.path.basename(caminho)):
+        return _copiar_workbook(_registro_workbooks.obter(caminho))
+
+# --- Índice de placeholders dos formulários Excel (Anexo F e Anexo I) ---
+# Montado uma vez no carregamento do template: o preenchimento escreve só nas células indexadas.
+def _indexar_placeholders(sheet, mapeamento_placeholders):
+    indice = []
+    for row in sheet.iter_rows():
+        for cell in row:
+            if cell.value and isinstance(cell.value, str):
+                cell_text_standardized = cell.value.strip().upper()
+                if cell_text_standardized in mapeamento_placeholders:
+                    indice.append((cell.coordinate, mapeamento_placeholders[cell_text_standardized], cell.font.name, cell.font.size))
+    return indice
+
+def _carregar_formulario_excel(caminho, sheet_name, mapeamento_placeholders):
+    workbook = openpyxl.load_workbook(caminho)
+    if sheet_name not in workbook.sheetnames:
+        return workbook, None
+    return workbook, _indexar_placeholders(workbook[sheet_name], mapeamento_placeholders)
+
+_registro_anexo_f = RegistroTemplates(lambda caminho: _carregar_formulario_excel(caminho, ANEXO_F_SHEET_NAME, ANEXO_F_PLACEHOLDER_TO_PYTHON_VAR))
+_registro_anexo_i = RegistroTemplates(lambda caminho: _carregar_formulario_excel(caminho, ANEXO_I_SHEET_NAME, ANEXO_I_PLACEHOLDER_TO_PYTHON_VAR))
+
+def carregar_formulario_excel(registro, caminho):
+    with medir_etapa('carregar_workbook', documento=os.path.basename(caminho)):
+        workbook, indice = registro.obter(caminho)
+        return _copiar_workbook(workbook), indice
+
+def _aplicar_fonte_preenchimento(cell, font_name, font_size):
+    cell.font = openpyxl.styles.Font(color='00000000', name=font_name, size=font_size)
+
+def preencher_anexo_f(sheet, indice, all_input_data):
+    for coordinate, python_var_name, font_name, font_size in indice:
+        cell = sheet[coordinate]
+        value_to_write = all_input_data.get(python_var_name)
+
+        if python_var_name == 'FULL_ADDRESS_COMPOSED':
+            rua_num_completo = all_input_data.get('Endereco_Rua_Numero', '')
+            bairro_comp = all_input_data.get('Bairro', '')
+            rua_parsed, numero_parsed = parse_address_for_excel(str(rua_num_completo))
+            full_address_str = f"{rua_parsed}"
+            if numero_parsed:
+                full_address_str += f", {numero_parsed}"
+            if bairro_comp:
+                full_address_str += f" - {bairro_comp}"
+            cell.value = full_address_str.strip(' ,-')
+        elif python_var_name in DATE_KEYS_FOR_FORMATTING:
+            if value_to_write:
+                try:
+                    dt_obj = datetime.strptime(str(value_to_write), '%Y-%m-%d')
+                except ValueError:
+                    try:
+                        dt_obj = datetime.strptime(str(value_to_write), '%d/%m/%Y')
+                    except ValueError:
+                        dt_obj = None
+                if dt_obj:
+                    cell.number_format = 'DD/MM/YYYY'
+                    cell.value = dt_obj
+                else:
+                    cell.value = str(value_to_write)
+            else:
+                cell.value = ''
+        elif python_var_name in NUMERIC_KEYS_FOR_FORMATTING:
+            # LATITUDE e LONGITUDE como string formatada com ponto e 6 casas decimais
+            if python_var_name in ['LATITUDE', 'LONGITUDE']:
+                if value_to_write is not None:
+                    try:
+                        float_val = float(str(value_to_write).replace(',', '.'))
+                        cell.value = f"{float_val:.6f}"
+                    except ValueError:
+                        cell.value = str(value_to_write)
+                else:
+                    cell.value = ''
+            else:
+                # Para os outros campos numéricos, mantém a formatação existente (2 casas, vírgula)
+                cell.value = format_value_for_display(value_to_write, is_numeric=True)
+        else:
+            cell.value = str(value_to_write) if value_to_write is not None else ''
+
+        _aplicar_fonte_preenchimento(cell, font_name, font_size)
+
+def preencher_anexo_i(sheet, indice, all_input_data):
+    for coordinate, python_var_name, font_name, font_size in indice:
+        cell = sheet[coordinate]
+        value_to_write = all_input_data.get(python_var_name)
+
+        if python_var_name in DATE_KEYS_FOR_FORMATTING:
+            if value_to_write:
+                try:
+                    dt_obj = datetime.strptime(value_to_write, '%d/%m/%Y')
+                    cell.number_format = 'DD/MM/YYYY'
+                    cell.value = dt_obj
+                except ValueError:
+                    cell.value = str(value_to_write)
+            else:
+                cell.value = ''
+        elif python_var_name in NUMERIC_KEYS_FOR_FORMATTING:
+            cell.value = format_value_for_display(value_to_write, is_numeric=True)
+        else:
+            cell.value = str(value_to_write) if value_to_write is not None else ''
+
+        _aplicar_fonte_preenchimento(cell, font_name, font_size)
+
 # --- FUNÇÃO PARA SUBSTITUIR PLACEHOLDERS NO DOCX COM PRESERVAÇÃO DE FORMATO ---
-def replace_docx_placeholders(doc_path, replacements):
-    document = Document(doc_path)
-    bold_keys = ['NOME_RAZAO_SOCIAL', 'CPF_CNPJ', 'UC']
+DOCX_BOLD_KEYS = ['NOME_RAZAO_SOCIAL', 'CPF_CNPJ', 'UC']
+DOCX_PLACEHOLDER_REGEX = re.compile(r'\{\{([^{}]+)\}\}')
+
+def _substituir_placeholders_paragrafo(p, replacements):
+    original_full_text = p.text
 
-    def process_text_block(text_block_container):
-        for p in text_block_container.paragraphs:
-            if not p.text.strip():
+    default_run_format = {
+        'bold': None, 'italic': None, 'font_name': None, 'font_size': None, 'underline': None
+    }
+    if p.runs:
+        first_run = p.runs[0]
+        default_run_format['bold'] = first_run.bold
+        default_run_format['italic'] = first_run.italic
+        default_run_format['font_name'] = first_run.font.name
+        default_run_format['font_size'] = first_run.font.size
+        default_run_format['underline'] = first_run.underline
+
+    final_segments_for_runs = []
+    last_idx = 0
+    for match in DOCX_PLACEHOLDER_REGEX.finditer(original_full_text):
+        placeholder_key = match.group(1)
+        if placeholder_key not in replacements:
+            continue
+        if match.start() > last_idx:
+            final_segments_for_runs.append((original_full_text[last_idx:match.start()], False, None))
+        final_segments_for_runs.append((str(replacements[placeholder_key]), True, placeholder_key))
+        last_idx = match.end()
+
+    if last_idx < len(original_full_text):
+        final_segments_for_runs.append((original_full_text[last_idx:], False, None))
+
+    for i in range(len(p.runs) - 1, -1, -1):
+        p.runs[i]._element.getparent().remove(p.runs[i]._element)
+
+    for text, is_replaced, placeholder_key in final_segments_for_runs:
+        if text:
+            new_run = p.add_run(text)
+            new_run.bold = default_run_format['bold']
+            new_run.italic = default_run_format['italic']
+            new_run.font.name = default_run_format['font_name']
+            new_run.font.size = default_run_format['font_size']
+            new_run.underline = default_run_format['underline']
+
+            if is_replaced and placeholder_key in DOCX_BOLD_KEYS:
+                new_run.bold = True
+
+def _iterar_paragrafos_docx(document):
+    # Localização: (None, índice do parágrafo) no corpo ou ((tabela, linha, célula), índice) dentro de tabelas
+    for indice_paragrafo, p in enumerate(document.paragraphs):
+        yield (None, indice_paragrafo), p
+
+    for indice_tabela, table in enumerate(document.tables):
+        celulas_vistas = set()
+        for indice_linha, row in enumerate(table.rows):
+            for indice_celula, cell in enumerate(row.cells):
+                # Células mescladas aparecem repetidas em row.cells (mesmo elemento <w:tc>)
+                if cell._tc in celulas_vistas:
+                    continue
+                celulas_vistas.add(cell._tc)
+                for indice_paragrafo, p in enumerate(cell.paragraphs):
+                    yield ((indice_tabela, indice_linha, indice_celula), indice_paragrafo), p
+
+class TemplateDocxCompilado:
+    # Guarda os bytes do template e a posição de cada parágrafo com {{CHAVE}};
+    # a renderização só visita esses parágrafos
+    def __init__(self, caminho):
+        with open(caminho, 'rb') as f:
+            self._conteudo = f.read()
+
+        self.localizacoes = []
+        for localizacao, p in _iterar_paragrafos_docx(Document(io.BytesIO(self._conteudo))):
+            chaves = frozenset(match.group(1) for match in DOCX_PLACEHOLDER_REGEX.finditer(p.text))
+            if chaves:
+                self.localizacoes.append((localizacao, chaves))
+
+    def renderizar(self, replacements):
+        document = Document(io.BytesIO(self._conteudo))
+        paragrafos_corpo = None
+        tabelas = None
+
+        for (celula, indice_paragrafo), chaves in self.localizacoes:
+            if chaves.isdisjoint(replacements):
                 continue
+            if celula is None:
+                if paragrafos_corpo is None:
+                    paragrafos_corpo = document.paragraphs
+                p = paragrafos_corpo[indice_paragrafo]
+            else:
+                if tabelas is None:
+                    tabelas = document.tables
+                indice_tabela, indice_linha, indice_celula = celula
+                p = tabelas[indice_tabela].rows[indice_linha].cells[indice_celula].paragraphs[indice_paragrafo]
+            _substituir_placeholders_paragrafo(p, replacements)
 
-            original_full_text = p.text
-            
-            default_run_format = {
-                'bold': None, 'italic': None, 'font_name': None, 'font_size': None, 'underline': None
-            }
-            if p.runs:
-                first_run = p.runs[0]
-                default_run_format['bold'] = first_run.bold
-                default_run_format['italic'] = first_run.italic
-                default_run_format['font_name'] = first_run.font.name
-                default_run_format['font_size'] = first_run.font.size
-                default_run_format['underline'] = first_run.underline
-
-            final_segments_for_runs = []
-            
-            placeholder_patterns = [re.escape('{{' + key + '}}') for key in replacements.keys()]
-            combined_pattern = '|'.join(placeholder_patterns)
-            
-            last_idx = 0
-            if combined_pattern:
-                for match in re.finditer(combined_pattern, original_full_text):
-                    if match.start() > last_idx:
-                        final_segments_for_runs.append((original_full_text[last_idx:match.start()], False, None))
-                    
-                    matched_placeholder = match.group(0)
-                    placeholder_key = matched_placeholder.strip('{}')
-                    
-                    value_to_insert = replacements.get(placeholder_key, matched_placeholder)
-                    final_segments_for_runs.append((str(value_to_insert), True, placeholder_key))
-                    
-                    last_idx = match.end()
-            
-            if last_idx < len(original_full_text):
-                final_segments_for_runs.append((original_full_text[last_idx:], False, None))
-
-            if not (final_segments_for_runs and any(s[1] for s in final_segments_for_runs)) and not combined_pattern:
-                return 
-
-            for i in range(len(p.runs) - 1, -1, -1):
-                p.runs[i]._element.getparent().remove(p.runs[i]._element)
-
-            for text, is_replaced, placeholder_key in final_segments_for_runs:
-                if text:
-                    new_run = p.add_run(text)
-                    new_run.bold = default_run_format['bold']
-                    new_run.italic = default_run_format['italic']
-                    new_run.font.name = default_run_format['font_name']
-                    new_run.font.size = default_run_format['font_size']
-                    new_run.underline = default_run_format['underline']
-
-                    if is_replaced and placeholder_key in bold_keys:
-                        new_run.bold = True
-    
-    process_text_block(document)
+        return document
 
-    for table in document.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                process_text_block(cell)
+_registro_docx = RegistroTemplates(TemplateDocxCompilado)
 
-    return document
+def replace_docx_placeholders(doc_path, replacements):
+    return _registro_docx.obter(doc_path).renderizar(replacements)
 
 # --- FUNÇÃO PARA GERAR CONTEÚDO DO TXT DA ART ---
 def generate_art_txt_content(data):
@@ -947,16 +1921,65 @@ LATITUDE_GMS: {data.get('LATITUDE_GMS', 'Não informado')}
 LONGITUDE_GMS: {data.get('LONGITUDE_GMS', 'Não informado')}
 """
 
+# --- Pré-processamento das fotos do PDF ---
+# Fotos de celular chegam com 12 MP ou mais; no A4 basta a resolução do quadro em IMAGE_PDF_TARGET_DPI.
+IMAGE_PDF_TARGET_DPI = int(os.environ.get('IMAGE_PDF_TARGET_DPI', 150))
+IMAGE_PDF_JPEG_QUALITY = int(os.environ.get('IMAGE_PDF_JPEG_QUALITY', 80))
+_EXIF_ORIENTATION_TAG = 0x0112
+_EXIF_ORIENTACOES_ROTACIONADAS = {5, 6, 7, 8}
+
+def _tamanho_quadro_imagem(largura, altura, max_width, max_height):
+    # Mesmo critério de antes: pixels tratados como pontos, reduzindo só o que não cabe na página
+    if largura > max_width or altura > max_height:
+        scale_factor = min(max_width / largura, max_height / altura)
+        return largura * scale_factor, altura * scale_factor
+    return largura, altura
+
+def preparar_imagem_para_pdf(origem_imagem, max_width, max_height):
+    if isinstance(origem_imagem, bytes):
+        origem_imagem = io.BytesIO(origem_imagem)
+    with Image.open(origem_imagem) as pil_img:
+        largura, altura = pil_img.size
+        rotacionada = pil_img.getexif().get(_EXIF_ORIENTATION_TAG) in _EXIF_ORIENTACOES_ROTACIONADAS
+        if rotacionada:
+            largura, altura = altura, largura
+
+        img_width, img_height = _tamanho_quadro_imagem(largura, altura, max_width, max_height)
+        alvo = (max(1, round(img_width / 72 * IMAGE_PDF_TARGET_DPI)), max(1, round(img_height / 72 * IMAGE_PDF_TARGET_DPI)))
+
+        # JPEG: o decodificador já reduz em 1/2, 1/4 ou 1/8 durante a leitura (uma única decodificação)
+        pil_img.draft('RGB', (alvo[1], alvo[0]) if rotacionada else alvo)
+        imagem = ImageOps.exif_transpose(pil_img)
+
+        if imagem.mode in ('RGBA', 'LA', 'P'):
+            imagem = imagem.convert('RGBA')
+            fundo = Image.new('RGB', imagem.size, (255, 255, 255))
+            fundo.paste(imagem, mask=imagem.getchannel('A'))
+            imagem = fundo
+        elif imagem.mode != 'RGB':
+            imagem = imagem.convert('RGB')
+
+        if imagem.width > alvo[0] or imagem.height > alvo[1]:
+            imagem = imagem.resize(alvo, Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        imagem.save(buffer, 'JPEG', quality=IMAGE_PDF_JPEG_QUALITY, optimize=True)
+        buffer.seek(0)
+
+    return ImageReader(buffer), img_width, img_height
+
 def generate_images_pdf(image_data_list, output_pdf_path):
     c = canvas.Canvas(output_pdf_path, pagesize=portrait(A4))
     width, height = portrait(A4)
     margin = 2 * cm
 
     for item in image_data_list:
-        img_path = item['path']
+        # Cada item traz o caminho da foto ('path') ou o conteúdo já em memória ('conteudo')
+        img_path = item.get('path') or item.get('nome', '')
+        origem_imagem = item['conteudo'] if 'conteudo' in item else item['path']
         title = item['title']
 
-        if not os.path.exists(img_path):
+        if isinstance(origem_imagem, str) and not os.path.exists(origem_imagem):
             c.setFont('Helvetica-Bold', 14)
             c.drawCentredString(width / 2.0, height - 2 * cm, title)
             c.setFont('Helvetica', 12)
@@ -968,27 +1991,15 @@ def generate_images_pdf(image_data_list, output_pdf_path):
             c.setFont('Helvetica-Bold', 14)
             c.drawCentredString(width / 2.0, height - cm, title)
 
-            pil_img = Image.open(img_path)
             max_img_width = width - 2 * margin
             max_img_height = height - 3.5 * cm
 
-            img_width_orig, img_height_orig = pil_img.size
-            
-            if img_width_orig > max_img_width or img_height_orig > max_img_height:
-                scale_width = max_img_width / img_width_orig
-                scale_height = max_img_height / img_height_orig
-                scale_factor = min(scale_width, scale_height)
-
-                img_width = img_width_orig * scale_factor
-                img_height = img_height_orig * scale_factor
-            else:
-                img_width = img_width_orig
-                img_height = img_height_orig
+            imagem_pdf, img_width, img_height = preparar_imagem_para_pdf(origem_imagem, max_img_width, max_img_height)
 
             x_pos = (width - img_width) / 2
             y_pos = (height - img_height) / 2 - (1 * cm)
 
-            c.drawImage(ImageReader(img_path), x_pos, y_pos, width=img_width, height=img_height, preserveAspectRatio=True)
+            c.drawImage(imagem_pdf, x_pos, y_pos, width=img_width, height=img_height, preserveAspectRatio=True)
             c.showPage()
 
         except Exception as e:
@@ -1008,12 +2019,18 @@ def upload_form():
 
 @app.route('/process_data', methods=['GET'])
 def show_process_data_form():
-    dados = session.pop('all_input_data_for_correction', None) or session.pop('extracted_data_from_pdf', {})
-    
-    if not dados and not session.get('extracted_data_from_pdf'):
-        return redirect(url_for('upload_form'))
-
-    session['current_process_data_form_data'] = dados 
+    job = obter_job(session.pop('job_id', None))
+    if job:
+        # Correção de um projeto já gerado: os dados completos ficam no job, não no cookie
+        dados = job['dados']
+        session.pop('current_process_data_form_data', None)
+        session['current_process_data_job_id'] = job['job_id']
+    else:
+        dados = session.pop('extracted_data_from_pdf', {})
+        if not dados:
+            return redirect(url_for('upload_form'))
+        session.pop('current_process_data_job_id', None)
+        session['current_process_data_form_data'] = dados
     
     return render_template('process_data.html', dados=dados, TABELA_CATEGORIA_ELET_KEYS=list(TABELA_CATEGORIA_ELET.keys()))
 
@@ -1037,19 +2054,15 @@ def upload_file():
         return render_template('index.html', error='Nenhum arquivo selecionado.'), 400
 
     if file and allowed_file(file.filename, ALLOWED_EXTENSIONS):
+        # O PDF é lido direto do upload (em memória ou no arquivo temporário do próprio Werkzeug);
+        # nada é gravado em uploads/, então envios simultâneos com o mesmo nome não se sobrescrevem
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        dados_fatura = extrair_dados_fatura(filepath, distributor_type)
+        dados_fatura = extrair_dados_fatura_com_cache(file.stream, distributor_type, filename)
 
         if 'error' in dados_fatura or dados_fatura.get('Nome_Razao_Social') == 'Não encontrado':
-            os.remove(filepath)
             error_message = dados_fatura.get('error', f'Erro desconhecido na extração da fatura para {distributor_type}. O Nome/Razão Social não foi encontrado, indicando um problema com o layout ou a legibilidade do PDF.')
             return render_template('index.html', error=error_message), 500
 
-        os.remove(filepath)
-
         dados_fatura['distributor_type'] = distributor_type
         session['extracted_data_from_pdf'] = dados_fatura
         
@@ -1057,6 +2070,412 @@ def upload_file():
     else:
         return render_template('index.html', error='Tipo de arquivo não permitido. Por favor, envie um PDF.'), 400
 
+# --- Sandbox da extração: processos filhos reaproveitados, com limite de memória e de tempo ---
+# Um PDF malformado pode fazer o pdfminer girar ou alocar sem limite. A extração roda num pool de processos
+# (multiprocessing.Pool, criado sob demanda em cada worker do gunicorn) com RLIMIT_AS em cada processo.
+# Os processos nascem do forkserver (spawn onde ele não existe), nunca de um fork do worker web: ele já tem
+# threads (render, projetos, OCR) e o processo copiado pode nascer com um lock preso por uma delas.
+# O tempo de cada fatura conta de quando ela começa a ser lida no processo filho, não do tempo na fila: o
+# alarme do filho interrompe a leitura; se nem ele responder (preso em código C), só aquele processo é
+# encerrado e o pool o substitui, sem afetar as outras faturas em andamento. O erro volta sempre no formato
+# {'error': ...}.
+SANDBOX_ENABLED = os.environ.get('SANDBOX_ENABLED', '1') == '1'
+SANDBOX_WORKERS = int(os.environ.get('SANDBOX_WORKERS', BATCH_MAX_WORKERS))
+# Inclui o OCR das faturas digitalizadas, que roda dentro do mesmo processo
+SANDBOX_TIMEOUT_SECONDS = int(os.environ.get('SANDBOX_TIMEOUT_SECONDS', 90))
+# Memória que a extração pode alocar além da que o processo já ocupa ao nascer
+SANDBOX_MEMORY_LIMIT_MB = int(os.environ.get('SANDBOX_MEMORY_LIMIT_MB', 1024))
+SANDBOX_MAX_TASKS_PER_CHILD = int(os.environ.get('SANDBOX_MAX_TASKS_PER_CHILD', 200))
+SANDBOX_MARGEM_SEGUNDOS = 5
+# De quanto em quanto tempo quem espera uma fatura confere se o processo que a lê ainda responde
+SANDBOX_VERIFICACAO_SEGUNDOS = 1
+
+class TempoExtracaoEsgotado(BaseException):
+    # BaseException: não pode ser engolida pelos "except Exception" da leitura do PDF
+    pass
+
+_sandbox_pool = None
+_sandbox_lock = threading.Lock()
+# Fila em que cada processo do pool avisa (tarefa, pid, início) ao começar uma fatura; quem espera cada
+# tarefa enviada a encontra em _sandbox_tarefas (None enquanto ela está na fila)
+_sandbox_inicios = None
+_sandbox_tarefas = {}
+_sandbox_ids_tarefas = itertools.count()
+
+def _memoria_virtual_atual():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def _alarme_sandbox(signum, frame):
+    raise TempoExtracaoEsgotado()
+
+def _inicializar_processo_sandbox(inicios):
+    global _sandbox_inicios
+    _sandbox_inicios = inicios
+    if resource is not None and SANDBOX_MEMORY_LIMIT_MB > 0:
+        limite = _memoria_virtual_atual() + SANDBOX_MEMORY_LIMIT_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+    if hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, _alarme_sandbox)
+
+def _extrair_fatura_no_sandbox(id_tarefa, conteudo_pdf, distributor_type, nome_arquivo):
+    _sandbox_inicios.put((id_tarefa, os.getpid(), time.time()))
+    with capturar_medicoes() as medicoes:
+        try:
+            if hasattr(signal, 'setitimer'):
+                signal.setitimer(signal.ITIMER_REAL, SANDBOX_TIMEOUT_SECONDS)
+            dados_fatura = extrair_dados_fatura(conteudo_pdf, distributor_type, nome_arquivo)
+        except TempoExtracaoEsgotado:
+            dados_fatura = {'error': f"A leitura da fatura '{nome_arquivo}' excedeu o tempo limite de {SANDBOX_TIMEOUT_SECONDS} s."}
+        except MemoryError:
+            dados_fatura = {'error': f"A leitura da fatura '{nome_arquivo}' excedeu o limite de memória."}
+        finally:
+            if hasattr(signal, 'setitimer'):
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    return dados_fatura, medicoes
+
+def _contexto_sandbox():
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    contexto = multiprocessing.get_context('forkserver')
+    # Os processos nascem com a aplicação já importada, em vez de importá-la ao receber a primeira fatura
+    if __name__ != '__main__':
+        contexto.set_forkserver_preload([__name__])
+    return contexto
+
+def _get_sandbox_pool():
+    global _sandbox_pool, _sandbox_inicios
+    with _sandbox_lock:
+        if _sandbox_pool is None:
+            contexto = _contexto_sandbox()
+            _sandbox_inicios = contexto.SimpleQueue()
+            _sandbox_pool = contexto.Pool(SANDBOX_WORKERS, initializer=_inicializar_processo_sandbox,
+                                          initargs=(_sandbox_inicios,), maxtasksperchild=SANDBOX_MAX_TASKS_PER_CHILD)
+        return _sandbox_pool
+
+def _inicio_tarefa_sandbox(id_tarefa):
+    # (pid, início) do processo que lê a fatura, ou (None, None) enquanto ela está na fila
+    with _sandbox_lock:
+        while not _sandbox_inicios.empty():
+            id_iniciada, pid, inicio = _sandbox_inicios.get()
+            # Tarefas que já foram recebidas não são mais acompanhadas
+            if id_iniciada in _sandbox_tarefas:
+                _sandbox_tarefas[id_iniciada] = (pid, inicio)
+        return _sandbox_tarefas[id_tarefa] or (None, None)
+
+def _processo_sandbox_vivo(pid):
+    # Processo filho deste worker, na mesma máquina: o pool recolhe os que morreram
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def enviar_extracao_sandbox(conteudo_pdf, distributor_type, nome_arquivo):
+    # Com a sandbox desligada a extração roda no próprio processo, em aguardar_extracao_sandbox
+    argumentos = (conteudo_pdf, distributor_type, nome_arquivo)
+    if not SANDBOX_ENABLED:
+        return {'argumentos': argumentos, 'id': None, 'resultado': None}
+    id_tarefa = next(_sandbox_ids_tarefas)
+    with _sandbox_lock:
+        _sandbox_tarefas[id_tarefa] = None
+    resultado = _get_sandbox_pool().apply_async(_extrair_fatura_no_sandbox, (id_tarefa,) + argumentos)
+    return {'argumentos': argumentos, 'id': id_tarefa, 'resultado': resultado}
+
+def aguardar_extracao_sandbox(tarefa):
+    if tarefa['resultado'] is None:
+        return extrair_dados_fatura(*tarefa['argumentos'])
+    nome_arquivo = tarefa['argumentos'][2]
+    try:
+        while True:
+            try:
+                dados_fatura, medicoes = tarefa['resultado'].get(timeout=SANDBOX_VERIFICACAO_SEGUNDOS)
+                break
+            except multiprocessing.TimeoutError:
+                pass
+            pid, inicio = _inicio_tarefa_sandbox(tarefa['id'])
+            if pid is None:
+                continue
+            if not _processo_sandbox_vivo(pid):
+                # O resultado pode ter sido enviado logo antes de o processo sair (maxtasksperchild)
+                tarefa['resultado'].wait(SANDBOX_VERIFICACAO_SEGUNDOS)
+                if tarefa['resultado'].ready():
+                    continue
+                return {'error': f"O processo que lia a fatura '{nome_arquivo}' foi encerrado (PDF malformado ou limite de memória)."}
+            if time.time() - inicio > SANDBOX_TIMEOUT_SECONDS + SANDBOX_MARGEM_SEGUNDOS:
+                # Nem o alarme respondeu: só este processo é encerrado, o pool põe outro no lugar
+                print(f"Extração da fatura '{nome_arquivo}' não respondeu; encerrando o processo {pid} da sandbox.")
+                os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                return {'error': f"A leitura da fatura '{nome_arquivo}' excedeu o tempo limite de {SANDBOX_TIMEOUT_SECONDS} s."}
+    except Exception as e:
+        return {'error': f"Erro inesperado ao processar a fatura: {e}"}
+    finally:
+        with _sandbox_lock:
+            _sandbox_tarefas.pop(tarefa['id'], None)
+    registrar_medicoes(medicoes)
+    return dados_fatura
+
+def extrair_dados_fatura_isolada(conteudo_pdf, distributor_type, nome_arquivo):
+    return aguardar_extracao_sandbox(enviar_extracao_sandbox(conteudo_pdf, distributor_type, nome_arquivo))
+
+# --- Processamento em lote de faturas (sandbox de extração) ---
+CAMPOS_EXTRAIDOS_FATURA = [
+    'UC', 'Nome_Razao_Social', 'CNPJ_CPF', 'Endereco_Rua_Numero', 'Bairro', 'Cidade',
+    'Estado', 'CEP', 'Grupo_Tarifario', 'Classe_Tarifaria', 'Tensao_Nominal_V',
+]
+
+def _coletar_pdfs_do_lote(arquivos):
+    # Retorna (pdfs, erros, erro_lote); erro_lote recusa o lote inteiro (ZIP acima dos limites)
+    pdfs = []
+    erros = []
+    total_descompactado = 0
+    for file_obj in arquivos:
+        if not file_obj or file_obj.filename == '':
+            continue
+        if not allowed_file(file_obj.filename, ALLOWED_BATCH_EXTENSIONS):
+            erros.append({'arquivo': file_obj.filename, 'error': 'Tipo de arquivo não permitido. Envie PDFs ou um ZIP de PDFs.'})
+            continue
+
+        if file_obj.filename.rsplit('.', 1)[1].lower() == 'zip':
+            try:
+                with zipfile.ZipFile(file_obj.stream) as zf:
+                    membros = zf.infolist()
+                    if len(membros) > BATCH_ZIP_MAX_MEMBERS:
+                        return [], [], (f"O ZIP '{file_obj.filename}' tem {len(membros)} arquivos; "
+                                        f"o limite é {BATCH_ZIP_MAX_MEMBERS}.")
+                    for info in membros:
+                        nome_membro = os.path.basename(info.filename)
+                        if info.is_dir() or info.filename.startswith('__MACOSX/') or not nome_membro:
+                            continue
+                        if not allowed_file(nome_membro, ALLOWED_EXTENSIONS):
+                            erros.append({'arquivo': info.filename, 'error': 'Arquivo dentro do ZIP não é um PDF.'})
+                            continue
+                        if info.file_size > BATCH_ZIP_MAX_MEMBER_SIZE:
+                            return [], [], (f"O arquivo '{info.filename}' do ZIP tem {info.file_size // (1024 * 1024)} MB "
+                                            f"descompactado; o limite é {BATCH_ZIP_MAX_MEMBER_SIZE // (1024 * 1024)} MB por arquivo.")
+                        total_descompactado += info.file_size
+                        if total_descompactado > BATCH_ZIP_MAX_TOTAL_SIZE:
+                            return [], [], (f"Os ZIPs do lote passam de {BATCH_ZIP_MAX_TOTAL_SIZE // (1024 * 1024)} MB "
+                                            f"descompactados.")
+                        pdfs.append((info.filename, secure_filename(nome_membro) or 'fatura.pdf', zf.read(info)))
+            except zipfile.BadZipFile:
+                erros.append({'arquivo': file_obj.filename, 'error': 'O arquivo ZIP está corrompido ou não é um ZIP válido.'})
+        else:
+            pdfs.append((file_obj.filename, secure_filename(file_obj.filename) or 'fatura.pdf', file_obj.read()))
+    return pdfs, erros, None
+
+def _resposta_lote_csv(resultados, erros):
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';')
+    writer.writerow(['arquivo'] + CAMPOS_EXTRAIDOS_FATURA + ['erro'])
+    for resultado in resultados:
+        writer.writerow([resultado['arquivo']] + [resultado['dados'].get(campo, '') for campo in CAMPOS_EXTRAIDOS_FATURA] + [''])
+    for erro in erros:
+        writer.writerow([erro['arquivo']] + [''] * len(CAMPOS_EXTRAIDOS_FATURA) + [erro['error']])
+    return Response('\ufeff' + output.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename="faturas_extraidas.csv"'})
+
+@app.route('/upload_batch', methods=['POST'])
+def upload_batch():
+    request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+
+    distributor_type = request.form.get('distribuidora')
+    if not distributor_type:
+        return jsonify({'error': 'Por favor, selecione a distribuidora.'}), 400
+
+    arquivos = request.files.getlist('files')
+    if not arquivos:
+        return jsonify({'error': 'Nenhum arquivo enviado.'}), 400
+
+    pdfs, erros, erro_lote = _coletar_pdfs_do_lote(arquivos)
+    if erro_lote:
+        return jsonify({'error': erro_lote}), 400
+    if not pdfs and not erros:
+        return jsonify({'error': 'Nenhum arquivo selecionado.'}), 400
+
+    # O cache é consultado aqui, no processo do worker web, para que os contadores de hit/miss sejam únicos
+    tarefas = []
+    for nome_original, nome_seguro, conteudo in pdfs:
+        chave = chave_cache_extracao(conteudo, distributor_type)
+        dados_em_cache = ler_cache_extracao(chave)
+        if dados_em_cache is not None:
+            tarefas.append((nome_original, chave, dados_em_cache, None))
+        else:
+            tarefas.append((nome_original, chave, None, enviar_extracao_sandbox(conteudo, distributor_type, nome_seguro)))
+
+    resultados = []
+    for nome_original, chave, dados_em_cache, tarefa in tarefas:
+        if tarefa is None:
+            dados_fatura = dados_em_cache
+        else:
+            dados_fatura = aguardar_extracao_sandbox(tarefa)
+            gravar_cache_extracao(chave, dados_fatura)
+
+        if 'error' not in dados_fatura and dados_fatura.get('Nome_Razao_Social') == 'Não encontrado':
+            dados_fatura = {'error': f"Nome/Razão Social não encontrado na fatura '{nome_original}' ({distributor_type})."}
+
+        if 'error' in dados_fatura:
+            erros.append({'arquivo': nome_original, 'error': dados_fatura['error']})
+        else:
+            dados_fatura['distributor_type'] = distributor_type
+            resultados.append({'arquivo': nome_original, 'UC': dados_fatura.get('UC'), 'dados': dados_fatura})
+
+    if request.form.get('formato', 'json').lower() == 'csv':
+        return _resposta_lote_csv(resultados, erros)
+
+    return jsonify({
+        'distributor_type': distributor_type,
+        'total_arquivos': len(resultados) + len(erros),
+        'resultados': resultados,
+        'erros': erros,
+    })
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(get_extraction_cache_stats())
+
+# --- Endpoint /metrics (formato texto do Prometheus) ---
+REGISTROS_TEMPLATES_METRICAS = {
+    'workbooks': _registro_workbooks,
+    'anexo_f': _registro_anexo_f,
+    'anexo_i': _registro_anexo_i,
+    'docx': _registro_docx,
+}
+
+@app.before_request
+def _iniciar_medicao_requisicao():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def _registrar_medicao_requisicao(response):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None and request.endpoint not in (None, 'static', 'metrics'):
+        registrar_duracao_etapa('requisicao', time.perf_counter() - inicio, rota=request.endpoint,
+                                status=f"{response.status_code // 100}xx")
+    return response
+
+def _rotulos_prometheus(pares):
+    if not pares:
+        return ''
+    escapados = []
+    for nome, valor in pares:
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escapados.append(f'{nome}="{valor}"')
+    return '{' + ','.join(escapados) + '}'
+
+def _tamanho_pasta(caminho):
+    total_bytes = 0
+    for raiz, _, arquivos in os.walk(caminho):
+        for nome in arquivos:
+            try:
+                total_bytes += os.path.getsize(os.path.join(raiz, nome))
+            except OSError:
+                pass
+    return total_bytes
+
+def gerar_metricas_prometheus():
+    linhas = []
+
+    def metrica(nome, tipo, ajuda, amostras):
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} {tipo}")
+        for sufixo, pares, valor in amostras:
+            linhas.append(f"{nome}{sufixo}{_rotulos_prometheus(pares)} {valor}")
+
+    amostras_histograma = []
+    for chave, histograma in sorted(obter_histogramas_etapas().items()):
+        acumulado = 0
+        for limite, contagem in zip(METRICAS_BUCKETS_SEGUNDOS, histograma['buckets']):
+            acumulado += contagem
+            amostras_histograma.append(('_bucket', chave + (('le', repr(limite)),), acumulado))
+        amostras_histograma.append(('_bucket', chave + (('le', '+Inf'),), histograma['total']))
+        amostras_histograma.append(('_sum', chave, repr(histograma['soma'])))
+        amostras_histograma.append(('_count', chave, histograma['total']))
+    metrica('extrator_solar_etapa_duracao_segundos', 'histogram',
+            'Duracao de cada etapa (extracao, workbooks, documentos, ZIP, requisicoes).', amostras_histograma)
+
+    cache = get_extraction_cache_stats()
+    metrica('extrator_solar_cache_extracao_hits_total', 'counter', 'Consultas ao cache de extracao encontradas.',
+            [('', (), cache['hits'])])
+    metrica('extrator_solar_cache_extracao_misses_total', 'counter', 'Consultas ao cache de extracao nao encontradas.',
+            [('', (), cache['misses'])])
+    metrica('extrator_solar_cache_extracao_hit_ratio', 'gauge', 'Proporcao de acertos do cache de extracao.',
+            [('', (), cache['hit_ratio'])])
+    metrica('extrator_solar_cache_extracao_entradas', 'gauge', 'Resultados gravados no cache de extracao.',
+            [('', (), cache['entries'])])
+
+    hits_templates, misses_templates, ratio_templates = [], [], []
+    for nome, registro in REGISTROS_TEMPLATES_METRICAS.items():
+        pares = (('registro', nome),)
+        hits, misses = registro.hits, registro.misses
+        hits_templates.append(('', pares, hits))
+        misses_templates.append(('', pares, misses))
+        ratio_templates.append(('', pares, round(hits / (hits + misses), 4) if hits + misses else 0.0))
+    metrica('extrator_solar_cache_templates_hits_total', 'counter', 'Templates reaproveitados do registro em memoria.', hits_templates)
+    metrica('extrator_solar_cache_templates_misses_total', 'counter', 'Templates carregados do disco.', misses_templates)
+    metrica('extrator_solar_cache_templates_hit_ratio', 'gauge', 'Proporcao de acertos do registro de templates.', ratio_templates)
+
+    pastas_jobs = 0
+    if os.path.isdir(JOB_STORE_DIR):
+        pastas_jobs = sum(1 for entrada in os.scandir(JOB_STORE_DIR)
+                          if entrada.is_dir() and entrada.name.startswith(JOB_TEMP_DIR_PREFIX))
+    disco_temp = shutil.disk_usage(tempfile.gettempdir())
+    metrica('extrator_solar_disco_temp_bytes', 'gauge', 'Espaco ocupado em disco pelos arquivos temporarios.', [
+        ('', (('area', 'jobs'),), _tamanho_pasta(JOB_STORE_DIR)),
+        ('', (('area', 'cache_extracao'),), cache['bytes']),
+    ])
+    metrica('extrator_solar_disco_temp_livre_bytes', 'gauge', 'Espaco livre no disco da pasta temporaria.',
+            [('', (), disco_temp.free)])
+    metrica('extrator_solar_jobs_pastas', 'gauge', 'Pastas de projetos aguardando download ou expiracao.',
+            [('', (), pastas_jobs)])
+
+    return '\n'.join(linhas) + '\n'
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(gerar_metricas_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/dimensionamento_lote', methods=['POST'])
+def dimensionamento_lote():
+    request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+
+    if request.is_json:
+        registros = request.get_json(silent=True)
+        if isinstance(registros, dict):
+            registros = registros.get('projetos')
+        formato = request.args.get('formato', 'json')
+    else:
+        arquivo = request.files.get('file')
+        if not arquivo or arquivo.filename == '':
+            return jsonify({'error': 'Envie um CSV (campo "file") ou uma lista JSON de projetos.'}), 400
+        try:
+            registros = ler_registros_csv(arquivo.read())
+        except UnicodeDecodeError:
+            return jsonify({'error': 'O CSV deve estar em UTF-8.'}), 400
+        formato = request.form.get('formato', 'csv')
+
+    if not isinstance(registros, list) or not all(isinstance(r, dict) for r in registros):
+        return jsonify({'error': 'Formato inválido: esperada uma lista de projetos.'}), 400
+
+    resultados = dimensionar_projetos_em_lote(registros)
+
+    if formato.lower() == 'csv':
+        colunas = list(dict.fromkeys(campo for registro in registros for campo in registro))
+        colunas += [campo for campo in CAMPOS_DIMENSIONAMENTO if campo not in colunas]
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=colunas, delimiter=';', extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(resultados)
+        return Response('\ufeff' + output.getvalue(), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename="dimensionamento_lote.csv"'})
+
+    return jsonify({'total_projetos': len(resultados), 'projetos': resultados})
+
 NUMERIC_KEYS_FOR_FORMATTING = {
     'LATITUDE', 'LONGITUDE', 'POTENCIA_MODULO_MANUAL', 'POTENCIA_INVERSOR_MANUAL',
     'CARGA_INSTALADA', 'POTENCIA_PICO_MODULOS', 'POTENCIA_TOTAL_SISTEMA_KWP',
@@ -1077,121 +2496,401 @@ def get_formatted_value_for_doc(key, data_dict):
     return str(value) if value is not None else ''
 
 
-@app.route('/process_and_save', methods=['POST'])
-def process_and_save():
-    all_input_data = session.pop('current_process_data_form_data', {})
-    if not all_input_data:
-        return render_template('index.html', error='Dados da sessão expirados ou não encontrados. Por favor, reinicie o processo.'), 400
+# --- Armazenamento dos projetos gerados no servidor (jobs) ---
+# A sessão (cookie) guarda só o ID do job; a lista de arquivos, a pasta temporária, os dados
+# usados para correção e o andamento de cada documento ficam num SQLite compartilhado entre
+# workers. Pastas de jobs expirados ou abandonados (sem registro) são removidas pela limpeza periódica.
+JOB_STORE_DIR = os.environ.get('JOB_STORE_DIR', os.path.join(tempfile.gettempdir(), 'extrator_solar_jobs'))
+JOB_STORE_DB_PATH = os.path.join(JOB_STORE_DIR, 'jobs.sqlite3')
+JOB_TEMP_DIR_PREFIX = 'extrator_solar_'
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 6 * 60 * 60))
+JOB_REAPER_INTERVAL_SECONDS = int(os.environ.get('JOB_REAPER_INTERVAL_SECONDS', 5 * 60))
+# Cada processo renova atualizado_em dos seus jobs em andamento (na fila ou gerando) a cada intervalo; um job
+# sem renovação há mais que o limite perdeu o processo que o gerava (worker reiniciado, OOM, outra máquina
+# que caiu). Vale entre máquinas e contêineres que compartilham JOB_STORE_DIR, o que um pid não garante
+JOB_HEARTBEAT_INTERVAL_SECONDS = float(os.environ.get('JOB_HEARTBEAT_INTERVAL_SECONDS', 10))
+JOB_HEARTBEAT_TIMEOUT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_TIMEOUT_SECONDS', 60))
+
+JOB_STATUS_PROCESSANDO = 'processando'
+JOB_STATUS_CONCLUIDO = 'concluido'
+JOB_STATUS_ERRO = 'erro'
+DOCUMENTO_STATUS_PENDENTE = 'pendente'
+
+# Versão do esquema em PRAGMA user_version. Bancos de versões anteriores (jobs.sqlite3 fica na pasta
+# temporária, que sobrevive a atualizações) recebem as colunas que faltam; os jobs gravados antes do
+# status existir já estavam concluídos. As colunas pid e processo da versão 2 não são mais usadas
+JOB_STORE_SCHEMA_VERSION = 3
+JOB_STORE_COLUNAS_ADICIONADAS = (
+    ('status', f"TEXT NOT NULL DEFAULT '{JOB_STATUS_CONCLUIDO}'"),
+    ('erro', 'TEXT'),
+    ('atualizado_em', 'REAL'),
+)
+
+_job_store_inicializado = False
+_job_store_lock = threading.Lock()
+_ultima_limpeza_jobs = 0.0
+
+# Jobs deste processo ainda não concluídos, renovados pela thread de batimento
+_jobs_em_andamento = set()
+_jobs_em_andamento_lock = threading.Lock()
+_batimento_jobs_thread = None
+
+def _migrar_job_store(conn):
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= JOB_STORE_SCHEMA_VERSION:
+        return
+    colunas = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+    for coluna, definicao in JOB_STORE_COLUNAS_ADICIONADAS:
+        if coluna not in colunas:
+            conn.execute(f'ALTER TABLE jobs ADD COLUMN {coluna} {definicao}')
+    conn.execute(f'PRAGMA user_version = {JOB_STORE_SCHEMA_VERSION}')
+
+@contextmanager
+def _conexao_job_store():
+    global _job_store_inicializado
+    # A pasta precisa existir antes do connect: o SQLite cria o arquivo, mas não a pasta
+    if not _job_store_inicializado:
+        os.makedirs(JOB_STORE_DIR, exist_ok=True)
+    conn = sqlite3.connect(JOB_STORE_DB_PATH, timeout=30)
+    try:
+        if not _job_store_inicializado:
+            with _job_store_lock:
+                # Transação exclusiva: outro worker pode estar criando ou migrando o mesmo banco
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS jobs ('
+                    ' job_id TEXT PRIMARY KEY, criado_em REAL NOT NULL, expira_em REAL NOT NULL,'
+                    ' temp_zip_dir TEXT NOT NULL, nome_pasta TEXT NOT NULL, arquivos TEXT NOT NULL, dados TEXT NOT NULL)'
+                )
+                _migrar_job_store(conn)
+                conn.execute('CREATE INDEX IF NOT EXISTS jobs_expira_em ON jobs (expira_em)')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS jobs_documentos ('
+                    ' job_id TEXT NOT NULL, ordem INTEGER NOT NULL, nome TEXT NOT NULL, status TEXT NOT NULL,'
+                    ' PRIMARY KEY (job_id, ordem))'
+                )
+                conn.commit()
+                _job_store_inicializado = True
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def criar_pasta_job():
+    os.makedirs(JOB_STORE_DIR, exist_ok=True)
+    return tempfile.mkdtemp(prefix=JOB_TEMP_DIR_PREFIX, dir=JOB_STORE_DIR)
+
+def _renovar_jobs_em_andamento():
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL_SECONDS)
+        with _jobs_em_andamento_lock:
+            jobs = list(_jobs_em_andamento)
+        if not jobs:
+            continue
+        try:
+            with _conexao_job_store() as conn:
+                conn.executemany('UPDATE jobs SET atualizado_em = ? WHERE job_id = ? AND status = ?',
+                                 [(time.time(), job_id, JOB_STATUS_PROCESSANDO) for job_id in jobs])
+        except Exception as e:
+            print(f"Erro ao renovar os jobs em andamento: {e}")
+
+def _acompanhar_job(job_id):
+    global _batimento_jobs_thread
+    with _jobs_em_andamento_lock:
+        _jobs_em_andamento.add(job_id)
+        # Threads não sobrevivem ao fork (gunicorn --preload): cada processo inicia a sua
+        if _batimento_jobs_thread is None or not _batimento_jobs_thread.is_alive():
+            _batimento_jobs_thread = threading.Thread(target=_renovar_jobs_em_andamento, name='batimento-jobs', daemon=True)
+            _batimento_jobs_thread.start()
+
+def _encerrar_acompanhamento_job(job_id):
+    with _jobs_em_andamento_lock:
+        _jobs_em_andamento.discard(job_id)
+
+def criar_job(temp_zip_dir, nome_pasta, dados, nomes_documentos):
+    job_id = uuid.uuid4().hex
+    agora = time.time()
+    with _conexao_job_store() as conn:
+        conn.execute(
+            'INSERT INTO jobs (job_id, criado_em, expira_em, temp_zip_dir, nome_pasta, arquivos, dados, status, atualizado_em)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, agora, agora + JOB_TTL_SECONDS, temp_zip_dir, nome_pasta, '[]',
+             json.dumps(dados, ensure_ascii=False, default=str), JOB_STATUS_PROCESSANDO, agora)
+        )
+        conn.executemany(
+            'INSERT INTO jobs_documentos (job_id, ordem, nome, status) VALUES (?, ?, ?, ?)',
+            [(job_id, ordem, nome, DOCUMENTO_STATUS_PENDENTE) for ordem, nome in enumerate(nomes_documentos)]
+        )
+    _acompanhar_job(job_id)
+    limpar_jobs_se_necessario()
+    return job_id
+
+def atualizar_documento_job(job_id, ordem, status):
+    with _conexao_job_store() as conn:
+        conn.execute('UPDATE jobs_documentos SET status = ? WHERE job_id = ? AND ordem = ?', (status, job_id, ordem))
+
+def concluir_job(job_id, arquivos):
+    _encerrar_acompanhamento_job(job_id)
+    with _conexao_job_store() as conn:
+        conn.execute('UPDATE jobs SET status = ?, arquivos = ? WHERE job_id = ?',
+                     (JOB_STATUS_CONCLUIDO, json.dumps(arquivos, ensure_ascii=False), job_id))
+
+def falhar_job(job_id, erro):
+    _encerrar_acompanhamento_job(job_id)
+    with _conexao_job_store() as conn:
+        conn.execute('UPDATE jobs SET status = ?, erro = ? WHERE job_id = ?', (JOB_STATUS_ERRO, erro, job_id))
+
+def _job_sem_batimento(atualizado_em, agora):
+    # Jobs gravados antes do batimento existir não têm atualizado_em e dependem do TTL
+    return atualizado_em is not None and agora - atualizado_em > JOB_HEARTBEAT_TIMEOUT_SECONDS
+
+def obter_job(job_id):
+    if not job_id:
+        return None
+    agora = time.time()
+    with _conexao_job_store() as conn:
+        row = conn.execute(
+            'SELECT temp_zip_dir, nome_pasta, arquivos, dados, status, erro, atualizado_em FROM jobs'
+            ' WHERE job_id = ? AND expira_em > ?',
+            (job_id, agora)
+        ).fetchone()
+        if row is None:
+            return None
+        status, erro = row[4], row[5]
+        # O processo que gerava os documentos morreu (worker reiniciado, OOM...): o job não vai mais terminar
+        if status == JOB_STATUS_PROCESSANDO and _job_sem_batimento(row[6], agora):
+            status, erro = JOB_STATUS_ERRO, 'O processo que gerava os documentos do projeto foi encerrado. Por favor, gere o projeto novamente.'
+            conn.execute('UPDATE jobs SET status = ?, erro = ? WHERE job_id = ? AND status = ?',
+                         (status, erro, job_id, JOB_STATUS_PROCESSANDO))
+        documentos = conn.execute(
+            'SELECT nome, status FROM jobs_documentos WHERE job_id = ? ORDER BY ordem', (job_id,)
+        ).fetchall()
+    return {
+        'job_id': job_id,
+        'temp_zip_dir': row[0],
+        'nome_pasta': row[1],
+        'arquivos': json.loads(row[2]),
+        'dados': json.loads(row[3]),
+        'status': status,
+        'erro': erro,
+        'documentos': [{'nome': nome, 'status': status} for nome, status in documentos],
+    }
 
-    distributor_type = request.form.get('distributor_type', all_input_data.get('distributor_type', 'RGE'))
-    all_input_data['distributor_type'] = distributor_type
+def limpar_jobs_expirados():
+    agora = time.time()
+    with _conexao_job_store() as conn:
+        expirados = [row[0] for row in conn.execute('SELECT temp_zip_dir FROM jobs WHERE expira_em <= ?', (agora,))]
+        conn.execute('DELETE FROM jobs_documentos WHERE job_id IN (SELECT job_id FROM jobs WHERE expira_em <= ?)', (agora,))
+        conn.execute('DELETE FROM jobs WHERE expira_em <= ?', (agora,))
+        ativos = {row[0] for row in conn.execute('SELECT temp_zip_dir FROM jobs')}
 
-    for key, value in request.form.items():
-        processed_value = value.strip() if isinstance(value, str) else value
+    for temp_zip_dir in expirados:
+        shutil.rmtree(temp_zip_dir, ignore_errors=True)
 
-        if key in ['CARGA_INSTALADA', 'POTENCIA_MODULO_MANUAL', 'POTENCIA_INVERSOR_MANUAL', 
-                    'LATITUDE', 'LONGITUDE', 'AREA_ARRANJOS_CALCULADO']:
-            if processed_value:
-                try:
-                    all_input_data[key] = float(str(processed_value).replace(',', '.'))
-                except ValueError:
-                    all_input_data[key] = processed_value
-            else:
-                all_input_data[key] = None
-        elif key in ['QUANTIDADE_PLACAS_MANUAL', 'QUANTIDADE_INVERSOR_MANUAL', 'ART']:
-            if processed_value and str(processed_value).isdigit():
-                all_input_data[key] = int(processed_value)
-            else:
-                all_input_data[key] = processed_value
-        elif key.startswith('extracted_'):
-            original_key = key[len('extracted_'):]
-            if original_key == 'Tensao_Nominal_V' and processed_value and processed_value.isdigit():
-                all_input_data[original_key] = int(processed_value)
-            else:
-                all_input_data[original_key] = processed_value
-        else:
-            all_input_data[key] = processed_value
-    
-    calculated_values = calculate_system_variables(all_input_data)
-    all_input_data.update(calculated_values)
+    # Pastas sem job registrado (geração interrompida, processo reiniciado...) só são removidas
+    # depois do TTL, para não apagar um projeto que ainda está sendo gerado
+    removidas = len(expirados)
+    try:
+        entradas = list(os.scandir(JOB_STORE_DIR))
+    except FileNotFoundError:
+        entradas = []
+    for entrada in entradas:
+        if not entrada.is_dir() or not entrada.name.startswith(JOB_TEMP_DIR_PREFIX) or entrada.path in ativos:
+            continue
+        try:
+            if agora - entrada.stat().st_mtime > JOB_TTL_SECONDS:
+                shutil.rmtree(entrada.path, ignore_errors=True)
+                removidas += 1
+        except OSError as e:
+            print(f"Erro ao remover pasta temporária abandonada '{entrada.path}': {e}")
+    return removidas
+
+def limpar_jobs_se_necessario():
+    global _ultima_limpeza_jobs
+    agora = time.time()
+    if agora - _ultima_limpeza_jobs < JOB_REAPER_INTERVAL_SECONDS:
+        return
+    _ultima_limpeza_jobs = agora
+    try:
+        limpar_jobs_expirados()
+    except Exception as e:
+        print(f"Erro na limpeza de jobs expirados: {e}")
+
+@app.cli.command('limpar-jobs')
+def limpar_jobs_command():
+    print(f"Pastas de projetos removidas: {limpar_jobs_expirados()}")
+
+# --- Geração dos documentos do projeto em tarefas independentes (executadas em paralelo) ---
+RENDER_MAX_WORKERS = int(os.environ.get('RENDER_MAX_WORKERS', 8))
+
+PROJECT_ASYNC_MODE = os.environ.get('PROJECT_ASYNC_MODE', '1') == '1'
+PROJECT_MAX_WORKERS = int(os.environ.get('PROJECT_MAX_WORKERS', 4))
+
+DOCUMENTO_STATUS_CONCLUIDO = 'concluido'
+DOCUMENTO_STATUS_ERRO = 'erro'
+
+_render_executor = None
+_render_executor_lock = threading.Lock()
+_project_executor = None
+
+def _get_render_executor():
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            _render_executor = ThreadPoolExecutor(max_workers=RENDER_MAX_WORKERS, thread_name_prefix='render')
+    return _render_executor
+
+def _get_project_executor():
+    # Pool separado do de documentos: cada projeto fica esperando os próprios documentos
+    global _project_executor
+    with _render_executor_lock:
+        if _project_executor is None:
+            _project_executor = ThreadPoolExecutor(max_workers=PROJECT_MAX_WORKERS, thread_name_prefix='projeto')
+    return _project_executor
+
+class ErroGeracaoDocumento(Exception):
+    # Erro que interrompe a geração do projeto; a mensagem é exibida na tela inicial
+    pass
+
+ANEXO_E_DOCX_PLACEHOLDER_TO_PYTHON_VAR = {
+    'UC': 'UC', 'ENDERECO_RUA_NUMERO': 'Endereco_Rua_Numero', 'Bairro': 'Bairro', 'Cidade': 'Cidade',
+    'ESTADO': 'Estado', 'CEP': 'CEP', 'TELEFONE': 'TELEFONE', 'E-MAIL': 'E-MAIL',
+    'CARGA_INSTALADA': 'CARGA_INSTALADA', 'CATEGORIA': 'CATEGORIA', 'CLASSE_TARIFARIA': 'Classe_Tarifaria',
+    'GRUPO_TARIFARIO': 'Grupo_Tarifario', 'TENSAO_NOMINAL_V': 'Tensao_Nominal_V',
+    'NUMERO_FASES_CALCULADO': 'NUMERO_FASES_CALCULADO', 'POTENCIA_TOTAL_SISTEMA_KWP': 'POTENCIA_TOTAL_SISTEMA_KWP',
+    'FABRICANTE_INVERSOR_MANUAL': 'FABRICANTE_INVERSOR_MANUAL', 'MODELO_INVERSOR_CALCULADO': 'MODELO_INVERSOR_CALCULADO',
+    'POTENCIA_INVERSOR_MANUAL': 'POTENCIA_INVERSOR_MANUAL', 'DISJUNTOR_CA': 'DISJUNTOR_CA',
+    'DISJ_CA_INTR': 'DISJ_CA_INTR', 'DISJ_CA_TENS': 'DISJ_CA_TENS', 'DISJ_CA_ATEN': 'DISJ_CA_ATEN',
+    'ISOLACAO_CA': 'ISOLACAO_CA', 'CABO_CA': 'CABO_CA', 'DATA_ATUAL': 'DATA_ATUAL',
+    'POTENCIA_PICO_MODULOS': 'POTENCIA_PICO_MODULOS', 'POTENCIA_MODULO_MANUAL_KWP': 'POTENCIA_MODULO_MANUAL_KWP',
+    'QUANTIDADE_INVERSOR_MANUAL': 'QUANTIDADE_INVERSOR_MANUAL', 'Nome_Razao_Social': 'Nome_Razao_Social',
+}
 
-    bairro = all_input_data.get('Bairro', '').strip()
-    cidade = all_input_data.get('Cidade', '').strip()
-    if bairro and cidade:
-        all_input_data['BAIRRO_CIDADE_COMBINADO'] = f"{bairro} - {cidade}"
-    elif bairro:
-        all_input_data['BAIRRO_CIDADE_COMBINADO'] = bairro
-    elif cidade:
-        all_input_data['BAIRRO_CIDADE_COMBINADO'] = cidade
-    else:
-        all_input_data['BAIRRO_CIDADE_COMBINADO'] = ''
+TERMO_ACEITE_DOCX_PLACEHOLDER_TO_PYTHON_VAR = {
+    'Nome_Razao_Social': 'Nome_Razao_Social', 'CPF_CNPJ': 'CNPJ_CPF', 'UC': 'UC', 'DATA_ATUAL': 'DATA_ATUAL',
+    'NUMERO_ART': 'ART', 'CIDADE': 'Cidade', 'ESTADO': 'Estado',
+}
 
-    cidade_val = all_input_data.get('Cidade', '').strip()
-    estado = all_input_data.get('Estado', '').strip()
-    if cidade_val and estado:
-        all_input_data['CIDADE_ESTADO'] = f"{cidade_val} - {estado}"
-    elif cidade_val:
-        all_input_data['CIDADE_ESTADO'] = cidade_val
-    elif estado:
-        all_input_data['CIDADE_ESTADO'] = estado
-    else:
-        all_input_data['CIDADE_ESTADO'] = ''
+PROCURACAO_DOCX_PLACEHOLDER_TO_PYTHON_VAR = {
+    'NOME_RAZAO_SOCIAL': 'Nome_Razao_Social', 'CPF_CNPJ': 'CNPJ_CPF', 'ENDERECO_RUA_NUMERO': 'Endereco_Rua_Numero',
+    'BAIRRO': 'Bairro', 'CIDADE': 'Cidade', 'ESTADO': 'Estado', 'UC': 'UC', 'DATA_ATUAL': 'DATA_ATUAL',
+    'ENDERECO_COMPLETO_OUTORGANTE': 'ENDERECO_COMPLETO_OUTORGANTE',
+    'CIDADE_ESTADO_DATA_ASSINATURA': 'CIDADE_ESTADO_DATA_ASSINATURA',
+}
 
-    endereco_rua_numero = all_input_data.get('Endereco_Rua_Numero', '').strip()
-    bairro_val = all_input_data.get('Bairro', '').strip()
-    if endereco_rua_numero and bairro_val:
-        all_input_data['Endereco_Rua_Numero_Bairro'] = f"{endereco_rua_numero} - {bairro_val}"
-    elif endereco_rua_numero:
-        all_input_data['Endereco_Rua_Numero_Bairro'] = endereco_rua_numero
-    elif bairro_val:
-        all_input_data['Endereco_Rua_Numero_Bairro'] = bairro_val
-    else:
-        all_input_data['Endereco_Rua_Numero_Bairro'] = ''
+TERMO_ACEITE_INCISO_III_DOCX_PLACEHOLDER_TO_PYTHON_VAR = {
+    'NOME_RAZAO_SOCIAL': 'Nome_Razao_Social', 'CPF_CNPJ': 'CNPJ_CPF', 'UC': 'UC', 'DATA_ATUAL': 'DATA_ATUAL',
+}
 
-    try:
-        lat_dec = float(str(all_input_data.get('LATITUDE', '0')).replace(',', '.'))
-        lon_dec = float(str(all_input_data.get('LONGITUDE', '0')).replace(',', '.'))
-        all_input_data['LATITUDE_GMS'] = decimal_to_dms(lat_dec, is_latitude=True)
-        all_input_data['LONGITUDE_GMS'] = decimal_to_dms(lon_dec, is_latitude=False)
-    except (ValueError, TypeError):
-        all_input_data['LATITUDE_GMS'] = 'N/A'
-        all_input_data['LONGITUDE_GMS'] = 'N/A'
+RESPONSABILIDADE_TECNICA_DOCX_PLACEHOLDER_TO_PYTHON_VAR = {
+    'POTENCIA_TOTAL_SISTEMA_KWP': 'POTENCIA_TOTAL_SISTEMA_KWP', 'Tensao_Nominal_V': 'Tensao_Nominal_V',
+    'NUMERO_FASES_CALCULADO': 'NUMERO_FASES_CALCULADO', 'UC': 'UC', 'NOME_RAZAO_SOCIAL': 'Nome_Razao_Social',
+    'ENDERECO_RUA_NUMERO': 'Endereco_Rua_Numero', 'BAIRRO': 'Bairro', 'CIDADE': 'Cidade', 'ESTADO': 'Estado',
+    'ART': 'ART', 'MODELO_INVERSOR_CALCULADO': 'MODELO_INVERSOR_CALCULADO',
+    'POTENCIA_INVERSOR_MANUAL': 'POTENCIA_INVERSOR_MANUAL', 'DATA_ATUAL': 'DATA_ATUAL', 'INMETRO': 'INMETRO',
+}
 
-    data_hoje = datetime.now()
-    all_input_data['DATA_ATUAL'] = data_hoje.strftime('%d/%m/%Y')
-    
-    if all_input_data.get('DATA_ART') == 'Não informado' or not all_input_data.get('DATA_ART'):
-        all_input_data['DATA_ART'] = all_input_data['DATA_ATUAL']
+DADOS_GD_UFV_DOCX_PLACEHOLDER_TO_PYTHON_VAR = {
+    'Classe_Tarifaria': 'Classe_Tarifaria', 'Grupo_Tarifario': 'Grupo_Tarifario', 'Cidade': 'Cidade',
+    'Estado': 'Estado', 'Endereco_Rua_Numero': 'Endereco_Rua_Numero', 'Bairro': 'Bairro', 'CEP': 'CEP',
+    'LATITUDE_GMS': 'LATITUDE_GMS', 'LONGITUDE_GMS': 'LONGITUDE_GMS', 'CNPJ_CPF': 'CNPJ_CPF',
+    'Nome_Razao_Social': 'Nome_Razao_Social', 'TELEFONE': 'TELEFONE', 'E-MAIL': 'E-MAIL',
+    'POTENCIA_TOTAL_SISTEMA_KWP': 'POTENCIA_TOTAL_SISTEMA_KWP', 'QUANTIDADE_PLACAS_MANUAL': 'QUANTIDADE_PLACAS_MANUAL',
+    'FABRICANTE_MODULO_MANUAL': 'FABRICANTE_MODULO_MANUAL', 'MODELO_MODULO_CALCULADO': 'MODELO_MODULO_CALCULADO',
+    'POTENCIA_INVERSOR_MANUAL': 'POTENCIA_INVERSOR_MANUAL', 'QUANTIDADE_INVERSOR_MANUAL': 'QUANTIDADE_INVERSOR_MANUAL',
+    'FABRICANTE_INVERSOR_MANUAL': 'FABRICANTE_INVERSOR_MANUAL', 'MODELO_INVERSOR_CALCULADO': 'MODELO_INVERSOR_CALCULADO',
+    'AREA': 'AREA_ARRANJOS_CALCULADO', 'DATA_OPERACAO_PREVISTA': 'DATA_OPERACAO_PREVISTA',
+    'POTENCIA_PICO_MODULOS': 'POTENCIA_PICO_MODULOS', 'POTENCIA_MODULO_MANUAL_KWP': 'POTENCIA_MODULO_MANUAL_KWP',
+}
 
-    data_operacao_prevista = data_hoje + timedelta(days=90)
-    all_input_data['DATA_OPERACAO_PREVISTA'] = data_operacao_prevista.strftime('%d/%m/%Y')
+MEMORIAL_DESCRITIVO_DOCX_PLACEHOLDER_TO_PYTHON_VAR = {
+    'Nome_Razao_Social': 'Nome_Razao_Social', 'UC': 'UC', 'Endereco_Rua_Numero': 'Endereco_Rua_Numero',
+    'Bairro': 'Bairro', 'Cidade': 'Cidade', 'Estado': 'Estado', 'LATITUDE_GMS': 'LATITUDE_GMS',
+    'LONGITUDE_GMS': 'LONGITUDE_GMS', 'ART': 'ART', 'QUANTIDADE_PLACAS_MANUAL': 'QUANTIDADE_PLACAS_MANUAL',
+    'FABRICANTE_MODULO_MANUAL': 'FABRICANTE_MODULO_MANUAL', 'MODELO_MODULO_CALCULADO': 'MODELO_MODULO_CALCULADO',
+    'POTENCIA_TOTAL_SISTEMA_KWP': 'POTENCIA_TOTAL_SISTEMA_KWP', 'QUANTIDADE_INVERSOR_MANUAL': 'QUANTIDADE_INVERSOR_MANUAL',
+    'FABRICANTE_INVERSOR_MANUAL': 'FABRICANTE_INVERSOR_MANUAL', 'MODELO_INVERSOR_CALCULADO': 'MODELO_INVERSOR_CALCULADO',
+    'POTENCIA_INVERSOR_MANUAL': 'POTENCIA_INVERSOR_MANUAL', 'DISJUNTOR_CA': 'DISJUNTOR_CA',
+    'DISJ_CA_INTR': 'DISJ_CA_INTR', 'DISJ_CA_TENS': 'DISJ_CA_TENS', 'DISJ_CA_ATEN': 'DISJ_CA_ATEN',
+    'ISOLACAO_CA': 'ISOLACAO_CA', 'CABO_CA': 'CABO_CA', 'DATA_ATUAL': 'DATA_ATUAL',
+    'POTENCIA_PICO_MODULOS': 'POTENCIA_PICO_MODULOS', 'POTENCIA_MODULO_MANUAL_KWP': 'POTENCIA_MODULO_MANUAL_KWP',
+}
 
-    try:
-        potencia_wp_str = str(all_input_data.get('POTENCIA_MODULO_MANUAL', '0')).replace('Wp', '').strip().replace(',', '.')
-        potencia_wp = float(potencia_wp_str)
-        all_input_data['POTENCIA_MODULO_MANUAL_KWP'] = potencia_wp / 1000
-    except ValueError:
-        all_input_data['POTENCIA_MODULO_MANUAL_KWP'] = 'Não informado'
+# Documentos DOCX gerados por tipo de distribuidora. Chaves de cada item:
+# template (caminho e nome), placeholders, prefixo do arquivo temporário, nome no ZIP,
+# base do nome do arquivo de erro no ZIP e o texto usado nas mensagens de erro.
+DOCX_ANEXO_E = {
+    'nome': 'Anexo E', 'template_path': ANEXO_E_TEMPLATE_PATH, 'template_filename': ANEXO_E_TEMPLATE_FILENAME,
+    'placeholders': ANEXO_E_DOCX_PLACEHOLDER_TO_PYTHON_VAR, 'prefixo_temp': 'anexo_e',
+    'zip_filename': '11. Formulário Anexo E - PREENCHIDO.docx', 'zip_erro': '11. Formulário Anexo E',
+    'mensagem_erro': 'Erro ao gerar Anexo E',
+}
+DOCX_TERMO_ACEITE = {
+    'nome': 'Termo de Aceite', 'template_path': TERMO_ACEITE_TEMPLATE_PATH, 'template_filename': TERMO_ACEITE_TEMPLATE_FILENAME,
+    'placeholders': TERMO_ACEITE_DOCX_PLACEHOLDER_TO_PYTHON_VAR, 'prefixo_temp': 'termo_aceite',
+    'zip_filename': '8. Termo de Aceite - PREENCHIDO.docx', 'zip_erro': '8. Termo de Aceite',
+    'mensagem_erro': 'Erro ao processar/salvar dados no Termo de Aceite',
+}
+DOCX_PROCURACAO = {
+    'nome': 'Procuração', 'template_path': PROCURACAO_TEMPLATE_PATH, 'template_filename': PROCURACAO_TEMPLATE_FILENAME,
+    'placeholders': PROCURACAO_DOCX_PLACEHOLDER_TO_PYTHON_VAR, 'prefixo_temp': 'procuracao',
+    'zip_filename': '12. Procuração - PREENCHIDO.docx', 'zip_erro': '12. Procuração',
+    'mensagem_erro': 'Erro ao gerar Procuração',
+}
+DOCX_TERMO_ACEITE_INCISO_III = {
+    'nome': 'Termo de Aceite Inciso III', 'template_path': TERMO_ACEITE_INCISO_III_TEMPLATE_PATH,
+    'template_filename': TERMO_ACEITE_INCISO_III_TEMPLATE_FILENAME,
+    'placeholders': TERMO_ACEITE_INCISO_III_DOCX_PLACEHOLDER_TO_PYTHON_VAR, 'prefixo_temp': 'termo_aceite_inciso_iii',
+    'zip_filename': '13. Termo de Aceite Inciso III - PREENCHIDO.docx', 'zip_erro': '13. Termo de Aceite Inciso III',
+    'mensagem_erro': 'Erro ao gerar Termo de Aceite Inciso III',
+}
+DOCX_RESPONSABILIDADE_TECNICA = {
+    'nome': 'Responsabilidade Tecnica', 'template_path': RESPONSABILIDADE_TECNICA_TEMPLATE_PATH,
+    'template_filename': RESPONSABILIDADE_TECNICA_TEMPLATE_FILENAME,
+    'placeholders': RESPONSABILIDADE_TECNICA_DOCX_PLACEHOLDER_TO_PYTHON_VAR, 'prefixo_temp': 'responsabilidade_tecnica',
+    'zip_filename': '14. Responsabilidade Tecnica - PREENCHIDO.docx', 'zip_erro': '14. Responsabilidade Tecnica',
+    'mensagem_erro': 'Erro ao gerar Responsabilidade Tecnica',
+}
+DOCX_DADOS_GD_UFV = {
+    'nome': 'Dados para GD de UFV', 'template_path': DADOS_GD_UFV_TEMPLATE_PATH, 'template_filename': DADOS_GD_UFV_TEMPLATE_FILENAME,
+    'placeholders': DADOS_GD_UFV_DOCX_PLACEHOLDER_TO_PYTHON_VAR, 'prefixo_temp': 'dados_gd_ufv',
+    'zip_filename': '15. Dados para GD de UFV - PREENCHIDO.docx', 'zip_erro': '15. Dados para GD de UFV',
+    'mensagem_erro': 'Erro ao gerar Dados para GD de UFV',
+}
+DOCX_MEMORIAL_DESCRITIVO = {
+    'nome': 'Memorial Descritivo', 'template_path': MEMORIAL_DESCRITIVO_TEMPLATE_PATH,
+    'template_filename': MEMORIAL_DESCRITIVO_TEMPLATE_FILENAME,
+    'placeholders': MEMORIAL_DESCRITIVO_DOCX_PLACEHOLDER_TO_PYTHON_VAR, 'prefixo_temp': 'memorial_descritivo',
+    'zip_filename': '16. Memorial Descritivo Padrão Fecoergs - PREENCHIDO.docx', 'zip_erro': '16. Memorial Descritivo',
+    'mensagem_erro': 'Erro ao gerar Memorial Descritivo',
+}
 
-    session['temp_files_to_zip'] = []
-    temp_zip_dir = tempfile.mkdtemp()
+PLACEHOLDERS_TXT_COMUNS = {
+    '9. 10. Documento de Identidade.txt': 'Conteúdo de placeholder para o documento de identidade.',
+    '5. Certificado Inmetro Inversor Solar.txt': 'Conteúdo de placeholder para o certificado Inmetro do inversor solar.',
+}
 
-    nome_razao_social_clean = re.sub(r'[\/:*?"<>|]', '', all_input_data.get('Nome_Razao_Social', 'Cliente')).strip()
-    if not nome_razao_social_clean:
-        nome_razao_social_clean = 'Cliente'
-    session['nome_razao_social_zip_folder'] = nome_razao_social_clean
+PLACEHOLDERS_TXT_COOPERATIVAS = {
+    'Diagrama Unifilar indicando desde o ponto de conexão com a Cooperluz.txt': 'Conteúdo de placeholder para Diagrama Unifilar.',
+    'Planta de Localizacao e Situacao.txt': 'Conteúdo de placeholder para Planta de Localização e Situação.',
+    'Diagrama Multifilar indicando desde o ponto de conexão com a Cooperluz.txt': 'Conteúdo de placeholder para Diagrama Multifilar.',
+}
 
+def _caminho_temp_unico(temp_zip_dir, prefixo, extensao):
+    return os.path.join(temp_zip_dir, f"{prefixo}_{uuid.uuid4().hex}.{extensao}")
 
-    current_excel_fv_template_path = EXCEL_PROJETO_FV_TEMPLATE_PATH
-    current_certidao_registro_profissional_path = CERTIDAO_REGISTRO_PROFISSIONAL_PATH
-    
-    temp_excel_proj_fv_filename_unique = f"dados_do_projeto_{uuid.uuid4().hex}.xlsx"
-    temp_excel_proj_fv_filepath = os.path.join(temp_zip_dir, temp_excel_proj_fv_filename_unique)
+def _gravar_txt_temp(temp_zip_dir, prefixo, conteudo, zip_filename):
+    filepath = _caminho_temp_unico(temp_zip_dir, prefixo, 'txt')
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(conteudo)
+    return {'path': filepath, 'zip_filename': zip_filename}
+
+def _gerar_excel_projeto_fv(all_input_data, temp_zip_dir):
+    temp_excel_proj_fv_filepath = _caminho_temp_unico(temp_zip_dir, 'dados_do_projeto', 'xlsx')
 
     try:
-        workbook_proj_fv = openpyxl.load_workbook(current_excel_fv_template_path)
+        workbook_proj_fv = carregar_workbook_template(EXCEL_PROJETO_FV_TEMPLATE_PATH)
         if 'DADOS' not in workbook_proj_fv.sheetnames:
-            return render_template('index.html', error="Erro: A aba 'DADOS' não foi encontrada no arquivo Excel 'Planilha Projetos FV.xlsx'.")
+            raise ErroGeracaoDocumento("Erro: A aba 'DADOS' não foi encontrada no arquivo Excel 'Planilha Projetos FV.xlsx'.")
 
         sheet_dados_proj_fv = workbook_proj_fv['DADOS']
 
@@ -1235,523 +2934,392 @@ def process_and_save():
                 sheet_dados_proj_fv[cell_address] = str(value_to_write)
 
         workbook_proj_fv.save(temp_excel_proj_fv_filepath)
-        session['temp_files_to_zip'].append({'path': temp_excel_proj_fv_filepath, 'zip_filename': 'Dados do Projeto.xlsx'})
+        return [{'path': temp_excel_proj_fv_filepath, 'zip_filename': 'Dados do Projeto.xlsx'}]
 
+    except ErroGeracaoDocumento:
+        raise
     except FileNotFoundError:
-        return render_template('index.html', error=f"Erro: Arquivo Excel de template '{EXCEL_PROJETO_FV_TEMPLATE_FILENAME}' não encontrado.")
+        raise ErroGeracaoDocumento(f"Erro: Arquivo Excel de template '{EXCEL_PROJETO_FV_TEMPLATE_FILENAME}' não encontrado.")
     except Exception as e:
-        return render_template('index.html', error=f"Erro ao processar/salvar dados no Excel de Projeto FV: {e}")
+        raise ErroGeracaoDocumento(f"Erro ao processar/salvar dados no Excel de Projeto FV: {e}")
 
-    temp_art_filename_unique = f"art_preenchida_{uuid.uuid4().hex}.txt"
-    temp_art_filepath = os.path.join(temp_zip_dir, temp_art_filename_unique)
+def _gerar_art_txt(all_input_data, temp_zip_dir):
     try:
-        art_content = generate_art_txt_content(all_input_data)
-        with open(temp_art_filepath, 'w', encoding='utf-8') as f:
-            f.write(art_content)
-        session['temp_files_to_zip'].append({'path': temp_art_filepath, 'zip_filename': '2. ART - PREENCHIDO.txt'})
+        return [_gravar_txt_temp(temp_zip_dir, 'art_preenchida', generate_art_txt_content(all_input_data), '2. ART - PREENCHIDO.txt')]
     except Exception as e:
-        return render_template('index.html', error=f"Erro ao gerar ART.txt: {e}")
-    
-    image_files = {
-        'foto_disjuntor': request.files.get('foto_disjuntor'),
-        'foto_fachada': request.files.get('foto_fachada'),
-        'foto_entrada_energia': request.files.get('foto_entrada_energia')
-    }
-
-    image_paths_for_pdf = []
-    titles_for_pdf = {
-        'foto_disjuntor': 'Foto do Disjuntor',
-        'foto_fachada': 'Foto da Fachada',
-        'foto_entrada_energia': 'Foto da Entrada de Energia'
-    }
+        raise ErroGeracaoDocumento(f"Erro ao gerar ART.txt: {e}")
+
+def _gerar_pdf_fotos(all_input_data, temp_zip_dir, image_data_for_pdf):
+    if image_data_for_pdf:
+        temp_image_pdf_filepath = _caminho_temp_unico(temp_zip_dir, 'fotos_geral_fachada', 'pdf')
+        generate_images_pdf(image_data_for_pdf, temp_image_pdf_filepath)
+        return [{'path': temp_image_pdf_filepath, 'zip_filename': '6. 7. Foto Geral da Entrada de Energia - Fachada.pdf'}]
+
+    return [_gravar_txt_temp(
+        temp_zip_dir, 'placeholder_fotos_vazio_geral',
+        "Aviso: Nenhuma imagem da entrada elétrica (disjuntor, fachada, etc.) foi fornecida. Este arquivo é um placeholder.",
+        '6. 7. Foto Geral da Entrada de Energia - Fachada.txt')]
+
+def _gerar_arquivos_fixos(all_input_data, temp_zip_dir):
+    arquivos = [{'path': CERTIDAO_REGISTRO_PROFISSIONAL_PATH, 'zip_filename': '1. Certidao de Registro Profissional.pdf'}]
+    for zip_name, content in PLACEHOLDERS_TXT_COMUNS.items():
+        arquivos.append(_gravar_txt_temp(temp_zip_dir, 'empty_placeholder', content, zip_name))
+    return arquivos
+
+def _gerar_postagem_txt(all_input_data, temp_zip_dir):
+    distributor_type = all_input_data['distributor_type']
+    try:
+        return [_gravar_txt_temp(
+            temp_zip_dir, f"postagem_{distributor_type.lower()}", generate_postagem_txt_content(all_input_data),
+            f'Postagem do projeto no site da {distributor_type}.txt')]
+    except Exception as e:
+        raise ErroGeracaoDocumento(f"Erro ao gerar Postagem_{distributor_type}.txt: {e}")
 
-    for key, file_obj in image_files.items():
-        if file_obj and file_obj.filename != '' and allowed_file(file_obj.filename, ALLOWED_IMAGE_EXTENSIONS):
-            image_filename = secure_filename(file_obj.filename)
-            temp_image_filepath = os.path.join(temp_zip_dir, image_filename)
-            file_obj.save(temp_image_filepath)
-            image_paths_for_pdf.append({'path': temp_image_filepath, 'title': titles_for_pdf[key]})
-
-    if image_paths_for_pdf:
-        temp_image_pdf_filename_unique = f"fotos_geral_fachada_{uuid.uuid4().hex}.pdf"
-        temp_image_pdf_filepath = os.path.join(temp_zip_dir, temp_image_pdf_filename_unique)
-        generate_images_pdf(image_paths_for_pdf, temp_image_pdf_filepath)
-        session['temp_files_to_zip'].append({'path': temp_image_pdf_filepath, 'zip_filename': '6. 7. Foto Geral da Entrada de Energia - Fachada.pdf'})
-    else:
-        temp_empty_image_pdf_placeholder = os.path.join(temp_zip_dir, f"placeholder_fotos_vazio_geral_{uuid.uuid4().hex}.txt")
-        with open(temp_empty_image_pdf_placeholder, 'w', encoding='utf-8') as f:
-            f.write("Aviso: Nenhuma imagem da entrada elétrica (disjuntor, fachada, etc.) foi fornecida. Este arquivo é um placeholder.")
-        session['temp_files_to_zip'].append({'path': temp_empty_image_pdf_placeholder, 'zip_filename': '6. 7. Foto Geral da Entrada de Energia - Fachada.txt'})
+def _gerar_anexo_f(all_input_data, temp_zip_dir):
+    temp_excel_anexo_f_filepath = _caminho_temp_unico(temp_zip_dir, 'anexo_f_preenchido', 'xlsx')
 
-    session['temp_files_to_zip'].append({'path': current_certidao_registro_profissional_path, 'zip_filename': '1. Certidao de Registro Profissional.pdf'})
+    try:
+        workbook_anexo_f, indice_anexo_f = carregar_formulario_excel(_registro_anexo_f, ANEXO_F_TEMPLATE_PATH)
+        if indice_anexo_f is None:
+            raise ErroGeracaoDocumento(f"Erro: A aba '{ANEXO_F_SHEET_NAME}' não foi encontrada no arquivo Excel '{ANEXO_F_TEMPLATE_FILENAME}'.")
 
-    empty_txt_files_common = {
-        '9. 10. Documento de Identidade.txt': 'Conteúdo de placeholder para o documento de identidade.',
-        '5. Certificado Inmetro Inversor Solar.txt': 'Conteúdo de placeholder para o certificado Inmetro do inversor solar.',
-    }
-    for zip_name, content in empty_txt_files_common.items():
-        temp_empty_filepath = os.path.join(temp_zip_dir, f"empty_placeholder_{uuid.uuid4().hex}.txt")
-        with open(temp_empty_filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
-        session['temp_files_to_zip'].append({'path': temp_empty_filepath, 'zip_filename': zip_name})
-
-    if distributor_type == 'RGE':
-        temp_postagem_filename_unique = f"postagem_{distributor_type.lower()}_{uuid.uuid4().hex}.txt"
-        temp_postagem_filepath = os.path.join(temp_zip_dir, temp_postagem_filename_unique)
-        try:
-            postagem_content = generate_postagem_txt_content(all_input_data)
-            with open(temp_postagem_filepath, 'w', encoding='utf-8') as f:
-                f.write(postagem_content)
-            session['temp_files_to_zip'].append({'path': temp_postagem_filepath, 'zip_filename': f'Postagem do projeto no site da {distributor_type}.txt'})
-        except Exception as e:
-            return render_template('index.html', error=f"Erro ao gerar Postagem_{distributor_type}.txt: {e}")
+        preencher_anexo_f(workbook_anexo_f[ANEXO_F_SHEET_NAME], indice_anexo_f, all_input_data)
 
-        current_anexo_f_template_path = ANEXO_F_TEMPLATE_PATH
-        current_anexo_e_template_path = ANEXO_E_TEMPLATE_PATH
-        current_termo_aceite_template_path = TERMO_ACEITE_TEMPLATE_PATH
+        workbook_anexo_f.save(temp_excel_anexo_f_filepath)
+        return [{'path': temp_excel_anexo_f_filepath, 'zip_filename': '3. Formulário Anexo F - PREENCHIDO.xlsx'}]
 
-        temp_excel_anexo_f_filename_unique = f"anexo_f_preenchido_{uuid.uuid4().hex}.xlsx"
-        temp_excel_anexo_f_filepath = os.path.join(temp_zip_dir, temp_excel_anexo_f_filename_unique)
+    except ErroGeracaoDocumento:
+        raise
+    except FileNotFoundError:
+        raise ErroGeracaoDocumento(f"Erro: Arquivo Excel de template '{ANEXO_F_TEMPLATE_FILENAME}' não encontrado.")
+    except Exception as e:
+        raise ErroGeracaoDocumento(f"Erro ao processar/salvar dados no Anexo F: {e}")
 
-        try:
-            workbook_anexo_f = openpyxl.load_workbook(current_anexo_f_template_path)
-            if ANEXO_F_SHEET_NAME not in workbook_anexo_f.sheetnames:
-                return render_template('index.html', error=f"Erro: A aba '{ANEXO_F_SHEET_NAME}' não foi encontrada no arquivo Excel '{ANEXO_F_TEMPLATE_FILENAME}'.")
-
-            sheet_anexo_f = workbook_anexo_f[ANEXO_F_SHEET_NAME]
-
-            for row in sheet_anexo_f.iter_rows():
-                for cell in row:
-                    if cell.value and isinstance(cell.value, str):
-                        cell_text_standardized = cell.value.strip().upper()
-                        if cell_text_standardized in ANEXO_F_PLACEHOLDER_TO_PYTHON_VAR:
-                            python_var_name = ANEXO_F_PLACEHOLDER_TO_PYTHON_VAR[cell_text_standardized]
-                            value_to_write = all_input_data.get(python_var_name)
-
-                            if python_var_name == 'FULL_ADDRESS_COMPOSED':
-                                rua_num_completo = all_input_data.get('Endereco_Rua_Numero', '')
-                                bairro_comp = all_input_data.get('Bairro', '')
-                                rua_parsed, numero_parsed = parse_address_for_excel(str(rua_num_completo))
-                                full_address_str = f"{rua_parsed}"
-                                if numero_parsed:
-                                    full_address_str += f", {numero_parsed}"
-                                if bairro_comp:
-                                    full_address_str += f" - {bairro_comp}"
-                                cell.value = full_address_str.strip(' ,-')
-                            elif python_var_name in DATE_KEYS_FOR_FORMATTING:
-                                if value_to_write:
-                                    try:
-                                        dt_obj = datetime.strptime(str(value_to_write), '%Y-%m-%d')
-                                    except ValueError:
-                                        try:
-                                            dt_obj = datetime.strptime(str(value_to_write), '%d/%m/%Y')
-                                        except ValueError:
-                                            dt_obj = None
-                                    if dt_obj:
-                                        cell.number_format = 'DD/MM/YYYY'
-                                        cell.value = dt_obj
-                                    else:
-                                        cell.value = str(value_to_write)
-                                else:
-                                    cell.value = ''
-                            elif python_var_name in NUMERIC_KEYS_FOR_FORMATTING:
-                                # **NOVO TRATAMENTO: LATITUDE e LONGITUDE como string formatada com ponto e 6 casas decimais**
-                                if python_var_name in ['LATITUDE', 'LONGITUDE']:
-                                    if value_to_write is not None:
-                                        try:
-                                            # Converte para float primeiro, para garantir o valor numérico
-                                            float_val = float(str(value_to_write).replace(',', '.'))
-                                            # Formata como string com 6 casas decimais e ponto
-                                            cell.value = f"{float_val:.6f}"
-                                        except ValueError:
-                                            # Se a conversão falhar, mantém o valor original como string
-                                            cell.value = str(value_to_write)
-                                    else:
-                                        cell.value = '' # Se for None
-                                else:
-                                    # Para os outros campos numéricos, mantém a formatação existente (2 casas, vírgula)
-                                    cell.value = format_value_for_display(value_to_write, is_numeric=True)
-                            else:
-                                cell.value = str(value_to_write) if value_to_write is not None else ''
-
-                            original_font = cell.font
-                            cell.font = openpyxl.styles.Font(color='00000000', name=original_font.name, size=original_font.size)
-
-            workbook_anexo_f.save(temp_excel_anexo_f_filepath)
-            session['temp_files_to_zip'].append({'path': temp_excel_anexo_f_filepath, 'zip_filename': '3. Formulário Anexo F - PREENCHIDO.xlsx'})
+def _gerar_anexo_i(all_input_data, temp_zip_dir):
+    temp_anexo_i_filepath = _caminho_temp_unico(temp_zip_dir, 'anexo_i_preenchido', 'xlsx')
 
-        except FileNotFoundError:
-            return render_template('index.html', error=f"Erro: Arquivo Excel de template '{ANEXO_F_TEMPLATE_FILENAME}' não encontrado.")
-        except Exception as e:
-            return render_template('index.html', error=f"Erro ao processar/salvar dados no Anexo F: {e}")
+    try:
+        workbook_anexo_i, indice_anexo_i = carregar_formulario_excel(_registro_anexo_i, ANEXO_I_TEMPLATE_PATH)
+        if indice_anexo_i is None:
+            return [_gravar_txt_temp(
+                temp_zip_dir, 'erro_anexo_i_template_nao_encontrado',
+                f"Erro ao gerar Anexo I: Template '{ANEXO_I_TEMPLATE_FILENAME}' não encontrado.",
+                '4. Anexo I - ERRO (Template não encontrado).txt')]
 
-        temp_anexo_e_filename_unique = f"anexo_e_preenchido_{uuid.uuid4().hex}.docx"
-        temp_anexo_e_filepath = os.path.join(temp_zip_dir, temp_anexo_e_filename_unique)
+        preencher_anexo_i(workbook_anexo_i[ANEXO_I_SHEET_NAME], indice_anexo_i, all_input_data)
 
-        try:
-            docx_replacements_anexo_e = {
-                'UC': get_formatted_value_for_doc('UC', all_input_data),
-                'ENDERECO_RUA_NUMERO': get_formatted_value_for_doc('Endereco_Rua_Numero', all_input_data),
-                'Bairro': get_formatted_value_for_doc('Bairro', all_input_data),
-                'Cidade': get_formatted_value_for_doc('Cidade', all_input_data),
-                'ESTADO': get_formatted_value_for_doc('Estado', all_input_data),
-                'CEP': get_formatted_value_for_doc('CEP', all_input_data),
-                'TELEFONE': get_formatted_value_for_doc('TELEFONE', all_input_data),
-                'E-MAIL': get_formatted_value_for_doc('E-MAIL', all_input_data),
-                'CARGA_INSTALADA': get_formatted_value_for_doc('CARGA_INSTALADA', all_input_data),
-                'CATEGORIA': get_formatted_value_for_doc('CATEGORIA', all_input_data),
-                'CLASSE_TARIFARIA': get_formatted_value_for_doc('Classe_Tarifaria', all_input_data),
-                'GRUPO_TARIFARIO': get_formatted_value_for_doc('Grupo_Tarifario', all_input_data),
-                'TENSAO_NOMINAL_V': get_formatted_value_for_doc('Tensao_Nominal_V', all_input_data),
-                'NUMERO_FASES_CALCULADO': get_formatted_value_for_doc('NUMERO_FASES_CALCULADO', all_input_data),
-                'POTENCIA_TOTAL_SISTEMA_KWP': get_formatted_value_for_doc('POTENCIA_TOTAL_SISTEMA_KWP', all_input_data),
-                'FABRICANTE_INVERSOR_MANUAL': get_formatted_value_for_doc('FABRICANTE_INVERSOR_MANUAL', all_input_data),
-                'MODELO_INVERSOR_CALCULADO': get_formatted_value_for_doc('MODELO_INVERSOR_CALCULADO', all_input_data),
-                'POTENCIA_INVERSOR_MANUAL': get_formatted_value_for_doc('POTENCIA_INVERSOR_MANUAL', all_input_data),
-                'DISJUNTOR_CA': get_formatted_value_for_doc('DISJUNTOR_CA', all_input_data),
-                'DISJ_CA_INTR': get_formatted_value_for_doc('DISJ_CA_INTR', all_input_data),
-                'DISJ_CA_TENS': get_formatted_value_for_doc('DISJ_CA_TENS', all_input_data),
-                'DISJ_CA_ATEN': get_formatted_value_for_doc('DISJ_CA_ATEN', all_input_data),
-                'ISOLACAO_CA': get_formatted_value_for_doc('ISOLACAO_CA', all_input_data),
-                'CABO_CA': get_formatted_value_for_doc('CABO_CA', all_input_data),
-                'DATA_ATUAL': get_formatted_value_for_doc('DATA_ATUAL', all_input_data),
-                'POTENCIA_PICO_MODULOS': get_formatted_value_for_doc('POTENCIA_PICO_MODULOS', all_input_data),
-                'POTENCIA_MODULO_MANUAL_KWP': get_formatted_value_for_doc('POTENCIA_MODULO_MANUAL_KWP', all_input_data),
-                'QUANTIDADE_INVERSOR_MANUAL': get_formatted_value_for_doc('QUANTIDADE_INVERSOR_MANUAL', all_input_data),
-                'Nome_Razao_Social': get_formatted_value_for_doc('Nome_Razao_Social', all_input_data), 
-            }
-
-            doc_anexo_e_preenchido = replace_docx_placeholders(current_anexo_e_template_path, docx_replacements_anexo_e)
-            doc_anexo_e_preenchido.save(temp_anexo_e_filepath)
-            session['temp_files_to_zip'].append({'path': temp_anexo_e_filepath, 'zip_filename': '11. Formulário Anexo E - PREENCHIDO.docx'})
+        workbook_anexo_i.save(temp_anexo_i_filepath)
+        return [{'path': temp_anexo_i_filepath, 'zip_filename': '4. Anexo I - PREENCHIDO.xlsx'}]
 
-        except FileNotFoundError:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_anexo_e_template_nao_encontrado_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Anexo E: Template '{ANEXO_E_TEMPLATE_FILENAME}' não encontrado.")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '11. Formulário Anexo E - ERRO (Template não encontrado).txt'})
-        except Exception as e:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_anexo_e_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Anexo E: {e}")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '11. Formulário Anexo E - ERRO.txt'})
+    except FileNotFoundError:
+        raise ErroGeracaoDocumento(f"Erro: Arquivo Excel de template '{ANEXO_I_TEMPLATE_FILENAME}' não encontrado.")
+    except Exception as e:
+        return [_gravar_txt_temp(temp_zip_dir, 'erro_anexo_i', f"Erro ao gerar Anexo I: {e}", '4. Anexo I - ERRO.txt')]
 
-        temp_termo_aceite_filename_unique = f"termo_aceite_preenchido_{uuid.uuid4().hex}.docx"
-        temp_termo_aceite_filepath = os.path.join(temp_zip_dir, temp_termo_aceite_filename_unique)
+def _gerar_docx(documento, all_input_data, temp_zip_dir):
+    # Falhas em documentos DOCX não interrompem o projeto: viram um TXT de erro dentro do ZIP
+    temp_docx_filepath = _caminho_temp_unico(temp_zip_dir, f"{documento['prefixo_temp']}_preenchido", 'docx')
 
-        try:
-            docx_replacements_termo_aceite = {
-                'Nome_Razao_Social': get_formatted_value_for_doc('Nome_Razao_Social', all_input_data), 
-                'CPF_CNPJ': get_formatted_value_for_doc('CNPJ_CPF', all_input_data),
-                'UC': get_formatted_value_for_doc('UC', all_input_data),
-                'DATA_ATUAL': get_formatted_value_for_doc('DATA_ATUAL', all_input_data),
-                'NUMERO_ART': get_formatted_value_for_doc('ART', all_input_data),
-                'CIDADE': get_formatted_value_for_doc('Cidade', all_input_data),
-                'ESTADO': get_formatted_value_for_doc('Estado', all_input_data),
-            }
-
-            doc_termo_aceite_preenchido = replace_docx_placeholders(current_termo_aceite_template_path, docx_replacements_termo_aceite)
-            doc_termo_aceite_preenchido.save(temp_termo_aceite_filepath)
-            session['temp_files_to_zip'].append({'path': temp_termo_aceite_filepath, 'zip_filename': '8. Termo de Aceite - PREENCHIDO.docx'})
+    try:
+        docx_replacements = {
+            placeholder: get_formatted_value_for_doc(python_var_name, all_input_data)
+            for placeholder, python_var_name in documento['placeholders'].items()
+        }
+        doc_preenchido = replace_docx_placeholders(documento['template_path'], docx_replacements)
+        doc_preenchido.save(temp_docx_filepath)
+        return [{'path': temp_docx_filepath, 'zip_filename': documento['zip_filename']}]
 
-        except FileNotFoundError:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_termo_aceite_template_nao_encontrado_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Termo de Aceite: Template '{TERMO_ACEITE_TEMPLATE_FILENAME}' não encontrado.")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '8. Termo de Aceite - ERRO (Template não encontrado).txt'})
-        except Exception as e:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_termo_aceite_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao processar/salvar dados no Termo de Aceite: {e}")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '8. Termo de Aceite - ERRO.txt'})
-
-        temp_empty_filepath = os.path.join(temp_zip_dir, f"empty_placeholder_projeto_{uuid.uuid4().hex}.txt")
-        with open(temp_empty_filepath, 'w', encoding='utf-8') as f:
-            f.write('Conteúdo de placeholder para o projeto.')
-        session['temp_files_to_zip'].append({'path': temp_empty_filepath, 'zip_filename': '4. Projeto.txt'})
-
-    elif distributor_type in ['COOPERLUZ', 'CERTHIL', 'CERMISSOES']:
-        current_anexo_i_template_path = ANEXO_I_TEMPLATE_PATH
-        current_procuracao_template_path = PROCURACAO_TEMPLATE_PATH
-        current_termo_aceite_inciso_iii_template_path = TERMO_ACEITE_INCISO_III_TEMPLATE_PATH
-        current_responsabilidade_tecnica_template_path = RESPONSABILIDADE_TECNICA_TEMPLATE_PATH
-        current_dados_gd_ufv_template_path = DADOS_GD_UFV_TEMPLATE_PATH
-        current_memorial_descritivo_template_path = MEMORIAL_DESCRITIVO_TEMPLATE_PATH
-
-        temp_anexo_i_filename_unique = f"anexo_i_preenchido_{uuid.uuid4().hex}.xlsx"
-        temp_anexo_i_filepath = os.path.join(temp_zip_dir, temp_anexo_i_filename_unique)
+    except FileNotFoundError:
+        return [_gravar_txt_temp(
+            temp_zip_dir, f"erro_{documento['prefixo_temp']}_template_nao_encontrado",
+            f"Erro ao gerar {documento['nome']}: Template '{documento['template_filename']}' não encontrado.",
+            f"{documento['zip_erro']} - ERRO (Template não encontrado).txt")]
+    except Exception as e:
+        return [_gravar_txt_temp(
+            temp_zip_dir, f"erro_{documento['prefixo_temp']}", f"{documento['mensagem_erro']}: {e}",
+            f"{documento['zip_erro']} - ERRO.txt")]
+
+def _gerar_placeholder_projeto(all_input_data, temp_zip_dir):
+    return [_gravar_txt_temp(temp_zip_dir, 'empty_placeholder_projeto', 'Conteúdo de placeholder para o projeto.', '4. Projeto.txt')]
+
+def _gerar_placeholders_cooperativas(all_input_data, temp_zip_dir):
+    return [_gravar_txt_temp(temp_zip_dir, 'empty_placeholder', content, zip_name)
+            for zip_name, content in PLACEHOLDERS_TXT_COOPERATIVAS.items()]
+
+def _preparar_dados_cooperativas(all_input_data):
+    full_address_outorgante_parts = []
+    rua_num_out = all_input_data.get('Endereco_Rua_Numero', '').strip()
+    bairro_out = all_input_data.get('Bairro', '').strip()
+    cidade_est_out = all_input_data.get('CIDADE_ESTADO', '').strip()
+    cep_out = all_input_data.get('CEP', '').strip()
+
+    if rua_num_out:
+        full_address_outorgante_parts.append(rua_num_out)
+    if bairro_out:
+        full_address_outorgante_parts.append(f"– {bairro_out}")
+    if cidade_est_out:
+        full_address_outorgante_parts.append(f"na cidade de {cidade_est_out}")
+    if cep_out:
+        full_address_outorgante_parts.append(f"CEP {cep_out}")
+
+    all_input_data['ENDERECO_COMPLETO_OUTORGANTE'] = ", ".join(filter(None, full_address_outorgante_parts))
+
+    cidade_estado_data_str = f"{format_value_for_display(all_input_data.get('Cidade', '')).upper()} – {format_value_for_display(all_input_data.get('Estado', '')).upper()}, {get_formatted_value_for_doc('DATA_ATUAL', all_input_data)}"
+    all_input_data['CIDADE_ESTADO_DATA_ASSINATURA'] = cidade_estado_data_str
+
+# Documentos específicos de cada distribuidora: (nome, função(all_input_data, temp_zip_dir)), na ordem do ZIP
+DOCUMENTOS_RGE = [
+    ('Postagem', _gerar_postagem_txt),
+    ('Anexo F', _gerar_anexo_f),
+    (DOCX_ANEXO_E['nome'], partial(_gerar_docx, DOCX_ANEXO_E)),
+    (DOCX_TERMO_ACEITE['nome'], partial(_gerar_docx, DOCX_TERMO_ACEITE)),
+    ('Projeto', _gerar_placeholder_projeto),
+]
 
+DOCUMENTOS_COOPERATIVAS = [('Anexo I', _gerar_anexo_i)] + [
+    (documento['nome'], partial(_gerar_docx, documento))
+    for documento in (DOCX_PROCURACAO, DOCX_TERMO_ACEITE_INCISO_III, DOCX_RESPONSABILIDADE_TECNICA,
+                      DOCX_DADOS_GD_UFV, DOCX_MEMORIAL_DESCRITIVO)
+] + [('Placeholders da cooperativa', _gerar_placeholders_cooperativas)]
+
+def _registrar_distribuidoras_embutidas():
+    registrar_distribuidora({
+        'codigo': 'RGE',
+        'nome': 'RGE',
+        'layouts': RGE_LAYOUTS,
+        # A RGE aceita a extração sem o nome (o usuário completa no formulário)
+        'exige_nome_razao_social': False,
+        'documentos': DOCUMENTOS_RGE,
+    })
+    registrar_distribuidora({
+        'codigo': 'COOPERLUZ',
+        'nome': 'Cooperluz',
+        'layouts': COOPERLUZ_LAYOUTS,
+        'documentos': DOCUMENTOS_COOPERATIVAS,
+        'preparar_dados': _preparar_dados_cooperativas,
+    })
+    for codigo, nome in (('CERTHIL', 'Certhil'), ('CERMISSOES', 'Cermissões')):
+        registrar_distribuidora({
+            'codigo': codigo,
+            'nome': nome,
+            'layouts': _layouts_coop_similar(codigo),
+            'documentos': DOCUMENTOS_COOPERATIVAS,
+            'preparar_dados': _preparar_dados_cooperativas,
+        })
+
+def montar_tarefas_documentos(all_input_data, distributor_type, temp_zip_dir, image_data_for_pdf):
+    # Lista de (nome do documento, tarefa) na ordem em que os arquivos entram no ZIP
+    tarefas = [
+        ('Dados do Projeto', partial(_gerar_excel_projeto_fv, all_input_data, temp_zip_dir)),
+        ('ART', partial(_gerar_art_txt, all_input_data, temp_zip_dir)),
+        ('Fotos', partial(_gerar_pdf_fotos, all_input_data, temp_zip_dir, image_data_for_pdf)),
+        ('Arquivos fixos', partial(_gerar_arquivos_fixos, all_input_data, temp_zip_dir)),
+    ]
+
+    distribuidora = obter_distribuidora(distributor_type)
+    if distribuidora is not None:
+        if distribuidora['preparar_dados']:
+            distribuidora['preparar_dados'](all_input_data)
+        tarefas += [(nome, partial(funcao, all_input_data, temp_zip_dir)) for nome, funcao in distribuidora['documentos']]
+
+    return [(nome, partial(_executar_tarefa_medida, funcao, distributor_type, nome)) for nome, funcao in tarefas]
+
+def _executar_tarefa_medida(funcao, distributor_type, nome):
+    with medir_etapa('documento', distribuidora=distributor_type, documento=nome):
+        return funcao()
+
+def _status_documento(future):
+    if future.exception() is not None:
+        return DOCUMENTO_STATUS_ERRO
+    if any(' - ERRO' in f['zip_filename'] for f in future.result()):
+        return DOCUMENTO_STATUS_ERRO
+    return DOCUMENTO_STATUS_CONCLUIDO
+
+def gerar_documentos_projeto(tarefas, ao_concluir_documento=None):
+    # Os documentos só compartilham all_input_data (somente leitura aqui), então rodam em paralelo;
+    # os resultados são reunidos na ordem das tarefas para manter a ordem dos arquivos no ZIP
+    executor = _get_render_executor()
+    futures = []
+    for ordem, (nome, funcao) in enumerate(tarefas):
+        future = executor.submit(funcao)
+        if ao_concluir_documento:
+            future.add_done_callback(lambda f, ordem=ordem: ao_concluir_documento(ordem, _status_documento(f)))
+        futures.append((nome, future))
+
+    arquivos = []
+    primeiro_erro = None
+    for nome, future in futures:
         try:
-            workbook_anexo_i = openpyxl.load_workbook(current_anexo_i_template_path)
-            if ANEXO_I_SHEET_NAME not in workbook_anexo_i.sheetnames:
-                temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_anexo_i_template_nao_encontrado_{uuid.uuid4().hex}.txt")
-                with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                    f.write(f"Erro ao gerar Anexo I: Template '{ANEXO_I_TEMPLATE_FILENAME}' não encontrado.")
-                session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '4. Anexo I - ERRO (Template não encontrado).txt'})
-            else:
-                sheet_anexo_i = workbook_anexo_i[ANEXO_I_SHEET_NAME]
-
-                for row in sheet_anexo_i.iter_rows():
-                    for cell in row:
-                        if cell.value and isinstance(cell.value, str):
-                            cell_text_standardized = cell.value.strip().upper()
-                            if cell_text_standardized in ANEXO_I_PLACEHOLDER_TO_PYTHON_VAR:
-                                python_var_name = ANEXO_I_PLACEHOLDER_TO_PYTHON_VAR[cell_text_standardized]
-                                value_to_write = all_input_data.get(python_var_name)
-
-                                if python_var_name in DATE_KEYS_FOR_FORMATTING:
-                                    if value_to_write:
-                                        try:
-                                            dt_obj = datetime.strptime(value_to_write, '%d/%m/%Y')
-                                            cell.number_format = 'DD/MM/YYYY'
-                                            cell.value = dt_obj
-                                        except ValueError:
-                                            cell.value = str(value_to_write)
-                                    else:
-                                        cell.value = ''
-                                elif python_var_name in NUMERIC_KEYS_FOR_FORMATTING:
-                                    cell.value = format_value_for_display(value_to_write, is_numeric=True)
-                                else:
-                                    cell.value = str(value_to_write) if value_to_write is not None else ''
-
-                                original_font = cell.font
-                                cell.font = openpyxl.styles.Font(color='00000000', name=original_font.name, size=original_font.size)
-                
-                workbook_anexo_i.save(temp_anexo_i_filepath)
-                session['temp_files_to_zip'].append({'path': temp_anexo_i_filepath, 'zip_filename': '4. Anexo I - PREENCHIDO.xlsx'})
+            arquivos.extend(future.result())
+        except ErroGeracaoDocumento as e:
+            print(f"Erro ao gerar {nome}: {e}")
+            if primeiro_erro is None:
+                primeiro_erro = e
+    if primeiro_erro is not None:
+        raise primeiro_erro
+    return arquivos
+
+def executar_job_projeto(job_id, tarefas, temp_zip_dir):
+    try:
+        arquivos = gerar_documentos_projeto(tarefas, partial(atualizar_documento_job, job_id))
+    except Exception as e:
+        shutil.rmtree(temp_zip_dir, ignore_errors=True)
+        mensagem = str(e) if isinstance(e, ErroGeracaoDocumento) else f"Erro inesperado ao gerar os documentos do projeto: {e}"
+        falhar_job(job_id, mensagem)
+        raise ErroGeracaoDocumento(mensagem)
+    concluir_job(job_id, arquivos)
+    return arquivos
+
+def _executar_job_projeto_em_segundo_plano(job_id, tarefas, temp_zip_dir):
+    try:
+        executar_job_projeto(job_id, tarefas, temp_zip_dir)
+    except ErroGeracaoDocumento as e:
+        print(f"Erro no job {job_id}: {e}")
+    except Exception as e:
+        # Falha fora da geração dos documentos (gravação do job concluído, ...): sem isso o job
+        # ficaria 'processando' até expirar
+        print(f"Erro inesperado no job {job_id}: {e}")
+        try:
+            falhar_job(job_id, f"Erro inesperado ao gerar os documentos do projeto: {e}")
+        except Exception as erro_registro:
+            print(f"Erro ao registrar a falha do job {job_id}: {erro_registro}")
 
-        except FileNotFoundError:
-            return render_template('index.html', error=f"Erro: Arquivo Excel de template '{ANEXO_I_TEMPLATE_FILENAME}' não encontrado.")
-        except Exception as e:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_anexo_i_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Anexo I: {e}")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '4. Anexo I - ERRO.txt'})
-        
-        full_address_outorgante_parts = []
-        rua_num_out = all_input_data.get('Endereco_Rua_Numero', '').strip()
-        bairro_out = all_input_data.get('Bairro', '').strip()
-        cidade_est_out = all_input_data.get('CIDADE_ESTADO', '').strip()
-        cep_out = all_input_data.get('CEP', '').strip()
 
-        if rua_num_out:
-            full_address_outorgante_parts.append(rua_num_out)
-        if bairro_out:
-            full_address_outorgante_parts.append(f"– {bairro_out}")
-        if cidade_est_out:
-            full_address_outorgante_parts.append(f"na cidade de {cidade_est_out}")
-        if cep_out:
-             full_address_outorgante_parts.append(f"CEP {cep_out}")
+# --- Preparação dos dados do projeto (usada pela rota web e pelo gerador em lote) ---
+TITULOS_FOTOS_PDF = {
+    'foto_disjuntor': 'Foto do Disjuntor',
+    'foto_fachada': 'Foto da Fachada',
+    'foto_entrada_energia': 'Foto da Entrada de Energia'
+}
 
-        all_input_data['ENDERECO_COMPLETO_OUTORGANTE'] = ", ".join(filter(None, full_address_outorgante_parts))
+def preparar_dados_projeto(all_input_data):
+    # Completa all_input_data (no próprio dict) com os valores calculados e derivados usados nos documentos
+    calculated_values = calculate_system_variables(all_input_data)
+    all_input_data.update(calculated_values)
 
-        cidade_estado_data_str = f"{format_value_for_display(all_input_data.get('Cidade', '')).upper()} – {format_value_for_display(all_input_data.get('Estado', '')).upper()}, {get_formatted_value_for_doc('DATA_ATUAL', all_input_data)}"
-        all_input_data['CIDADE_ESTADO_DATA_ASSINATURA'] = cidade_estado_data_str
+    bairro = all_input_data.get('Bairro', '').strip()
+    cidade = all_input_data.get('Cidade', '').strip()
+    if bairro and cidade:
+        all_input_data['BAIRRO_CIDADE_COMBINADO'] = f"{bairro} - {cidade}"
+    elif bairro:
+        all_input_data['BAIRRO_CIDADE_COMBINADO'] = bairro
+    elif cidade:
+        all_input_data['BAIRRO_CIDADE_COMBINADO'] = cidade
+    else:
+        all_input_data['BAIRRO_CIDADE_COMBINADO'] = ''
 
-        temp_procuracao_filename_unique = f"procuracao_preenchida_{uuid.uuid4().hex}.docx"
-        temp_procuracao_filepath = os.path.join(temp_zip_dir, temp_procuracao_filename_unique)
+    cidade_val = all_input_data.get('Cidade', '').strip()
+    estado = all_input_data.get('Estado', '').strip()
+    if cidade_val and estado:
+        all_input_data['CIDADE_ESTADO'] = f"{cidade_val} - {estado}"
+    elif cidade_val:
+        all_input_data['CIDADE_ESTADO'] = cidade_val
+    elif estado:
+        all_input_data['CIDADE_ESTADO'] = estado
+    else:
+        all_input_data['CIDADE_ESTADO'] = ''
 
-        try:
-            docx_replacements_procuracao = {
-                'NOME_RAZAO_SOCIAL': get_formatted_value_for_doc('Nome_Razao_Social', all_input_data),
-                'CPF_CNPJ': get_formatted_value_for_doc('CNPJ_CPF', all_input_data),
-                'ENDERECO_RUA_NUMERO': get_formatted_value_for_doc('Endereco_Rua_Numero', all_input_data),
-                'BAIRRO': get_formatted_value_for_doc('Bairro', all_input_data),
-                'CIDADE': get_formatted_value_for_doc('Cidade', all_input_data),
-                'ESTADO': get_formatted_value_for_doc('Estado', all_input_data),
-                'UC': get_formatted_value_for_doc('UC', all_input_data),
-                'DATA_ATUAL': get_formatted_value_for_doc('DATA_ATUAL', all_input_data),
-                'ENDERECO_COMPLETO_OUTORGANTE': get_formatted_value_for_doc('ENDERECO_COMPLETO_OUTORGANTE', all_input_data),
-                'CIDADE_ESTADO_DATA_ASSINATURA': get_formatted_value_for_doc('CIDADE_ESTADO_DATA_ASSINATURA', all_input_data),
-            }
-
-            doc_procuracao_preenchida = replace_docx_placeholders(current_procuracao_template_path, docx_replacements_procuracao)
-            doc_procuracao_preenchida.save(temp_procuracao_filepath)
-            session['temp_files_to_zip'].append({'path': temp_procuracao_filepath, 'zip_filename': '12. Procuração - PREENCHIDO.docx'})
+    endereco_rua_numero = all_input_data.get('Endereco_Rua_Numero', '').strip()
+    bairro_val = all_input_data.get('Bairro', '').strip()
+    if endereco_rua_numero and bairro_val:
+        all_input_data['Endereco_Rua_Numero_Bairro'] = f"{endereco_rua_numero} - {bairro_val}"
+    elif endereco_rua_numero:
+        all_input_data['Endereco_Rua_Numero_Bairro'] = endereco_rua_numero
+    elif bairro_val:
+        all_input_data['Endereco_Rua_Numero_Bairro'] = bairro_val
+    else:
+        all_input_data['Endereco_Rua_Numero_Bairro'] = ''
 
-        except FileNotFoundError:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_procuracao_template_nao_encontrado_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Procuração: Template '{PROCURACAO_TEMPLATE_FILENAME}' não encontrado.")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '12. Procuração - ERRO (Template não encontrado).txt'})
-        except Exception as e:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_procuracao_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Procuração: {e}")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '12. Procuração - ERRO.txt'})
+    try:
+        lat_dec = float(str(all_input_data.get('LATITUDE', '0')).replace(',', '.'))
+        lon_dec = float(str(all_input_data.get('LONGITUDE', '0')).replace(',', '.'))
+        all_input_data['LATITUDE_GMS'] = decimal_to_dms(lat_dec, is_latitude=True)
+        all_input_data['LONGITUDE_GMS'] = decimal_to_dms(lon_dec, is_latitude=False)
+    except (ValueError, TypeError):
+        all_input_data['LATITUDE_GMS'] = 'N/A'
+        all_input_data['LONGITUDE_GMS'] = 'N/A'
 
-        temp_termo_aceite_inciso_iii_filename_unique = f"termo_aceite_inciso_iii_preenchido_{uuid.uuid4().hex}.docx"
-        temp_termo_aceite_inciso_iii_filepath = os.path.join(temp_zip_dir, temp_termo_aceite_inciso_iii_filename_unique)
+    data_hoje = datetime.now()
+    all_input_data['DATA_ATUAL'] = data_hoje.strftime('%d/%m/%Y')
+    
+    if all_input_data.get('DATA_ART') == 'Não informado' or not all_input_data.get('DATA_ART'):
+        all_input_data['DATA_ART'] = all_input_data['DATA_ATUAL']
 
-        try:
-            docx_replacements_termo_aceite_inciso_iii = {
-                'NOME_RAZAO_SOCIAL': get_formatted_value_for_doc('Nome_Razao_Social', all_input_data),
-                'CPF_CNPJ': get_formatted_value_for_doc('CNPJ_CPF', all_input_data),
-                'UC': get_formatted_value_for_doc('UC', all_input_data),
-                'DATA_ATUAL': get_formatted_value_for_doc('DATA_ATUAL', all_input_data),
-            }
+    data_operacao_prevista = data_hoje + timedelta(days=90)
+    all_input_data['DATA_OPERACAO_PREVISTA'] = data_operacao_prevista.strftime('%d/%m/%Y')
 
-            doc_termo_aceite_inciso_iii_preenchido = replace_docx_placeholders(current_termo_aceite_inciso_iii_template_path, docx_replacements_termo_aceite_inciso_iii)
-            doc_termo_aceite_inciso_iii_preenchido.save(temp_termo_aceite_inciso_iii_filepath)
-            session['temp_files_to_zip'].append({'path': temp_termo_aceite_inciso_iii_filepath, 'zip_filename': '13. Termo de Aceite Inciso III - PREENCHIDO.docx'})
+    try:
+        potencia_wp_str = str(all_input_data.get('POTENCIA_MODULO_MANUAL', '0')).replace('Wp', '').strip().replace(',', '.')
+        potencia_wp = float(potencia_wp_str)
+        all_input_data['POTENCIA_MODULO_MANUAL_KWP'] = potencia_wp / 1000
+    except ValueError:
+        all_input_data['POTENCIA_MODULO_MANUAL_KWP'] = 'Não informado'
 
-        except FileNotFoundError:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_termo_aceite_inciso_iii_template_nao_encontrado_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Termo de Aceite Inciso III: Template '{TERMO_ACEITE_INCISO_III_TEMPLATE_FILENAME}' não encontrado.")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '13. Termo de Aceite Inciso III - ERRO (Template não encontrado).txt'})
-        except Exception as e:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_termo_aceite_inciso_iii_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Termo de Aceite Inciso III: {e}")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '13. Termo de Aceite Inciso III - ERRO.txt'})
-        
-        temp_responsabilidade_tecnica_filename_unique = f"responsabilidade_tecnica_preenchido_{uuid.uuid4().hex}.docx"
-        temp_responsabilidade_tecnica_filepath = os.path.join(temp_zip_dir, temp_responsabilidade_tecnica_filename_unique)
+def nome_pasta_projeto(all_input_data):
+    nome_razao_social_clean = re.sub(r'[\/:*?"<>|]', '', all_input_data.get('Nome_Razao_Social', 'Cliente')).strip()
+    if not nome_razao_social_clean:
+        nome_razao_social_clean = 'Cliente'
+    return nome_razao_social_clean
 
-        try:
-            docx_replacements_responsabilidade_tecnica = {
-                'POTENCIA_TOTAL_SISTEMA_KWP': get_formatted_value_for_doc('POTENCIA_TOTAL_SISTEMA_KWP', all_input_data),
-                'Tensao_Nominal_V': get_formatted_value_for_doc('Tensao_Nominal_V', all_input_data),
-                'NUMERO_FASES_CALCULADO': get_formatted_value_for_doc('NUMERO_FASES_CALCULADO', all_input_data),
-                'UC': get_formatted_value_for_doc('UC', all_input_data),
-                'NOME_RAZAO_SOCIAL': get_formatted_value_for_doc('Nome_Razao_Social', all_input_data),
-                'ENDERECO_RUA_NUMERO': get_formatted_value_for_doc('Endereco_Rua_Numero', all_input_data),
-                'BAIRRO': get_formatted_value_for_doc('Bairro', all_input_data),
-                'CIDADE': get_formatted_value_for_doc('Cidade', all_input_data),
-                'ESTADO': get_formatted_value_for_doc('Estado', all_input_data),
-                'ART': get_formatted_value_for_doc('ART', all_input_data),
-                'MODELO_INVERSOR_CALCULADO': get_formatted_value_for_doc('MODELO_INVERSOR_CALCULADO', all_input_data),
-                'POTENCIA_INVERSOR_MANUAL': get_formatted_value_for_doc('POTENCIA_INVERSOR_MANUAL', all_input_data),
-                'DATA_ATUAL': get_formatted_value_for_doc('DATA_ATUAL', all_input_data),
-                'INMETRO': get_formatted_value_for_doc('INMETRO', all_input_data),
-            }
-
-            doc_responsabilidade_tecnica_preenchido = replace_docx_placeholders(current_responsabilidade_tecnica_template_path, docx_replacements_responsabilidade_tecnica)
-            doc_responsabilidade_tecnica_preenchido.save(temp_responsabilidade_tecnica_filepath)
-            session['temp_files_to_zip'].append({'path': temp_responsabilidade_tecnica_filepath, 'zip_filename': '14. Responsabilidade Tecnica - PREENCHIDO.docx'})
 
-        except FileNotFoundError:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_responsabilidade_tecnica_template_nao_encontrado_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Responsabilidade Tecnica: Template '{RESPONSABILIDADE_TECNICA_TEMPLATE_FILENAME}' não encontrado.")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '14. Responsabilidade Tecnica - ERRO (Template não encontrado).txt'})
-        except Exception as e:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_responsabilidade_tecnica_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Responsabilidade Tecnica: {e}")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '14. Responsabilidade Tecnica - ERRO.txt'})
+@app.route('/process_and_save', methods=['POST'])
+def process_and_save():
+    all_input_data = session.pop('current_process_data_form_data', None)
+    if all_input_data is None:
+        job = obter_job(session.pop('current_process_data_job_id', None))
+        all_input_data = job['dados'] if job else {}
+    if not all_input_data:
+        return render_template('index.html', error='Dados da sessão expirados ou não encontrados. Por favor, reinicie o processo.'), 400
 
-        temp_dados_gd_ufv_filename_unique = f"dados_gd_ufv_preenchido_{uuid.uuid4().hex}.docx"
-        temp_dados_gd_ufv_filepath = os.path.join(temp_zip_dir, temp_dados_gd_ufv_filename_unique)
+    distributor_type = request.form.get('distributor_type', all_input_data.get('distributor_type', 'RGE'))
+    all_input_data['distributor_type'] = distributor_type
 
-        try:
-            docx_replacements_dados_gd_ufv = {
-                'Classe_Tarifaria': get_formatted_value_for_doc('Classe_Tarifaria', all_input_data),
-                'Grupo_Tarifario': get_formatted_value_for_doc('Grupo_Tarifario', all_input_data),
-                'Cidade': get_formatted_value_for_doc('Cidade', all_input_data),
-                'Estado': get_formatted_value_for_doc('Estado', all_input_data),
-                'Endereco_Rua_Numero': get_formatted_value_for_doc('Endereco_Rua_Numero', all_input_data),
-                'Bairro': get_formatted_value_for_doc('Bairro', all_input_data),
-                'CEP': get_formatted_value_for_doc('CEP', all_input_data),
-                'LATITUDE_GMS': get_formatted_value_for_doc('LATITUDE_GMS', all_input_data),
-                'LONGITUDE_GMS': get_formatted_value_for_doc('LONGITUDE_GMS', all_input_data),
-                'CNPJ_CPF': get_formatted_value_for_doc('CNPJ_CPF', all_input_data),
-                'Nome_Razao_Social': get_formatted_value_for_doc('Nome_Razao_Social', all_input_data),
-                'TELEFONE': get_formatted_value_for_doc('TELEFONE', all_input_data),
-                'E-MAIL': get_formatted_value_for_doc('E-MAIL', all_input_data),
-                'POTENCIA_TOTAL_SISTEMA_KWP': get_formatted_value_for_doc('POTENCIA_TOTAL_SISTEMA_KWP', all_input_data),
-                'QUANTIDADE_PLACAS_MANUAL': get_formatted_value_for_doc('QUANTIDADE_PLACAS_MANUAL', all_input_data),
-                'FABRICANTE_MODULO_MANUAL': get_formatted_value_for_doc('FABRICANTE_MODULO_MANUAL', all_input_data),
-                'MODELO_MODULO_CALCULADO': get_formatted_value_for_doc('MODELO_MODULO_CALCULADO', all_input_data),
-                'POTENCIA_INVERSOR_MANUAL': get_formatted_value_for_doc('POTENCIA_INVERSOR_MANUAL', all_input_data),
-                'QUANTIDADE_INVERSOR_MANUAL': get_formatted_value_for_doc('QUANTIDADE_INVERSOR_MANUAL', all_input_data),
-                'FABRICANTE_INVERSOR_MANUAL': get_formatted_value_for_doc('FABRICANTE_INVERSOR_MANUAL', all_input_data),
-                'MODELO_INVERSOR_CALCULADO': get_formatted_value_for_doc('MODELO_INVERSOR_CALCULADO', all_input_data),
-                'AREA': get_formatted_value_for_doc('AREA_ARRANJOS_CALCULADO', all_input_data),
-                'DATA_OPERACAO_PREVISTA': get_formatted_value_for_doc('DATA_OPERACAO_PREVISTA', all_input_data),
-                'POTENCIA_PICO_MODULOS': get_formatted_value_for_doc('POTENCIA_PICO_MODULOS', all_input_data),
-                'POTENCIA_MODULO_MANUAL_KWP': get_formatted_value_for_doc('POTENCIA_MODULO_MANUAL_KWP', all_input_data),
-            }
-
-            doc_dados_gd_ufv_preenchido = replace_docx_placeholders(current_dados_gd_ufv_template_path, docx_replacements_dados_gd_ufv)
-            doc_dados_gd_ufv_preenchido.save(temp_dados_gd_ufv_filepath)
-            session['temp_files_to_zip'].append({'path': temp_dados_gd_ufv_filepath, 'zip_filename': '15. Dados para GD de UFV - PREENCHIDO.docx'})
+    for key, value in request.form.items():
+        if key.startswith('extracted_'):
+            processed_value = value.strip() if isinstance(value, str) else value
+            original_key = key[len('extracted_'):]
+            if original_key == 'Tensao_Nominal_V' and processed_value and processed_value.isdigit():
+                all_input_data[original_key] = int(processed_value)
+            else:
+                all_input_data[original_key] = processed_value
+        else:
+            all_input_data[key] = converter_valor_formulario(key, value)
+    
+    preparar_dados_projeto(all_input_data)
 
-        except FileNotFoundError:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_dados_gd_ufv_template_nao_encontrado_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Dados para GD de UFV: Template '{DADOS_GD_UFV_TEMPLATE_FILENAME}' não encontrado.")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '15. Dados para GD de UFV - ERRO (Template não encontrado).txt'})
-        except Exception as e:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_dados_gd_ufv_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Dados para GD de UFV: {e}")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '15. Dados para GD de UFV - ERRO.txt'})
+    temp_zip_dir = criar_pasta_job()
+    nome_razao_social_clean = nome_pasta_projeto(all_input_data)
 
-        temp_memorial_descritivo_filename_unique = f"memorial_descritivo_preenchido_{uuid.uuid4().hex}.docx"
-        temp_memorial_descritivo_filepath = os.path.join(temp_zip_dir, temp_memorial_descritivo_filename_unique)
+    image_files = {
+        'foto_disjuntor': request.files.get('foto_disjuntor'),
+        'foto_fachada': request.files.get('foto_fachada'),
+        'foto_entrada_energia': request.files.get('foto_entrada_energia')
+    }
 
-        try:
-            docx_replacements_memorial_descritivo = {
-                'Nome_Razao_Social': get_formatted_value_for_doc('Nome_Razao_Social', all_input_data),
-                'UC': get_formatted_value_for_doc('UC', all_input_data),
-                'Endereco_Rua_Numero': get_formatted_value_for_doc('Endereco_Rua_Numero', all_input_data),
-                'Bairro': get_formatted_value_for_doc('Bairro', all_input_data),
-                'Cidade': get_formatted_value_for_doc('Cidade', all_input_data),
-                'Estado': get_formatted_value_for_doc('Estado', all_input_data),
-                'LATITUDE_GMS': get_formatted_value_for_doc('LATITUDE_GMS', all_input_data),
-                'LONGITUDE_GMS': get_formatted_value_for_doc('LONGITUDE_GMS', all_input_data),
-                'ART': get_formatted_value_for_doc('ART', all_input_data),
-                'QUANTIDADE_PLACAS_MANUAL': get_formatted_value_for_doc('QUANTIDADE_PLACAS_MANUAL', all_input_data),
-                'FABRICANTE_MODULO_MANUAL': get_formatted_value_for_doc('FABRICANTE_MODULO_MANUAL', all_input_data),
-                'MODELO_MODULO_CALCULADO': get_formatted_value_for_doc('MODELO_MODULO_CALCULADO', all_input_data),
-                'POTENCIA_TOTAL_SISTEMA_KWP': get_formatted_value_for_doc('POTENCIA_TOTAL_SISTEMA_KWP', all_input_data),
-                'QUANTIDADE_INVERSOR_MANUAL': get_formatted_value_for_doc('QUANTIDADE_INVERSOR_MANUAL', all_input_data),
-                'FABRICANTE_INVERSOR_MANUAL': get_formatted_value_for_doc('FABRICANTE_INVERSOR_MANUAL', all_input_data),
-                'MODELO_INVERSOR_CALCULADO': get_formatted_value_for_doc('MODELO_INVERSOR_CALCULADO', all_input_data),
-                'POTENCIA_INVERSOR_MANUAL': get_formatted_value_for_doc('POTENCIA_INVERSOR_MANUAL', all_input_data),
-                'DISJUNTOR_CA': get_formatted_value_for_doc('DISJUNTOR_CA', all_input_data),
-                'DISJ_CA_INTR': get_formatted_value_for_doc('DISJ_CA_INTR', all_input_data),
-                'DISJ_CA_TENS': get_formatted_value_for_doc('DISJ_CA_TENS', all_input_data),
-                'DISJ_CA_ATEN': get_formatted_value_for_doc('DISJ_CA_ATEN', all_input_data),
-                'ISOLACAO_CA': get_formatted_value_for_doc('ISOLACAO_CA', all_input_data),
-                'CABO_CA': get_formatted_value_for_doc('CABO_CA', all_input_data),
-                'DATA_ATUAL': get_formatted_value_for_doc('DATA_ATUAL', all_input_data),
-                'POTENCIA_PICO_MODULOS': get_formatted_value_for_doc('POTENCIA_PICO_MODULOS', all_input_data),
-                'POTENCIA_MODULO_MANUAL_KWP': get_formatted_value_for_doc('POTENCIA_MODULO_MANUAL_KWP', all_input_data),
-            }
-
-            doc_memorial_descritivo_preenchido = replace_docx_placeholders(current_memorial_descritivo_template_path, docx_replacements_memorial_descritivo)
-            doc_memorial_descritivo_preenchido.save(temp_memorial_descritivo_filepath)
-            session['temp_files_to_zip'].append({'path': temp_memorial_descritivo_filepath, 'zip_filename': '16. Memorial Descritivo Padrão Fecoergs - PREENCHIDO.docx'})
+    image_data_for_pdf = []
 
-        except FileNotFoundError:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_memorial_descritivo_template_nao_encontrado_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Memorial Descritivo: Template '{MEMORIAL_DESCRITIVO_TEMPLATE_FILENAME}' não encontrado.")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '16. Memorial Descritivo - ERRO (Template não encontrado).txt'})
-        except Exception as e:
-            temp_error_txt_filepath = os.path.join(temp_zip_dir, f"erro_memorial_descritivo_{uuid.uuid4().hex}.txt")
-            with open(temp_error_txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Erro ao gerar Memorial Descritivo: {e}")
-            session['temp_files_to_zip'].append({'path': temp_error_txt_filepath, 'zip_filename': '16. Memorial Descritivo - ERRO.txt'})
-
-        empty_txt_files_cooperluz_specific = {
-            'Diagrama Unifilar indicando desde o ponto de conexão com a Cooperluz.txt': 'Conteúdo de placeholder para Diagrama Unifilar.',
-            'Planta de Localizacao e Situacao.txt': 'Conteúdo de placeholder para Planta de Localização e Situação.',
-            'Diagrama Multifilar indicando desde o ponto de conexão com a Cooperluz.txt': 'Conteúdo de placeholder para Diagrama Multifilar.',
-        }
-        for zip_name, content in empty_txt_files_cooperluz_specific.items():
-            temp_empty_filepath = os.path.join(temp_zip_dir, f"empty_placeholder_{uuid.uuid4().hex}.txt")
-            with open(temp_empty_filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
-            session['temp_files_to_zip'].append({'path': temp_empty_filepath, 'zip_filename': zip_name})
+    # As fotos vão em memória para o PIL (a geração pode rodar depois que a requisição terminar);
+    # antes eram gravadas pelo nome do arquivo e duas fotos "foto.jpg" se sobrescreviam
+    for key, file_obj in image_files.items():
+        if file_obj and file_obj.filename != '' and allowed_file(file_obj.filename, ALLOWED_IMAGE_EXTENSIONS):
+            image_data_for_pdf.append({'conteudo': file_obj.read(), 'nome': secure_filename(file_obj.filename), 'title': TITULOS_FOTOS_PDF[key]})
 
-    session['temp_zip_dir'] = temp_zip_dir
-    session['all_input_data_for_correction'] = all_input_data
+    tarefas = montar_tarefas_documentos(all_input_data, distributor_type, temp_zip_dir, image_data_for_pdf)
+    job_id = criar_job(temp_zip_dir, nome_razao_social_clean, all_input_data, [nome for nome, _ in tarefas])
+    session['job_id'] = job_id
 
-    final_zip_filename_unique = f"Projeto de {nome_razao_social_clean}_{uuid.uuid4().hex}.zip"
+    if PROJECT_ASYNC_MODE:
+        _get_project_executor().submit(_executar_job_projeto_em_segundo_plano, job_id, tarefas, temp_zip_dir)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(_status_job_json(obter_job(job_id))), 202
+    else:
+        try:
+            executar_job_projeto(job_id, tarefas, temp_zip_dir)
+        except ErroGeracaoDocumento as e:
+            session.pop('job_id', None)
+            return render_template('index.html', error=str(e))
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(_status_job_json(obter_job(job_id)))
 
     lat_val = all_input_data.get('LATITUDE')
     lon_val = all_input_data.get('LONGITUDE')
@@ -1823,52 +3391,127 @@ def process_and_save():
         'Disjuntor CA': format_value_for_display(all_input_data.get('DISJUNTOR_CA')),
     }
 
+    job = obter_job(job_id)
+    if job['status'] == JOB_STATUS_CONCLUIDO:
+        message = "Todos os documentos foram processados e estão prontos para download em um único arquivo ZIP!"
+    elif job['status'] == JOB_STATUS_ERRO:
+        message = "Não foi possível gerar os documentos do projeto."
+    else:
+        message = "Os documentos estão sendo gerados. O download será liberado assim que todos estiverem prontos."
+
     return render_template('success.html',
-                           message="Todos os documentos foram processados e estão prontos para download em um único arquivo ZIP!",
-                           zip_filename=final_zip_filename_unique,
+                           message=message,
+                           job=job,
+                           job_id=job_id,
                            distributor_type=distributor_type,
                            dados_cliente=dados_cliente_for_display,
                            dados_entrada=dados_entrada_for_display,
                            dados_sistema_fv=dados_sistema_fv_for_display)
 
 
-@app.route('/download_zip/<zip_filename>', methods=['GET'])
-def download_zip(zip_filename):
-    files_to_zip_info = session.pop('temp_files_to_zip', [])
-    temp_zip_dir = session.pop('temp_zip_dir', None)
-    nome_razao_social_zip_folder = session.pop('nome_razao_social_zip_folder', 'Projeto')
+# --- Download do ZIP em streaming ---
+# Formatos que já são comprimidos (ZIP internamente ou imagem/PDF) vão sem recompressão
+ZIP_EXTENSOES_SEM_COMPRESSAO = {'xlsx', 'docx', 'pdf', 'jpg', 'jpeg', 'png', 'zip'}
+ZIP_STREAM_CHUNK_SIZE = 64 * 1024
 
-    if not files_to_zip_info or not temp_zip_dir:
-        return "Erro: Arquivo ZIP não encontrado ou sessão expirada. Por favor, tente novamente.", 404
+class _BufferSaidaZip:
+    # Destino sem seek para o zipfile: ele passa a usar data descriptors e cada bloco
+    # escrito pode ser enviado ao cliente logo em seguida
+    def __init__(self):
+        self._partes = []
 
-    zip_filepath = os.path.join(tempfile.gettempdir(), zip_filename)
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
 
-    try:
-        with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for file_info in files_to_zip_info:
-                original_path = file_info['path']
-                zip_name = file_info['zip_filename']
-                zf.write(original_path, arcname=f"{nome_razao_social_zip_folder}/{zip_name}")
-
-        response = send_file(zip_filepath,
-                             mimetype='application/zip',
-                             as_attachment=True,
-                             download_name=f"Projeto de {nome_razao_social_zip_folder}.zip")
-
-        @response.call_on_close
-        def cleanup():
-            try:
-                if os.path.exists(zip_filepath):
-                    os.remove(zip_filepath)
-                if temp_zip_dir and os.path.exists(temp_zip_dir):
-                    shutil.rmtree(temp_zip_dir)
-            except Exception as e:
-                print(f"Erro durante a limpeza de arquivos temporários: {e}")
-
-        return response
+    def flush(self):
+        pass
 
-    except Exception as e:
-        return f"Erro ao gerar o arquivo ZIP: {e}", 500
+    def esvaziar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+def gerar_zip_streaming(arquivos, pasta_raiz):
+    # Só o tempo gasto montando o ZIP entra na métrica, não o tempo que o cliente leva para consumir cada bloco
+    duracao = 0.0
+    inicio = time.perf_counter()
+    buffer = _BufferSaidaZip()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for file_info in arquivos:
+            zinfo = zipfile.ZipInfo.from_file(file_info['path'], arcname=f"{pasta_raiz}/{file_info['zip_filename']}")
+            extensao = file_info['zip_filename'].rsplit('.', 1)[-1].lower()
+            zinfo.compress_type = zipfile.ZIP_STORED if extensao in ZIP_EXTENSOES_SEM_COMPRESSAO else zipfile.ZIP_DEFLATED
+
+            with open(file_info['path'], 'rb') as origem, zf.open(zinfo, 'w') as destino:
+                while True:
+                    bloco = origem.read(ZIP_STREAM_CHUNK_SIZE)
+                    if not bloco:
+                        break
+                    destino.write(bloco)
+                    dados = buffer.esvaziar()
+                    if dados:
+                        duracao += time.perf_counter() - inicio
+                        yield dados
+                        inicio = time.perf_counter()
+    registrar_duracao_etapa('zip', duracao + time.perf_counter() - inicio)
+    yield buffer.esvaziar()
+
+def gravar_zip_projeto(arquivos, pasta_raiz, caminho_zip):
+    with open(caminho_zip, 'wb') as destino:
+        for bloco in gerar_zip_streaming(arquivos, pasta_raiz):
+            destino.write(bloco)
+
+def _content_disposition_anexo(download_name):
+    try:
+        download_name.encode('ascii')
+        return {'filename': download_name}
+    except UnicodeEncodeError:
+        simples = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simples, 'filename*': f"UTF-8''{quote(download_name, safe='!#$&+-.^_`|~')}"}
+
+def _status_job_json(job):
+    dados = {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'erro': job['erro'],
+        'documentos': job['documentos'],
+        'status_url': url_for('job_status', job_id=job['job_id']),
+    }
+    if job['status'] == JOB_STATUS_CONCLUIDO:
+        dados['download_url'] = url_for('download_zip', job_id=job['job_id'])
+    return dados
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = obter_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado ou expirado.'}), 404
+    return jsonify(_status_job_json(job))
+
+@app.route('/download_zip/<job_id>', methods=['GET'])
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def download_zip(job_id):
+    job = obter_job(job_id)
+    if not job:
+        return "Erro: Arquivo ZIP não encontrado ou sessão expirada. Por favor, tente novamente.", 404
+    if job['status'] == JOB_STATUS_ERRO:
+        return f"Erro ao gerar o projeto: {job['erro']}", 500
+    if job['status'] != JOB_STATUS_CONCLUIDO:
+        return "Os documentos do projeto ainda estão sendo gerados. Tente novamente em instantes.", 409
+
+    files_to_zip_info = job['arquivos']
+    nome_razao_social_zip_folder = job['nome_pasta']
+
+    arquivos_faltando = [f['zip_filename'] for f in files_to_zip_info if not os.path.exists(f['path'])]
+    if arquivos_faltando:
+        return f"Erro ao gerar o arquivo ZIP: arquivos não encontrados: {', '.join(arquivos_faltando)}", 500
+
+    response = Response(gerar_zip_streaming(files_to_zip_info, nome_razao_social_zip_folder), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment',
+                         **_content_disposition_anexo(f"Projeto de {nome_razao_social_zip_folder}.zip"))
+    # A pasta do projeto continua disponível para novos downloads até o job expirar
+    return response
 
 if __name__ == '__main__':
     if not os.path.exists(UPLOAD_FOLDER):
@@ -0,0 +1,147 @@
+import argparse
+import csv
+import os
+import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+import openpyxl
+
+import extrator_solar_web as extrator
+
+# Gera o pacote completo (o mesmo ZIP do botão "Baixar Projeto") para cada linha de uma planilha.
+# A planilha (CSV ou XLSX) tem uma linha por cliente e, no cabeçalho, os mesmos nomes de campo de
+# EXCEL_PROJETO_FV_CELL_MAPPING (Nome_Razao_Social, UC, Endereco_Rua_Numero, POTENCIA_MODULO_MANUAL, ...).
+# Colunas opcionais foto_disjuntor, foto_fachada e foto_entrada_energia recebem o caminho da foto
+# (relativo à planilha).
+#
+# Uso:
+#   python gerar_projetos_lote.py clientes.xlsx --distribuidora COOPERLUZ --saida projetos/ --workers 4
+
+
+def _valor_celula(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, date):
+        return valor.strftime('%d/%m/%Y')
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def ler_planilha(caminho, aba=None):
+    if caminho.lower().endswith('.csv'):
+        with open(caminho, 'rb') as f:
+            return extrator.ler_registros_csv(f.read())
+
+    workbook = openpyxl.load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        sheet = workbook[aba] if aba else workbook.worksheets[0]
+        linhas = sheet.iter_rows(values_only=True)
+        cabecalho = [str(c).strip() if c is not None else '' for c in next(linhas, [])]
+        registros = []
+        for linha in linhas:
+            if all(v is None or str(v).strip() == '' for v in linha):
+                continue
+            registros.append({campo: _valor_celula(valor) for campo, valor in zip(cabecalho, linha) if campo})
+        return registros
+    finally:
+        workbook.close()
+
+
+def nomes_zip_unicos(registros):
+    # Definidos antes de distribuir as linhas entre os processos: linhas repetidas (mesmo cliente e UC)
+    # ganham um sufixo em vez de uma sobrescrever o ZIP da outra
+    nomes = []
+    usados = set()
+    for registro in registros:
+        nome = extrator.nome_pasta_projeto(registro)
+        uc = re.sub(r'[\/:*?"<>|]', '', str(registro.get('UC', ''))).strip()
+        base = f"Projeto de {nome} - UC {uc}" if uc else f"Projeto de {nome}"
+        nome_zip = f"{base}.zip"
+        contador = 2
+        while nome_zip.lower() in usados:
+            nome_zip = f"{base} ({contador}).zip"
+            contador += 1
+        usados.add(nome_zip.lower())
+        nomes.append(nome_zip)
+    return nomes
+
+
+def gerar_projeto(numero_linha, registro, distributor_type, caminho_zip, pasta_planilha):
+    dados = {key: extrator.converter_valor_formulario(key, value) for key, value in registro.items()
+             if key not in extrator.TITULOS_FOTOS_PDF}
+    dados['distributor_type'] = distributor_type
+    extrator.preparar_dados_projeto(dados)
+
+    image_data_for_pdf = []
+    for coluna, titulo in extrator.TITULOS_FOTOS_PDF.items():
+        caminho_foto = (registro.get(coluna) or '').strip()
+        if caminho_foto:
+            image_data_for_pdf.append({'path': os.path.join(pasta_planilha, caminho_foto), 'title': titulo})
+
+    temp_dir = tempfile.mkdtemp(prefix=extrator.JOB_TEMP_DIR_PREFIX)
+    try:
+        tarefas = extrator.montar_tarefas_documentos(dados, distributor_type, temp_dir, image_data_for_pdf)
+        arquivos = extrator.gerar_documentos_projeto(tarefas)
+        extrator.gravar_zip_projeto(arquivos, extrator.nome_pasta_projeto(dados), caminho_zip)
+        return numero_linha, dados.get('UC', ''), dados.get('Nome_Razao_Social', ''), caminho_zip, ''
+    except extrator.ErroGeracaoDocumento as e:
+        return numero_linha, dados.get('UC', ''), dados.get('Nome_Razao_Social', ''), '', str(e)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Gera os pacotes de projeto (ZIP) para cada cliente de uma planilha CSV/XLSX.')
+    parser.add_argument('planilha', help='CSV ou XLSX com uma linha por cliente')
+    parser.add_argument('--distribuidora', required=True,
+                        choices=[distribuidora['codigo'] for distribuidora in extrator.listar_distribuidoras()])
+    parser.add_argument('--saida', required=True, help='Pasta onde os ZIPs serão gravados')
+    parser.add_argument('--aba', help='Aba do XLSX (padrão: a primeira)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Processos em paralelo')
+    args = parser.parse_args(argv)
+
+    registros = ler_planilha(args.planilha, args.aba)
+    if not registros:
+        print('Nenhum cliente encontrado na planilha.')
+        return 1
+
+    os.makedirs(args.saida, exist_ok=True)
+    pasta_planilha = os.path.dirname(os.path.abspath(args.planilha))
+
+    # Primeira linha de dados = linha 2 da planilha (a 1 é o cabeçalho)
+    resultados = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(gerar_projeto, numero_linha, registro, args.distribuidora,
+                            os.path.join(args.saida, nome_zip), pasta_planilha)
+            for numero_linha, (registro, nome_zip) in enumerate(zip(registros, nomes_zip_unicos(registros)), start=2)
+        ]
+        for future in as_completed(futures):
+            try:
+                resultado = future.result()
+            except Exception as e:
+                numero_linha = futures.index(future) + 2
+                resultado = (numero_linha, '', '', '', f"Erro inesperado: {e}")
+            resultados.append(resultado)
+            numero_linha, uc, nome, caminho_zip, erro = resultado
+            print(f"[{len(resultados)}/{len(futures)}] linha {numero_linha} UC {uc} - {erro or caminho_zip}")
+
+    resultados.sort()
+    caminho_relatorio = os.path.join(args.saida, 'relatorio_geracao.csv')
+    with open(caminho_relatorio, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['linha', 'UC', 'Nome_Razao_Social', 'zip', 'erro'])
+        writer.writerows(resultados)
+
+    total_erros = sum(1 for r in resultados if r[4])
+    print(f"{len(resultados) - total_erros} projeto(s) gerado(s), {total_erros} com erro. Relatório: {caminho_relatorio}")
+    return 1 if total_erros else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
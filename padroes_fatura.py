@@ -0,0 +1,149 @@
+import os
+import re
+import time
+import unicodedata
+
+# Padrões dos campos das faturas, pré-compilados e usados pelos extratores de layout de extrator_solar_web.
+# Regras para que o pior caso seja linear no tamanho do texto:
+#   - todo padrão começa por um literal (âncora), então só as posições da âncora iniciam uma tentativa;
+#   - nenhuma repetição depois da âncora é ilimitada: campos têm até ~200 caracteres;
+#   - o antigo "âncora.*?valor" com DOTALL virou PadraoEmSequencia: o valor é o primeiro depois da primeira
+#     âncora, como antes, sem limite de distância, mas cada parte percorre o texto uma única vez;
+#   - repetições vizinhas não disputam os mesmos caracteres (ex.: "\s*\d+\s*[A-Z0-9\s]+" virou uma classe só);
+#   - blocos de várias linhas (endereço) são montados linha a linha, com classes que não atravessam "\n".
+# benchmarks/regex_adversarial.py confere que isso continua valendo com textos adversariais.
+#
+# O texto da fatura é normalizado uma única vez (TextoFatura) e compartilhado pela classificação do layout e
+# por todos os extratores. Não há índice de rótulos: cada fatura faz só 6 a 8 buscas (~20 us no total) e
+# montar um índice numa passada custa de 10 a 17 us (str.find ou alternância) antes da primeira consulta.
+
+EXTRACTION_TIME_BUDGET_SECONDS = float(os.environ.get('EXTRACTION_TIME_BUDGET_SECONDS', 0.5))
+EXTRACTION_MAX_TEXT_CHARS = int(os.environ.get('EXTRACTION_MAX_TEXT_CHARS', 100000))
+
+# O bloco de endereço começa em até tantas linhas depois da linha do nome do cliente
+JANELA_ENDERECO_LINHAS = 10
+
+# Todo caractere de espaço (str.isspace) além de ' ' e '\n': vira ' ' na normalização
+_OUTROS_ESPACOS = ('\t', '\r', '\x0b', '\x0c', '\x1c', '\x1d', '\x1e', '\x1f', '\x85', '\xa0', '\u1680', '\u2028', '\u2029',
+                   '\u202f', '\u205f', '\u3000') + tuple(map(chr, range(0x2000, 0x200b)))
+
+class OrcamentoEsgotado(Exception):
+    pass
+
+
+def _normalizar_espacos(texto):
+    # Só replace/in (feitos em C): bem mais rápido que refazer o texto linha a linha
+    for espaco in _OUTROS_ESPACOS:
+        if espaco in texto:
+            texto = texto.replace(espaco, ' ')
+    while '  ' in texto:
+        texto = texto.replace('  ', ' ')
+    texto = texto.replace(' \n', '\n').replace('\n ', '\n')
+    while '\n\n' in texto:
+        texto = texto.replace('\n\n', '\n')
+    return texto.strip(' \n')
+
+
+class TextoFatura(str):
+    # Texto de uma fatura preparado uma vez para todos os extratores: cortado em EXTRACTION_MAX_TEXT_CHARS,
+    # em NFC (acentos decompostos viram um caractere só), com espaços repetidos reduzidos a um, sem espaços
+    # nas pontas das linhas e sem linhas em branco (o "\r\n" do pdfplumber em alguns PDFs vira "\n")
+    def __new__(cls, texto):
+        if isinstance(texto, TextoFatura):
+            return texto
+        texto = _normalizar_espacos(unicodedata.normalize('NFC', (texto or '')[:EXTRACTION_MAX_TEXT_CHARS]))
+        return super().__new__(cls, texto)
+
+    def fim_linhas(self, pos, quantidade):
+        # Posição do fim da quantidade-ésima linha depois da linha de pos
+        fim = self.find('\n', pos)
+        for _ in range(quantidade):
+            if fim < 0:
+                break
+            fim = self.find('\n', fim + 1)
+        return len(self) if fim < 0 else fim
+
+
+class BuscaFatura:
+    # Texto preparado de uma extração + o prazo dela: cada busca confere o prazo antes de rodar
+    def __init__(self, texto, orcamento_segundos=None):
+        self.texto = TextoFatura(texto)
+        self.orcamento_segundos = EXTRACTION_TIME_BUDGET_SECONDS if orcamento_segundos is None else orcamento_segundos
+        self.prazo = time.perf_counter() + self.orcamento_segundos
+
+    def search(self, padrao, pos=0, endpos=None):
+        if time.perf_counter() > self.prazo:
+            raise OrcamentoEsgotado(f"Tempo da extração esgotado ({self.orcamento_segundos} s).")
+        return padrao.search(self.texto, pos, len(self.texto) if endpos is None else endpos)
+
+
+class PadraoEmSequencia:
+    # Equivale a re.compile(a + '.*?' + b, re.DOTALL), mas cada parte é buscada uma única vez a partir do
+    # fim da anterior (tempo linear). Devolve o match da última parte.
+    def __init__(self, *padroes):
+        self.padroes = padroes
+
+    def search(self, texto, pos=0, endpos=None):
+        endpos = len(texto) if endpos is None else endpos
+        match = None
+        for padrao in self.padroes:
+            match = padrao.search(texto, pos, endpos)
+            if match is None:
+                return None
+            pos = match.end()
+        return match
+
+
+# --- Campos comuns ---
+GRUPO_TARIFARIO = re.compile(r'(B[1-4]|A)')
+CLASSE_TARIFARIA = re.compile(r'(Residencial|Comercial|Industrial|Rural|Poder Público|Iluminação Pública)', re.IGNORECASE)
+CNPJ = re.compile(r'CNPJ:\s*(\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2})')
+
+# --- RGE ---
+TENSAO_NOMINAL_RGE = re.compile(r'TENSÃO NOMINAL EM VOLTS\s*Disp\.:\s*(\d{1,6})')
+CLASSIFICACAO_RGE = re.compile(r'Classificaç(?:ão|ao):\s*([^\n]+)', re.IGNORECASE)
+NOME_CABECALHO_CNPJ_RGE = re.compile(r'Inscrição no CNPJ: \d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}\n+([A-Z\s,.]{1,200})\n')
+NOME_ARCINDO = re.compile(r'CÓDIGO DA UNIDADE CONSUMIDORA:\s*\d{1,20}\n([A-Z\s]{1,200})\n')
+CPF_RGE = re.compile(r'CPF:\s*(\d{3}\.\d{3}\.\d{3}-\d{2})')
+CPF_MASCARADO_RGE = re.compile(r'CPF:\s*(\*{0,6}\.\d{3}-\*{0,2})')
+UC_RGE = re.compile(r'UC:\s*(\d{10})')
+UC_LIMITE_MAXIMO_RGE = re.compile(r'Lim.\s*máx.:\s*\d{1,12}\s*(\d{10})')
+UC_ARCINDO = re.compile(r'CÓDIGO DA UNIDADE CONSUMIDORA:\s*(\d{10})')
+UC_ARCINDO_PAGINA = re.compile(r'(\d{10})\n1/2')
+
+# Rua e número numa linha, bairro na seguinte e "CEP cidade RS" na terceira
+_RUA_NUMERO = r'((?:R|AV|EST|ROD|AL|TV|PR|TR|VD|RUA|VL|PRC|PCA)[ \t]+[A-Z \t,.-]{1,120}\d{1,10}[A-Z0-9 \t,.-]{0,120})\n'
+_BAIRRO = r'([A-Z \t,.-]{1,120})\n'
+ENDERECO_RGE = re.compile(_RUA_NUMERO + _BAIRRO + r'(\d{5}-\d{3})[ \t]+([A-Z \t,.-]{1,120})[ \t]+(RS)')
+ENDERECO_ARCINDO = re.compile(_RUA_NUMERO + _BAIRRO + r'(\d{5}-\d{3})[ \t]+([A-Z \t,.-]{1,120})[ \t]*-[ \t]*(RS)')
+
+ASSINATURA_RGE_ADRIANO = PadraoEmSequencia(NOME_CABECALHO_CNPJ_RGE, re.compile(r'Pelo CPF:\s*\d{3}\.\d{3}\.\d{3}-\d{2}'))
+ASSINATURA_RGE_ADROALDO = PadraoEmSequencia(NOME_CABECALHO_CNPJ_RGE, CPF_MASCARADO_RGE)
+
+# --- Cooperluz e cooperativas com a mesma diagramação ---
+FASE = re.compile(r'(Monofásico|Bifásico|Trifásico)', re.IGNORECASE)
+TIPO_FORNECIMENTO = PadraoEmSequencia(re.compile(r'Tipo de Fornecimento:', re.IGNORECASE), FASE)
+CLASSIFICACAO_COOP = re.compile(r'Classificaç(?:ão|ao):\s*([^\n]*)', re.IGNORECASE)
+NOME_COOPERLUZ_COM_COD_UA = re.compile(
+    r'(?:Monofásico|Bifásico|Trifásico)\n+([A-Z\s,.-]{1,200})\n+(?:Leitura anterior|DATAS DE|COD UA)', re.IGNORECASE)
+NOME_COOPERLUZ_SEM_COD_UA = re.compile(r'(?:Monofásico|Bifásico|Trifásico)\n+([A-Z\s,.-]{1,200})\n+Leitura anterior', re.IGNORECASE)
+NOME_COOP_SIMILAR = re.compile(
+    r'(?:Monofásico|Bifásico|Trifásico)\n+([A-Z\s,.-]{1,200})\n+(?:Leitura anterior|DATAS DE)', re.IGNORECASE)
+ENDERECO_COOP = re.compile(r'Proxima Leitura\n+([^\n]{1,200}) DATAS DE')
+_CIDADE = r'([A-Za-zÀ-ÖØ-öø-ÿ\s,.-]{1,100})'
+# Linha "INTERIOR / CIDADE-UF" (ou "RURAL / ..."): no texto preparado as linhas não começam com espaço
+# nem há linhas em branco, então "\n" equivale ao "\n\s*" original
+_LINHA_INTERIOR = re.compile(r'\n(INTERIOR / ' + _CIDADE + r')-([A-Z]{2})')
+_LINHA_RURAL_OU_INTERIOR = re.compile(r'\n(RURAL|INTERIOR)\s*/\s*' + _CIDADE + r'-([A-Z]{2})')
+INTERIOR_COOPERLUZ_COM_COD_UA = PadraoEmSequencia(re.compile(r'COD UA \d{1,20} LEITURAS'), _LINHA_INTERIOR)
+INTERIOR_COOPERLUZ_SEM_COD_UA = PadraoEmSequencia(re.compile(r'LEITURAS'), _LINHA_INTERIOR)
+INTERIOR_COOP_SIMILAR = PadraoEmSequencia(re.compile(r'LEITURAS|UNIDADE CONSUMIDORA'), _LINHA_RURAL_OU_INTERIOR)
+CPF_CNPJ_COOP = re.compile(r'CPF/CNPJ:\s*([\d*]{3}\.[\d*]{3}\.[\d*]{3}-\d{2}|\d{2}\.[\d*]{3}\.[\d*]{3}/\d{4}-\d{2})')
+CEP_COOP = re.compile(r'CEP:\s*(\d{2}\s*\d{3}-\d{3})')
+UC_APOS_CEP_COOPERLUZ = re.compile(r'CEP:\s*\d{2}\s*\d{3}-\d{3}\s*([\d-]{1,30})')
+UC_ROTA_COOPERLUZ = re.compile(r'UNIDADE CONSUMIDORA\n+Rota:\s*\d{1,10},\s*Sequência:\s*\d{1,10}\s*([\d-]{1,30})')
+UC_EXPLICITA_COOP = re.compile(r'UC:\s*(\d{1,30})[- ]')
+UC_ROTA_COOP = re.compile(r'UNIDADE CONSUMIDORA\n+Rota:\s*\d{1,10},\s*Sequência:\s*\d{1,10}\s*(\d{1,30})')
+UC_CODIGO_CLIENTE_COOP = re.compile(r'CÓDIGO DO CLIENTE\n*(\d{1,30})')
+
+ASSINATURA_COOPERLUZ_COD_UA = re.compile(r'COD UA \d+')